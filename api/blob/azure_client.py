@@ -1,14 +1,18 @@
 from typing import Optional
 
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceModifiedError, ResourceNotFoundError
 from azure.storage.blob import BlobProperties
 from azure.storage.blob.aio import BlobClient, ContainerClient
+from blob.block_cache import block_cache
+from blob.properties_cache import properties_cache
+from blob.storage_client import BlobStorageClient
 from database.models import Metadata
-from helpers.urlmapping import ApiType, get_file_name
-from pydantic import SecretStr
-from rf.spectrogram import get_spectrogram_image
+from helpers.concurrency import download_limiter
+from helpers.conversions import find_smallest_and_largest_next_to_each_other
 
 
-class AzureBlobClient:
+class AzureBlobClient(BlobStorageClient):
     """
     AzureBlobClient is a wrapper around the Azure BlobClient class.
 
@@ -21,18 +25,8 @@ class AzureBlobClient:
         The Azure container name.
     """
 
-    account: str
-    container: str
-    sas_token: SecretStr = None
     clients: dict[str, BlobClient] = {}
 
-    def __init__(self, account, container):
-        self.account = account
-        self.container = container
-
-    def set_sas_token(self, sas_token):
-        self.sas_token = sas_token
-
     def get_blob_client(self, filepath):
         if filepath in self.clients:
             return self.clients[filepath]
@@ -57,18 +51,131 @@ class AzureBlobClient:
             credential=self.sas_token.get_secret_value(),
         )
 
+    def get_properties_key(self, filepath: str):
+        return (self.account, self.container, filepath)
+
     async def get_blob_properties(self, filepath) -> BlobProperties:
-        blob_client = self.get_blob_client(filepath)
-        return await blob_client.get_blob_properties()
+        key = self.get_properties_key(filepath)
+        properties = properties_cache.get(key)
+        if properties is None:
+            blob_client = self.get_blob_client(filepath)
+            properties = await blob_client.get_blob_properties()
+            properties_cache.put(key, properties)
+        return properties
 
     async def get_blob_content(
-        self, filepath: str, offset: Optional[int] = None, length: Optional[int] = None
+        self,
+        filepath: str,
+        offset: Optional[int] = None,
+        length: Optional[int] = None,
+        cached: bool = True,
+    ) -> bytes:
+        """
+        Read a blob or a byte range of it. Ranges go through the block cache
+        unless cached is False, for small reads scattered over a blob where
+        whole blocks would mostly be downloaded for nothing.
+        """
+        if offset is None or length is None or not cached or not block_cache.enabled:
+            return await self.download_blob_content(filepath, offset, length)
+        return await self.get_cached_blob_content(filepath, offset, length)
+
+    async def download_blob_content(
+        self,
+        filepath: str,
+        offset: Optional[int] = None,
+        length: Optional[int] = None,
+        **kwargs,
     ) -> bytes:
         blob_client = self.get_blob_client(filepath)
-        blob = await blob_client.download_blob(offset=offset, length=length)
+        try:
+            blob = await blob_client.download_blob(
+                offset=offset, length=length, **kwargs
+            )
+        except ResourceNotFoundError:
+            # the blob was deleted while its properties were cached
+            properties_cache.invalidate(self.get_properties_key(filepath))
+            raise
         content = await blob.readall()
         return content
 
+    async def get_cached_blob_content(
+        self, filepath: str, offset: int, length: int
+    ) -> bytes:
+        """
+        Read a byte range through the block cache. Only the blocks that are
+        not cached yet are downloaded, one ranged request per contiguous run
+        of missing blocks, conditioned on the etag the blocks are cached under.
+
+        Parameters
+        ----------
+        filepath : str
+            The blob path.
+        offset : int
+            The offset of the range in bytes.
+        length : int
+            The length of the range in bytes.
+
+        Returns
+        -------
+        bytes
+            The content of the range, truncated at the end of the blob.
+        """
+        properties = await self.get_blob_properties(filepath)
+        blob_size = int(properties.size)
+        end = min(offset + length, blob_size)
+        if offset >= end:
+            return b""
+
+        block_size = block_cache.block_size
+        first_block = offset // block_size
+        last_block = (end - 1) // block_size
+
+        def block_key(block_number):
+            return (
+                self.account,
+                self.container,
+                filepath,
+                properties.etag,
+                block_number,
+            )
+
+        blocks = {}
+        missing_blocks = []
+        for block_number in range(first_block, last_block + 1):
+            block = block_cache.get(block_key(block_number))
+            if block is None:
+                missing_blocks.append(block_number)
+            else:
+                blocks[block_number] = block
+
+        for run_start, run_end in find_smallest_and_largest_next_to_each_other(
+            missing_blocks
+        ):
+            run_offset = run_start * block_size
+            run_length = min((run_end + 1) * block_size, blob_size) - run_offset
+            try:
+                content = await self.download_blob_content(
+                    filepath,
+                    run_offset,
+                    run_length,
+                    etag=properties.etag,
+                    match_condition=MatchConditions.IfNotModified,
+                )
+            except ResourceModifiedError:
+                # The blob changed since its properties were read
+                properties_cache.invalidate(self.get_properties_key(filepath))
+                return await self.download_blob_content(filepath, offset, end - offset)
+            for block_number in range(run_start, run_end + 1):
+                start = (block_number - run_start) * block_size
+                block = content[start : start + block_size]
+                block_cache.put(block_key(block_number), block)
+                blocks[block_number] = block
+
+        parts = [blocks[n] for n in range(first_block, last_block + 1)]
+        parts[-1] = parts[-1][: end - last_block * block_size]
+        parts[0] = parts[0][offset - first_block * block_size :]
+        return b"".join(parts)
+
     async def get_blob_stream(
         self, filepath: str, offset: Optional[int] = None, length: Optional[int] = None
     ):
@@ -79,23 +186,34 @@ class AzureBlobClient:
     async def upload_blob(self, filepath: str, data: bytes):
         blob_client = self.get_blob_client(filepath)
         await blob_client.upload_blob(data, overwrite=True)
-
-    async def get_new_thumbnail(self, data_type: str, filepath: str) -> bytes:
-        iq_path = get_file_name(filepath, ApiType.IQDATA)
-        fftSize = 1024
-        content = await self.get_blob_content(iq_path, 8000, fftSize * 512)
-        image = get_spectrogram_image(content, data_type, fftSize)
-        return image
+        properties_cache.invalidate(self.get_properties_key(filepath))
 
     async def get_metadata_files(self):
         container_client = self.get_container_client()
+        batch_size = download_limiter.max_per_account
+        batch = []
         # files that enf with .sigmf-meta
         async for blob in container_client.list_blobs():
+            # the listing already carries the properties of every blob, keep
+            # them so that the caller does not need a HEAD request per file
+            properties_cache.put(self.get_properties_key(blob.name), blob)
             if blob.name.endswith(".sigmf-meta"):
-                metadata = await self.get_metadata_file(blob.name)
-                yield str(blob.name), metadata
+                batch.append(str(blob.name))
+            if len(batch) >= batch_size:
+                async for item in self.get_metadata_batch(batch):
+                    yield item
+                batch = []
+        async for item in self.get_metadata_batch(batch):
+            yield item
         return
 
+    async def get_metadata_batch(self, filepaths: list[str]):
+        metadatas = await download_limiter.gather(
+            self.account, [self.get_metadata_file(path) for path in filepaths]
+        )
+        for filepath, metadata in zip(filepaths, metadatas):
+            yield filepath, metadata
+
     async def get_metadata_file(self, filepath: str):
         blob_client = self.get_blob_client(filepath)
         blob = await blob_client.download_blob()
@@ -104,10 +222,17 @@ class AzureBlobClient:
         return metadata
 
     async def blob_exist(self, filepath):
+        """
+        Check that a blob exists in storage. The properties cache is not
+        trusted for this, it may hold a blob deleted since, and is cleared
+        of a blob found missing.
+        """
         blob_client = self.get_blob_client(filepath)
-        return await blob_client.exists()
+        exists = await blob_client.exists()
+        if not exists:
+            properties_cache.invalidate(self.get_properties_key(filepath))
+        return exists
 
     async def get_file_length(self, filepath):
-        blob_client = self.get_blob_client(filepath)
-        blob = await blob_client.get_blob_properties()
+        blob = await self.get_blob_properties(filepath)
         return int(blob.size)
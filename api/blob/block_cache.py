@@ -0,0 +1,68 @@
+import os
+
+from cachetools import LRUCache
+
+BlockKey = tuple[str, str, str, str, int]
+
+
+class BlockCache:
+    """
+    BlockCache keeps fixed size, block aligned pieces of blobs in memory so
+    that repeated and overlapping range reads can be served without going
+    back to storage. Blocks are keyed by (account, container, filepath, etag,
+    block number), so a blob that is overwritten never serves stale bytes.
+
+    Parameters
+    ----------
+    max_bytes : int
+        The memory budget for cached blocks. 0 disables the cache.
+    block_size : int
+        The size in bytes of each cached block.
+    """
+
+    def __init__(self, max_bytes: int, block_size: int):
+        self.max_bytes = max_bytes
+        self.block_size = block_size
+        self.hits = 0
+        self.misses = 0
+        self.blocks: LRUCache[BlockKey, bytes] = LRUCache(
+            maxsize=max(max_bytes, 1), getsizeof=len
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0 and self.block_size > 0
+
+    def get(self, key: BlockKey) -> bytes | None:
+        block = self.blocks.get(key)
+        if block is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return block
+
+    def put(self, key: BlockKey, block: bytes):
+        if len(block) > self.max_bytes:
+            return
+        self.blocks[key] = block
+
+    def clear(self):
+        self.blocks.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "blocks": len(self.blocks),
+            "bytes": self.blocks.currsize,
+            "max_bytes": self.max_bytes,
+            "block_size": self.block_size,
+        }
+
+
+block_cache = BlockCache(
+    max_bytes=int(os.getenv("IQENGINE_BLOCK_CACHE_SIZE", 256 * 1024 * 1024)),
+    block_size=int(os.getenv("IQENGINE_BLOCK_CACHE_BLOCK_SIZE", 1024 * 1024)),
+)
@@ -0,0 +1,29 @@
+import os
+
+from blob.azure_client import AzureBlobClient
+from blob.local_client import LocalBlobClient
+from blob.storage_client import BlobStorageClient
+
+
+def get_storage_client(account: str, container: str) -> BlobStorageClient:
+    """
+    Get the storage client for a datasource. When IQENGINE_LOCAL_STORAGE_ROOT
+    is set the blobs are served from <root>/<account>/<container> on the local
+    filesystem, otherwise they are read from Azure Blob Storage.
+
+    Parameters
+    ----------
+    account : str
+        The account name.
+    container : str
+        The container name.
+
+    Returns
+    -------
+    BlobStorageClient
+        The storage client.
+    """
+    local_storage_root = os.getenv("IQENGINE_LOCAL_STORAGE_ROOT", None)
+    if local_storage_root:
+        return LocalBlobClient(account, container, local_storage_root)
+    return AzureBlobClient(account, container)
@@ -0,0 +1,218 @@
+import asyncio
+import mmap
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Optional
+
+from azure.storage.blob import BlobProperties
+from blob.storage_client import BlobStorageClient
+from database.models import Metadata
+
+# Number of memory maps kept open between requests, keyed by absolute path
+MAX_OPEN_MAPS = 64
+
+# Size of the chunks yielded by LocalBlobStream.chunks()
+STREAM_CHUNK_SIZE = 4 * 1024 * 1024
+
+_open_maps: OrderedDict[str, tuple[int, int, mmap.mmap]] = OrderedDict()
+_open_maps_lock = threading.Lock()
+
+
+def _get_map(path: str) -> Optional[mmap.mmap]:
+    """
+    Get a read-only memory map of a file, reusing the one opened by a previous
+    request as long as the file has not changed on disk. Blocking, called from
+    worker threads: maps dropped from the cache are closed when the last
+    thread reading them lets them go, rather than under its feet.
+
+    Parameters
+    ----------
+    path : str
+        The absolute path of the file.
+
+    Returns
+    -------
+    mmap.mmap
+        The memory map, or None if the file is empty.
+    """
+    stat = os.stat(path)
+    with _open_maps_lock:
+        cached = _open_maps.get(path)
+        if cached is not None:
+            mtime_ns, size, mapped = cached
+            if mtime_ns == stat.st_mtime_ns and size == stat.st_size:
+                _open_maps.move_to_end(path)
+                return mapped
+            del _open_maps[path]
+
+    if stat.st_size == 0:
+        return None
+    with open(path, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    with _open_maps_lock:
+        _open_maps[path] = (stat.st_mtime_ns, stat.st_size, mapped)
+        while len(_open_maps) > MAX_OPEN_MAPS:
+            _open_maps.popitem(last=False)
+    return mapped
+
+
+def _read_range(path: str, start: int, count: int) -> bytes:
+    mapped = _get_map(path)
+    if mapped is None or count == 0:
+        return b""
+    return mapped[start : start + count]
+
+
+def _write_file(path: str, data: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(data)
+    os.replace(temp_path, path)
+
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+class LocalBlobStream:
+    """
+    LocalBlobStream mirrors the parts of the Azure StorageStreamDownloader used
+    by the handlers, reading a byte range of a local file in chunks.
+    """
+
+    def __init__(self, path: str, offset: int, length: int):
+        self.path = path
+        self.offset = offset
+        self.size = length
+
+    async def chunks(self):
+        f = await asyncio.to_thread(open, self.path, "rb")
+        try:
+            await asyncio.to_thread(f.seek, self.offset)
+            remaining = self.size
+            while remaining > 0:
+                chunk = await asyncio.to_thread(
+                    f.read, min(STREAM_CHUNK_SIZE, remaining)
+                )
+                if not chunk:
+                    return
+                remaining -= len(chunk)
+                yield chunk
+        finally:
+            f.close()
+
+    async def readall(self) -> bytes:
+        content = bytearray()
+        async for chunk in self.chunks():
+            content.extend(chunk)
+        return bytes(content)
+
+
+class LocalBlobClient(BlobStorageClient):
+    """
+    LocalBlobClient serves the blobs of a datasource from a directory on the
+    local filesystem laid out as <root>/<account>/<container>/<filepath>.
+
+    Parameters
+    ----------
+    account : str
+        The account name.
+    container : str
+        The container name.
+    root : str
+        The directory holding one folder per account.
+    """
+
+    root: str
+
+    def __init__(self, account, container, root):
+        super().__init__(account, container)
+        self.root = os.path.abspath(os.path.join(root, account, container))
+
+    def get_path(self, filepath: str) -> str:
+        path = os.path.abspath(os.path.join(self.root, filepath))
+        if os.path.commonpath([self.root, path]) != self.root:
+            raise ValueError(f"Invalid file path {filepath}")
+        return path
+
+    def get_range(
+        self, path: str, offset: Optional[int], length: Optional[int]
+    ) -> tuple[int, int]:
+        """
+        Get the start and length of a byte range clamped to the file size.
+        Blocking, called from worker threads.
+        """
+        size = os.path.getsize(path)
+        start = min(offset or 0, size)
+        end = size if length is None else min(start + length, size)
+        return start, end - start
+
+    async def get_blob_properties(self, filepath) -> BlobProperties:
+        path = self.get_path(filepath)
+        stat = await asyncio.to_thread(os.stat, path)
+        properties = BlobProperties()
+        properties.name = filepath
+        properties.container = self.container
+        properties.size = stat.st_size
+        properties.last_modified = datetime.fromtimestamp(
+            stat.st_mtime, tz=timezone.utc
+        )
+        properties.etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+        return properties
+
+    async def get_blob_content(
+        self,
+        filepath: str,
+        offset: Optional[int] = None,
+        length: Optional[int] = None,
+        cached: bool = True,
+    ) -> bytes:
+        path = self.get_path(filepath)
+        start, count = await asyncio.to_thread(self.get_range, path, offset, length)
+        # slicing the map reads the pages from disk
+        return await asyncio.to_thread(_read_range, path, start, count)
+
+    async def get_blob_stream(
+        self, filepath: str, offset: Optional[int] = None, length: Optional[int] = None
+    ) -> LocalBlobStream:
+        path = self.get_path(filepath)
+        start, count = await asyncio.to_thread(self.get_range, path, offset, length)
+        return LocalBlobStream(path, start, count)
+
+    async def upload_blob(self, filepath: str, data: bytes):
+        await asyncio.to_thread(_write_file, self.get_path(filepath), data)
+
+    def list_metadata_files(self) -> list[str]:
+        """
+        List the SigMF metadata files of the container. Blocking, called from
+        a worker thread.
+        """
+        filepaths = []
+        for directory, _, files in os.walk(self.root):
+            for name in sorted(files):
+                if name.endswith(".sigmf-meta"):
+                    filepaths.append(
+                        os.path.relpath(
+                            os.path.join(directory, name), self.root
+                        ).replace(os.sep, "/")
+                    )
+        return filepaths
+
+    async def get_metadata_files(self):
+        for filepath in await asyncio.to_thread(self.list_metadata_files):
+            metadata = await self.get_metadata_file(filepath)
+            yield filepath, metadata
+
+    async def get_metadata_file(self, filepath: str):
+        content = await asyncio.to_thread(_read_file, self.get_path(filepath))
+        return Metadata.parse_raw(content)
+
+    async def blob_exist(self, filepath):
+        return await asyncio.to_thread(os.path.isfile, self.get_path(filepath))
+
+    async def get_file_length(self, filepath):
+        return await asyncio.to_thread(os.path.getsize, self.get_path(filepath))
@@ -0,0 +1,63 @@
+import os
+
+from azure.storage.blob import BlobProperties
+from cachetools import TTLCache
+
+PropertiesKey = tuple[str, str, str]
+
+
+class PropertiesCache:
+    """
+    PropertiesCache keeps the properties (size, etag, last modified) of
+    recently used blobs for a short time, so that the handlers do not issue a
+    HEAD request to storage before every read.
+
+    Parameters
+    ----------
+    maxsize : int
+        The maximum number of blobs to keep properties for.
+    ttl : float
+        How long in seconds the properties of a blob are trusted.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.hits = 0
+        self.misses = 0
+        self.properties: TTLCache[PropertiesKey, BlobProperties] = TTLCache(
+            maxsize=max(maxsize, 1), ttl=ttl
+        )
+        self.enabled = maxsize > 0 and ttl > 0
+
+    def get(self, key: PropertiesKey) -> BlobProperties | None:
+        properties = self.properties.get(key) if self.enabled else None
+        if properties is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return properties
+
+    def put(self, key: PropertiesKey, properties: BlobProperties):
+        if self.enabled:
+            self.properties[key] = properties
+
+    def invalidate(self, key: PropertiesKey):
+        self.properties.pop(key, None)
+
+    def clear(self):
+        self.properties.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self.properties),
+            "ttl": self.properties.ttl,
+        }
+
+
+properties_cache = PropertiesCache(
+    maxsize=int(os.getenv("IQENGINE_BLOB_PROPERTIES_CACHE_SIZE", 10000)),
+    ttl=float(os.getenv("IQENGINE_BLOB_PROPERTIES_CACHE_TTL", 60)),
+)
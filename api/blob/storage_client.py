@@ -0,0 +1,87 @@
+from abc import ABC, abstractmethod
+from typing import AsyncIterator, Optional
+
+from azure.storage.blob import BlobProperties
+from database.models import Metadata
+from helpers.compute import compute_pool
+from helpers.concurrency import download_limiter
+from helpers.urlmapping import ApiType, get_file_name
+from pydantic import SecretStr
+from rf.spectrogram import get_spectrogram_image
+
+
+class BlobStorageClient(ABC):
+    """
+    BlobStorageClient is the interface shared by every storage backend that
+    can serve SigMF recordings for a datasource (account/container). A backend
+    implements every abstract method, or cannot be instantiated.
+
+    Parameters
+    ----------
+    account : str
+        The account name.
+    container : str
+        The container name.
+    """
+
+    account: str
+    container: str
+    sas_token: SecretStr = None
+
+    def __init__(self, account, container):
+        self.account = account
+        self.container = container
+
+    def set_sas_token(self, sas_token):
+        self.sas_token = sas_token
+
+    @abstractmethod
+    async def get_blob_properties(self, filepath) -> BlobProperties:
+        raise NotImplementedError()
+
+    @abstractmethod
+    async def get_blob_content(
+        self,
+        filepath: str,
+        offset: Optional[int] = None,
+        length: Optional[int] = None,
+        cached: bool = True,
+    ) -> bytes:
+        raise NotImplementedError()
+
+    @abstractmethod
+    async def get_blob_stream(
+        self, filepath: str, offset: Optional[int] = None, length: Optional[int] = None
+    ):
+        raise NotImplementedError()
+
+    @abstractmethod
+    async def upload_blob(self, filepath: str, data: bytes):
+        raise NotImplementedError()
+
+    @abstractmethod
+    def get_metadata_files(self) -> AsyncIterator[tuple[str, Metadata]]:
+        raise NotImplementedError()
+
+    @abstractmethod
+    async def get_metadata_file(self, filepath: str) -> Metadata:
+        raise NotImplementedError()
+
+    @abstractmethod
+    async def blob_exist(self, filepath) -> bool:
+        raise NotImplementedError()
+
+    @abstractmethod
+    async def get_file_length(self, filepath) -> int:
+        raise NotImplementedError()
+
+    async def get_new_thumbnail(self, data_type: str, filepath: str) -> bytes:
+        iq_path = get_file_name(filepath, ApiType.IQDATA)
+        fftSize = 1024
+        # only the download takes a storage slot, not the spectrogram
+        async with download_limiter.limit(self.account):
+            content = await self.get_blob_content(iq_path, 8000, fftSize * 512)
+        image = await compute_pool.run(
+            get_spectrogram_image, content, data_type, fftSize
+        )
+        return image
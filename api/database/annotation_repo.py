@@ -0,0 +1,268 @@
+import uuid
+
+from database.database import db
+from database.models import MetadataAnnotation
+from motor.core import AgnosticCollection
+from pymongo import ASCENDING, DeleteMany, ReplaceOne
+from pymongo.errors import BulkWriteError
+
+# Field of an annotation document holding the recording it belongs to
+ORIGIN_FIELD = "traceability:origin"
+
+
+def collection() -> AgnosticCollection:
+    collection: AgnosticCollection = db().annotations
+    return collection
+
+
+def recording_query(account, container, filepath) -> dict:
+    return {
+        f"{ORIGIN_FIELD}.account": account,
+        f"{ORIGIN_FIELD}.container": container,
+        f"{ORIGIN_FIELD}.file_path": filepath,
+    }
+
+
+def assign_uuids(annotations: list[MetadataAnnotation]):
+    """
+    Give a core:uuid to the annotations without one, which identifies them
+    in the annotations collection.
+    """
+    for annotation in annotations:
+        if not annotation.core_uuid:
+            annotation.core_uuid = str(uuid.uuid4())
+
+
+def from_document(document: dict) -> dict:
+    """
+    Get the SigMF annotation stored in an annotation document.
+    """
+    return {
+        key: value
+        for key, value in document.items()
+        if key not in ["_id", ORIGIN_FIELD]
+    }
+
+
+async def get_all(
+    account, container, filepath, projection: dict | None = None
+) -> list[dict]:
+    """
+    Get the annotations of a recording.
+
+    Parameters
+    ----------
+    account : str
+        The account name.
+    container : str
+        The container name.
+    filepath : str
+        The filepath
+    projection : dict, optional
+        The MongoDB projection of the annotation fields to read, all of
+        them if None.
+
+    Returns
+    -------
+    list[dict]
+        The SigMF annotations, ordered by core:sample_start.
+    """
+    annotations = (
+        collection()
+        .find(recording_query(account, container, filepath), projection)
+        .sort([("core:sample_start", ASCENDING), ("_id", ASCENDING)])
+    )
+    return [from_document(document) async for document in annotations]
+
+
+async def get_by_file_paths(
+    account, container, filepaths: list[str], projection: dict | None = None
+) -> dict[str, list[dict]]:
+    """
+    Get the annotations of several recordings of a container at once.
+
+    Returns
+    -------
+    dict[str, list[dict]]
+        The SigMF annotations of each filepath, ordered by core:sample_start.
+    """
+    if projection is not None:
+        projection = {**projection, f"{ORIGIN_FIELD}.file_path": 1}
+    annotations = (
+        collection()
+        .find(
+            {
+                f"{ORIGIN_FIELD}.account": account,
+                f"{ORIGIN_FIELD}.container": container,
+                f"{ORIGIN_FIELD}.file_path": {"$in": filepaths},
+            },
+            projection,
+        )
+        .sort(
+            [
+                (f"{ORIGIN_FIELD}.file_path", ASCENDING),
+                ("core:sample_start", ASCENDING),
+                ("_id", ASCENDING),
+            ]
+        )
+    )
+    result: dict[str, list[dict]] = {filepath: [] for filepath in filepaths}
+    async for document in annotations:
+        result[document[ORIGIN_FIELD]["file_path"]].append(from_document(document))
+    return result
+
+
+async def write(
+    account,
+    container,
+    filepath,
+    upserts: list[dict],
+    deletes: list[str],
+):
+    """
+    Upsert and delete annotations of a recording in one bulk write.
+
+    Parameters
+    ----------
+    account : str
+        The account name.
+    container : str
+        The container name.
+    filepath : str
+        The filepath
+    upserts : list[dict]
+        The SigMF annotations to insert or replace, identified by their
+        core:uuid.
+    deletes : list[str]
+        The core:uuid of the annotations to delete.
+    """
+    query = recording_query(account, container, filepath)
+    origin = {"account": account, "container": container, "file_path": filepath}
+    requests: list = [
+        ReplaceOne(
+            {**query, "core:uuid": annotation["core:uuid"]},
+            {**annotation, ORIGIN_FIELD: origin},
+            upsert=True,
+        )
+        for annotation in upserts
+    ]
+    if deletes:
+        requests.append(DeleteMany({**query, "core:uuid": {"$in": deletes}}))
+    if requests:
+        await collection().bulk_write(requests, ordered=False)
+
+
+async def insert_many(recordings: list[tuple[dict, list[dict]]]) -> dict[int, dict]:
+    """
+    Insert the annotations of new recordings in one unordered write.
+
+    Parameters
+    ----------
+    recordings : list[tuple[dict, list[dict]]]
+        The origin of each recording, with its account, container and
+        file_path, and its SigMF annotations.
+
+    Returns
+    -------
+    dict[int, dict]
+        The first MongoDB write error of each recording whose annotations
+        could not all be written, by position.
+    """
+    positions = []
+    documents = []
+    for position, (origin, annotations) in enumerate(recordings):
+        for annotation in annotations:
+            positions.append(position)
+            documents.append({**annotation, ORIGIN_FIELD: origin})
+    errors: dict[int, dict] = {}
+    if documents:
+        try:
+            await collection().insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            for error in e.details["writeErrors"]:
+                errors.setdefault(positions[error["index"]], error)
+    return errors
+
+
+async def delete_all(account, container, filepath):
+    """
+    Delete all the annotations of a recording.
+    """
+    await collection().delete_many(recording_query(account, container, filepath))
+
+
+async def replace_all(
+    account, container, filepath, annotations: list[dict]
+) -> tuple[list[dict], list[str]]:
+    """
+    Replace the annotations of a recording, writing only the annotations
+    that changed.
+
+    Returns
+    -------
+    tuple[list[dict], list[str]]
+        The annotations upserted and the core:uuid of those deleted.
+    """
+    existing = {
+        annotation["core:uuid"]: annotation
+        for annotation in await get_all(account, container, filepath)
+    }
+    incoming = {annotation["core:uuid"]: annotation for annotation in annotations}
+    upserts = [
+        annotation
+        for annotation_uuid, annotation in incoming.items()
+        if existing.get(annotation_uuid) != annotation
+    ]
+    deletes = [
+        annotation_uuid
+        for annotation_uuid in existing
+        if annotation_uuid not in incoming
+    ]
+    await write(account, container, filepath, upserts, deletes)
+    return upserts, deletes
+
+
+async def get_label_summary(account, container, filepath) -> dict:
+    """
+    Get the number of annotations of a recording and their distinct labels
+    and comments, computed by the database server.
+    """
+    summaries = (
+        await collection()
+        .aggregate(
+            [
+                {"$match": recording_query(account, container, filepath)},
+                {
+                    "$group": {
+                        "_id": None,
+                        "count": {"$sum": 1},
+                        "labels": {"$addToSet": "$core:label"},
+                        "comments": {"$addToSet": "$core:comment"},
+                    }
+                },
+            ]
+        )
+        .to_list(1)
+    )
+    if not summaries:
+        return {"count": 0, "labels": [], "comments": []}
+    return {
+        "count": summaries[0]["count"],
+        "labels": [label for label in summaries[0]["labels"] if label],
+        "comments": [comment for comment in summaries[0]["comments"] if comment],
+    }
+
+
+async def find_recordings(query: dict) -> list[dict]:
+    """
+    Get the recordings with annotations matching a query.
+
+    Returns
+    -------
+    list[dict]
+        The account, container and file_path of each recording.
+    """
+    recordings = collection().aggregate(
+        [{"$match": query}, {"$group": {"_id": f"${ORIGIN_FIELD}"}}]
+    )
+    return [recording["_id"] async for recording in recordings]
@@ -1,5 +1,5 @@
 import database.metadata_repo
-from blob.azure_client import AzureBlobClient
+from blob.client_factory import get_storage_client
 from database.database import db
 from database.models import DataSource, DataSourceReference
 from helpers.cipher import decrypt, encrypt
@@ -58,15 +58,17 @@ async def datasource_exists(account, container) -> bool:
 
 
 async def sync(account: str, container: str):
-    azure_blob_client = AzureBlobClient(account, container)
+    storage_client = get_storage_client(account, container)
     datasource = await get(account, container)
     if datasource is None:
         raise Exception(f"Datasource {account}/{container} does not exist")
-    azure_blob_client.set_sas_token(decrypt(datasource.sasToken))
-    metadatas = azure_blob_client.get_metadata_files()
+    storage_client.set_sas_token(decrypt(datasource.sasToken.get_secret_value()))
+    metadatas = storage_client.get_metadata_files()
     async for metadata in metadatas:
         filepath = metadata[0].replace(".sigmf-meta", "")
-        if not azure_blob_client.blob_exist(filepath + ".sigmf-data"):
+        if await database.metadata_repo.exists(account, container, filepath):
+            continue
+        if not await storage_client.blob_exist(filepath + ".sigmf-data"):
             print(f"Data file {filepath} does not exist for metadata file")
             continue
         metadata = metadata[1]
@@ -79,13 +81,12 @@ async def sync(account: str, container: str):
             }
         )
         metadata.globalMetadata.traceability_revision = 0
-        file_length = await azure_blob_client.get_file_length(filepath + ".sigmf-data")
+        file_length = await storage_client.get_file_length(filepath + ".sigmf-data")
         metadata.globalMetadata.traceability_sample_length = (
-            file_length / get_bytes_per_iq_sample(metadata.globalMetadata.core_datatype)
+            file_length
+            // get_bytes_per_iq_sample(metadata.globalMetadata.core_datatype)
         )
-        if await database.metadata_repo.exists(account, container, filepath):
-            continue
-        await database.metadata_repo.create(account, container, filepath)
+        await database.metadata_repo.create(metadata)
 
 
 async def create(datasource: DataSource) -> DataSource:
@@ -0,0 +1,94 @@
+from datetime import datetime, timedelta, timezone
+
+# Values computed from a metadata on every write, so that range queries over
+# the band, duration and time span of recordings are served by indexes
+DERIVED_FIELD = "_derived"
+
+
+def parse_datetime(value) -> datetime | None:
+    """
+    Parse a SigMF datetime as a naive UTC datetime, the way MongoDB stores
+    them, or None when it is not an ISO 8601 datetime.
+    """
+    if not isinstance(value, str):
+        return None
+    # before Python 3.11, fromisoformat does not accept the Z suffix of UTC
+    if value.endswith(("Z", "z")):
+        value = value[:-1] + "+00:00"
+    try:
+        return to_utc(datetime.fromisoformat(value))
+    except ValueError:
+        return None
+
+
+def to_utc(value: datetime) -> datetime:
+    """
+    Convert a datetime to a naive UTC datetime, naive datetimes being
+    already in UTC.
+    """
+    if value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def get_derived_fields(document: dict) -> dict:
+    """
+    Get the derived fields of a metadata document.
+
+    Parameters
+    ----------
+    document : dict
+        The metadata, as stored in the database.
+
+    Returns
+    -------
+    dict
+        The fields that can be computed from the metadata:
+
+        - min_frequency and max_frequency, the band covered by the captures,
+          their center frequencies -/+ half the sample rate, in Hz.
+        - duration, the length of the recording in seconds.
+        - start_datetime and end_datetime, the time span of the recording.
+        - annotation_count, the number of annotations.
+    """
+    global_metadata = document.get("global") or {}
+    captures = document.get("captures") or []
+    sample_rate = global_metadata.get("core:sample_rate")
+    sample_length = global_metadata.get("traceability:sample_length")
+    fields: dict = {"annotation_count": len(document.get("annotations") or [])}
+
+    frequencies = [
+        capture["core:frequency"]
+        for capture in captures
+        if capture.get("core:frequency") is not None
+    ]
+    if frequencies:
+        half_band = sample_rate / 2 if sample_rate else 0
+        fields["min_frequency"] = min(frequencies) - half_band
+        fields["max_frequency"] = max(frequencies) + half_band
+
+    duration = None
+    if sample_rate and sample_length is not None:
+        duration = sample_length / sample_rate
+        fields["duration"] = duration
+
+    # the start of the recording, from captures that start part way through
+    starts = []
+    datetimes = []
+    for capture in captures:
+        capture_datetime = parse_datetime(capture.get("core:datetime"))
+        if capture_datetime is None:
+            continue
+        datetimes.append(capture_datetime)
+        offset = capture.get("core:sample_start", 0) / sample_rate if sample_rate else 0
+        starts.append(capture_datetime - timedelta(seconds=offset))
+    if starts:
+        fields["start_datetime"] = min(starts)
+        if duration is not None:
+            fields["end_datetime"] = fields["start_datetime"] + timedelta(
+                seconds=duration
+            )
+        else:
+            # without the length of the recording, its last known instant
+            fields["end_datetime"] = max(datetimes)
+    return fields
@@ -0,0 +1,217 @@
+import logging
+import re
+from datetime import datetime
+
+from database import annotation_repo
+from database.database import db
+from database.derived import DERIVED_FIELD
+from database.search import SEARCH_FIELD
+from pymongo import ASCENDING, GEOSPHERE, TEXT, IndexModel
+from pymongo.errors import PyMongoError
+
+logger = logging.getLogger("api")
+
+ORIGIN_FIELDS = [
+    ("global.traceability:origin.account", ASCENDING),
+    ("global.traceability:origin.container", ASCENDING),
+    ("global.traceability:origin.file_path", ASCENDING),
+]
+
+ANNOTATION_ORIGIN_FIELDS = [
+    (f"{annotation_repo.ORIGIN_FIELD}.account", ASCENDING),
+    (f"{annotation_repo.ORIGIN_FIELD}.container", ASCENDING),
+    (f"{annotation_repo.ORIGIN_FIELD}.file_path", ASCENDING),
+]
+
+# Indexes of each collection, created at startup when they do not exist yet
+INDEXES = {
+    "metadata": [
+        IndexModel(ORIGIN_FIELDS, name="origin", unique=True),
+        # keyset pagination of the metadata of a container
+        IndexModel(ORIGIN_FIELDS[:2] + [("_id", ASCENDING)], name="container_id"),
+        IndexModel(
+            [("captures.core:geolocation", GEOSPHERE)], name="captures_geolocation"
+        ),
+        IndexModel([("captures.core:frequency", ASCENDING)], name="captures_frequency"),
+        IndexModel([("captures.core:datetime", ASCENDING)], name="captures_datetime"),
+        IndexModel(
+            [
+                (f"{DERIVED_FIELD}.min_frequency", ASCENDING),
+                (f"{DERIVED_FIELD}.max_frequency", ASCENDING),
+            ],
+            name="derived_frequency",
+        ),
+        IndexModel(
+            [
+                (f"{DERIVED_FIELD}.start_datetime", ASCENDING),
+                (f"{DERIVED_FIELD}.end_datetime", ASCENDING),
+            ],
+            name="derived_datetime",
+        ),
+        IndexModel([(f"{DERIVED_FIELD}.duration", ASCENDING)], name="derived_duration"),
+        IndexModel([(f"{SEARCH_FIELD}.labels", ASCENDING)], name="search_labels"),
+        IndexModel([(f"{SEARCH_FIELD}.author", ASCENDING)], name="search_author"),
+        IndexModel(
+            [(f"{SEARCH_FIELD}.description", ASCENDING)], name="search_description"
+        ),
+        IndexModel([(f"{SEARCH_FIELD}.comments", ASCENDING)], name="search_comments"),
+        IndexModel([(f"{SEARCH_FIELD}.account", ASCENDING)], name="search_account"),
+        IndexModel([(f"{SEARCH_FIELD}.container", ASCENDING)], name="search_container"),
+        # words of the descriptions, labels and comments, labels weigh most
+        IndexModel(
+            [
+                ("global.core:description", TEXT),
+                (f"{SEARCH_FIELD}.labels", TEXT),
+                (f"{SEARCH_FIELD}.comments", TEXT),
+            ],
+            name="text",
+            weights={
+                "global.core:description": 2,
+                f"{SEARCH_FIELD}.labels": 4,
+                f"{SEARCH_FIELD}.comments": 1,
+            },
+        ),
+    ],
+    "annotations": [
+        IndexModel(
+            ANNOTATION_ORIGIN_FIELDS + [("core:uuid", ASCENDING)],
+            name="recording_uuid",
+            unique=True,
+        ),
+        IndexModel(
+            ANNOTATION_ORIGIN_FIELDS + [("core:sample_start", ASCENDING)],
+            name="recording_sample_start",
+        ),
+        IndexModel([("core:geolocation", GEOSPHERE)], name="geolocation"),
+    ],
+    "versions": [
+        IndexModel(
+            ORIGIN_FIELDS + [("global.traceability:revision", ASCENDING)],
+            name="origin_revision",
+        ),
+    ],
+    "datasources": [
+        IndexModel(
+            [("account", ASCENDING), ("container", ASCENDING)],
+            name="account_container",
+            unique=True,
+        ),
+    ],
+}
+
+# Representative query of each index, explained by /api/status/indexes
+EXPLAINED_QUERIES = {
+    "metadata": {
+        "origin": {
+            "global.traceability:origin.account": "account",
+            "global.traceability:origin.container": "container",
+            "global.traceability:origin.file_path": "file_path",
+        },
+        "frequency": {"captures.core:frequency": {"$gte": 0, "$lte": 1e9}},
+        "datetime": {"captures.core:datetime": {"$gte": "2000-01-01T00:00:00"}},
+        "frequency_overlap": {
+            f"{DERIVED_FIELD}.min_frequency": {"$lte": 2.48e9},
+            f"{DERIVED_FIELD}.max_frequency": {"$gte": 2.4e9},
+        },
+        "datetime_overlap": {
+            f"{DERIVED_FIELD}.start_datetime": {"$lte": datetime(2000, 1, 2)},
+            f"{DERIVED_FIELD}.end_datetime": {"$gte": datetime(2000, 1, 1)},
+        },
+        "label": {f"{SEARCH_FIELD}.labels": re.compile("^label")},
+        "account": {f"{SEARCH_FIELD}.account": {"$in": [re.compile("^account")]}},
+        "text": {"$text": {"$search": "label"}},
+        "captures_geolocation": {
+            "captures.core:geolocation": {
+                "$near": {
+                    "$geometry": {"type": "Point", "coordinates": [0, 0]},
+                    "$maxDistance": 1000,
+                }
+            }
+        },
+    },
+    "annotations": {
+        "recording_sample_start": {
+            f"{annotation_repo.ORIGIN_FIELD}.account": "account",
+            f"{annotation_repo.ORIGIN_FIELD}.container": "container",
+            f"{annotation_repo.ORIGIN_FIELD}.file_path": "file_path",
+        },
+    },
+    "versions": {
+        "origin_revision": {
+            "global.traceability:origin.account": "account",
+            "global.traceability:origin.container": "container",
+            "global.traceability:origin.file_path": "file_path",
+            "global.traceability:revision": 0,
+        },
+    },
+    "datasources": {
+        "account_container": {"account": "account", "container": "container"},
+    },
+}
+
+
+async def create_indexes():
+    """
+    Create the indexes of the metadata, annotations, versions and datasources
+    collections.
+    Indexes that already exist are left untouched, so this runs at every
+    startup. An index that cannot be built, for instance a unique index over
+    duplicated documents, is logged and skipped rather than stopping the API.
+    """
+    database = db()
+    for collection_name, indexes in INDEXES.items():
+        collection = database[collection_name]
+        for index in indexes:
+            try:
+                await collection.create_indexes([index])
+            except PyMongoError as e:
+                logger.error(
+                    "Could not create index %s on %s: %s",
+                    index.document["name"],
+                    collection_name,
+                    e,
+                )
+
+
+def summarize_plan(plan: dict) -> dict:
+    """
+    Summarize the winning plan of an explained query as its stages, from the
+    last to the first, and the indexes it uses.
+    """
+    stages = []
+    indexes = []
+    while plan:
+        stages.append(plan.get("stage"))
+        if "indexName" in plan:
+            indexes.append(plan["indexName"])
+        plan = plan.get("inputStage") or (plan.get("inputStages") or [None])[0]
+    return {"stages": stages, "indexes": indexes}
+
+
+async def get_index_report() -> dict:
+    """
+    Get the indexes of each collection and the plan chosen for a
+    representative query of each of them.
+    """
+    database = db()
+    report = {}
+    for collection_name, queries in EXPLAINED_QUERIES.items():
+        collection = database[collection_name]
+        plans = {}
+        for query_name, query in queries.items():
+            try:
+                explained = await collection.find(query).explain()
+                plans[query_name] = summarize_plan(
+                    explained["queryPlanner"]["winningPlan"]
+                )
+            except (PyMongoError, AttributeError, KeyError) as e:
+                # not every Mongo compatible server explains every query
+                plans[query_name] = {"error": str(e)}
+        report[collection_name] = {
+            "indexes": {
+                name: {key: value for key, value in info.items() if key != "v"}
+                for name, info in (await collection.index_information()).items()
+            },
+            "plans": plans,
+        }
+    return report
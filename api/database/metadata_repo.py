@@ -1,6 +1,38 @@
+import logging
+import uuid
+from datetime import datetime, timedelta
+
+from database import annotation_repo, version_repo
 from database.database import db
+from database.derived import DERIVED_FIELD, get_derived_fields
 from database.models import Metadata
+from database.search import SEARCH_FIELD, get_search_fields, normalize_distinct
 from motor.core import AgnosticCollection
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+
+logger = logging.getLogger("api")
+
+# Documents updated at once when adding computed fields to old metadata
+BACKFILL_BATCH_SIZE = 500
+
+REVISION_FIELD = "global.traceability:revision"
+
+# Field of a metadata document holding the lease of the writer of its latest
+# revision while it writes the annotations and the version of that revision,
+# so that the writes of concurrent revisions are not interleaved. A lease a
+# writer did not release, because it stopped, expires after
+# WRITE_LEASE_SECONDS
+WRITING_FIELD = "_writing"
+WRITE_LEASE_SECONDS = 30
+
+# Computed fields that depend on the annotations of a metadata, left as they
+# are when only its global and captures change
+ANNOTATION_COMPUTED_FIELDS = [
+    f"{SEARCH_FIELD}.labels",
+    f"{SEARCH_FIELD}.comments",
+    f"{DERIVED_FIELD}.annotation_count",
+]
 
 
 def collection() -> AgnosticCollection:
@@ -8,9 +40,119 @@ def collection() -> AgnosticCollection:
     return collection
 
 
-def versions_collection() -> AgnosticCollection:
-    collection: AgnosticCollection = db().versions
-    return collection
+# Fields of a metadata summary, computed by the database server so that
+# the captures of a recording are never sent to the API
+SUMMARY_PROJECTION = {
+    "account": "$global.traceability:origin.account",
+    "container": "$global.traceability:origin.container",
+    "file_path": "$global.traceability:origin.file_path",
+    "datatype": "$global.core:datatype",
+    "sample_rate": "$global.core:sample_rate",
+    "frequency": {"$arrayElemAt": ["$captures.core:frequency", 0]},
+    "description": "$global.core:description",
+    "annotation_count": {"$ifNull": [f"${DERIVED_FIELD}.annotation_count", 0]},
+}
+
+
+def get_computed_fields(document: dict) -> dict:
+    """
+    Get the fields stored alongside a metadata document and computed from
+    it: its normalized search fields and its derived fields.
+    """
+    return {
+        SEARCH_FIELD: get_search_fields(document),
+        DERIVED_FIELD: get_derived_fields(document),
+    }
+
+
+def to_documents(metadata: Metadata) -> tuple[dict, list[dict]]:
+    """
+    Split a metadata into the document of the metadata collection, with its
+    computed fields, and its annotations, which are stored in the
+    annotations collection. Annotations without a core:uuid are given one.
+    """
+    annotation_repo.assign_uuids(metadata.annotations)
+    document = metadata.dict(by_alias=True, exclude_unset=True, exclude_none=True)
+    annotations = document.pop("annotations", [])
+    computed_fields = get_computed_fields({**document, "annotations": annotations})
+    return {**document, **computed_fields}, annotations
+
+
+def get_revision_update(
+    document: dict, previous: dict, keep_annotation_fields: bool = False
+) -> dict:
+    """
+    Get the MongoDB update from a stored metadata document to a new revision
+    of it. Fields are set one by one, so that the revision is incremented by
+    the database server rather than written by the API.
+
+    Parameters
+    ----------
+    document : dict
+        The new metadata document, with its computed fields.
+    previous : dict
+        The global and computed fields of the stored document, whose members
+        missing from the new document are removed.
+    keep_annotation_fields : bool
+        Whether the computed fields that depend on the annotations are left
+        as they are.
+
+    Returns
+    -------
+    dict
+        The update.
+    """
+    updates: dict = {"captures": document.get("captures", [])}
+    removals: dict = {}
+    for section in ["global", SEARCH_FIELD, DERIVED_FIELD]:
+        fields = document.get(section, {})
+        for key, value in fields.items():
+            updates[f"{section}.{key}"] = value
+        for key in previous.get(section, {}):
+            if key not in fields:
+                removals[f"{section}.{key}"] = ""
+    updates.pop(REVISION_FIELD, None)
+    removals.pop(REVISION_FIELD, None)
+    if keep_annotation_fields:
+        for field in ANNOTATION_COMPUTED_FIELDS:
+            updates.pop(field, None)
+            removals.pop(field, None)
+    update = {"$set": updates, "$inc": {REVISION_FIELD: 1}}
+    if removals:
+        update["$unset"] = removals
+    return update
+
+
+def origin_query(account, container, filepath) -> dict:
+    return {
+        "global.traceability:origin.account": account,
+        "global.traceability:origin.container": container,
+        "global.traceability:origin.file_path": filepath,
+    }
+
+
+def get_summary_pipeline(query: dict, limit: int | None = None) -> list[dict]:
+    """
+    Get the aggregation pipeline of the summaries of the metadata matching a
+    query, ordered by creation.
+
+    Parameters
+    ----------
+    query : dict
+        The query of the metadata.
+    limit : int, optional
+        The maximum number of summaries.
+
+    Returns
+    -------
+    list[dict]
+        The pipeline, its documents keep their _id for pagination.
+    """
+    pipeline: list[dict] = [{"$match": query}, {"$sort": {"_id": 1}}]
+    if limit is not None:
+        pipeline.append({"$limit": limit})
+    pipeline.append({"$project": SUMMARY_PROJECTION})
+    return pipeline
 
 
 async def get(account, container, filepath) -> Metadata | None:
@@ -33,17 +175,67 @@ async def get(account, container, filepath) -> Metadata | None:
     """
     metadata_collection: AgnosticCollection = collection()
     metadata = await metadata_collection.find_one(
-        {
-            "global.traceability:origin.account": account,
-            "global.traceability:origin.container": container,
-            "global.traceability:origin.file_path": filepath,
-        }
+        origin_query(account, container, filepath)
     )
     if not metadata:
         return None
+    metadata["annotations"] = await annotation_repo.get_all(
+        account, container, filepath
+    )
     return Metadata(**metadata)
 
 
+async def get_fields(account, container, filepath, projection: dict) -> dict | None:
+    """
+    Get some fields of a metadata by account, container and filepath
+
+    Parameters
+    ----------
+    account : str
+        The account name.
+    container : str
+        The container name.
+    filepath : str
+        The filepath
+    projection : dict
+        The MongoDB projection of the fields to read.
+
+    Returns
+    -------
+    dict
+        The fields of the metadata, without its _id, not validated.
+    """
+    metadata_collection: AgnosticCollection = collection()
+    return await metadata_collection.find_one(
+        origin_query(account, container, filepath), {**projection, "_id": 0}
+    )
+
+
+async def get_summary(account, container, filepath) -> dict | None:
+    """
+    Get the summary of a metadata by account, container and filepath, see
+    SUMMARY_PROJECTION.
+    """
+    metadata_collection: AgnosticCollection = collection()
+    summaries = await metadata_collection.aggregate(
+        get_summary_pipeline(origin_query(account, container, filepath), 1)
+    ).to_list(1)
+    return summaries[0] if summaries else None
+
+
+async def get_datatype(account, container, filepath) -> str | None:
+    """
+    Get the datatype of a metadata by account, container and filepath,
+    without reading the rest of the document.
+    """
+    metadata = await get_fields(
+        account, container, filepath, {"global.core:datatype": 1}
+    )
+    if not metadata:
+        return None
+    return metadata.get("global", {}).get("core:datatype")
+
+
 async def exists(account, container, filepath) -> bool:
     """
     Check if a metadata exists by account, container and filepath
@@ -74,6 +266,26 @@ async def exists(account, container, filepath) -> bool:
     return metadata is not None
 
 
+async def get_existing_file_paths(account, container, filepaths: list[str]) -> set:
+    """
+    Get which of some filepaths of a container already have a metadata, in
+    one query.
+    """
+    metadata_collection: AgnosticCollection = collection()
+    documents = metadata_collection.find(
+        {
+            "global.traceability:origin.account": account,
+            "global.traceability:origin.container": container,
+            "global.traceability:origin.file_path": {"$in": filepaths},
+        },
+        {"global.traceability:origin.file_path": 1, "_id": 0},
+    )
+    return {
+        document["global"]["traceability:origin"]["file_path"]
+        async for document in documents
+    }
+
+
 async def create(metadata: Metadata):
     """
     Create a new metadata. The metadata will be henceforth identified by account/container/filepath which
@@ -90,13 +302,344 @@ async def create(metadata: Metadata):
     -------
     None
     """
-    if await exists(metadata.account, metadata.container, metadata.filepath):
+    origin = metadata.globalMetadata.traceability_origin
+    if await exists(origin.account, origin.container, origin.file_path):
         raise Exception("Metadata Already Exists")
+    await insert(metadata)
 
-    metadata_collection: AgnosticCollection = collection()
-    versions: AgnosticCollection = versions_collection()
 
-    await metadata_collection.insert_one(
-        metadata.dict(by_alias=True, exclude_unset=True)
+async def insert(metadata: Metadata):
+    """
+    Write a new metadata, its annotations and its first version.
+    """
+    origin = metadata.globalMetadata.traceability_origin
+    document, annotations = to_documents(metadata)
+    await collection().insert_one(document)
+    await annotation_repo.write(
+        origin.account, origin.container, origin.file_path, annotations, []
+    )
+    await version_repo.insert(document, annotations=annotations)
+
+
+async def insert_many(metadatas: list[Metadata]) -> dict[int, dict]:
+    """
+    Write new metadata, their annotations and their first versions in bulk.
+    Writes are unordered, so that a metadata that cannot be written, such as
+    one that already exists, does not stop the others.
+
+    Parameters
+    ----------
+    metadatas : list[Metadata]
+        The metadata to write.
+
+    Returns
+    -------
+    dict[int, dict]
+        The MongoDB write error of each metadata that could not be written,
+        by position. A metadata whose annotations could not be written is
+        removed again, and its error has collection set to "annotations".
+    """
+    if not metadatas:
+        return {}
+    documents = [to_documents(metadata) for metadata in metadatas]
+    errors: dict[int, dict] = {}
+    try:
+        await collection().insert_many(
+            [document for document, _ in documents], ordered=False
+        )
+    except BulkWriteError as e:
+        errors = {error["index"]: error for error in e.details["writeErrors"]}
+    written = [index for index in range(len(documents)) if index not in errors]
+    origins = [
+        {
+            key: documents[index][0]["global"]["traceability:origin"][key]
+            for key in ["account", "container", "file_path"]
+        }
+        for index in written
+    ]
+    annotation_errors = await annotation_repo.insert_many(
+        [(origin, documents[index][1]) for origin, index in zip(origins, written)]
+    )
+    for position, error in annotation_errors.items():
+        # a metadata is not left without its annotations and versions
+        origin = origins[position]
+        await collection().delete_one(
+            origin_query(origin["account"], origin["container"], origin["file_path"])
+        )
+        await annotation_repo.delete_all(
+            origin["account"], origin["container"], origin["file_path"]
+        )
+        errors[written[position]] = {**error, "collection": "annotations"}
+    await version_repo.insert_many(
+        [
+            documents[index]
+            for position, index in enumerate(written)
+            if position not in annotation_errors
+        ]
+    )
+    return errors
+
+
+def get_lease() -> dict:
+    return {
+        "id": str(uuid.uuid4()),
+        "until": datetime.utcnow() + timedelta(seconds=WRITE_LEASE_SECONDS),
+    }
+
+
+def not_writing_query() -> dict:
+    """
+    Get the condition on the metadata no writer holds an unexpired lease on.
+    """
+    return {f"{WRITING_FIELD}.until": {"$not": {"$gt": datetime.utcnow()}}}
+
+
+def is_writing(document: dict) -> bool:
+    """
+    Check whether a writer held an unexpired lease on a metadata when it
+    was read.
+    """
+    lease = document.get(WRITING_FIELD)
+    return bool(lease) and lease["until"] > datetime.utcnow()
+
+
+async def release(document: dict, lease: dict):
+    """
+    Release the lease taken to write a revision of a metadata, unless it
+    expired and was taken over.
+    """
+    await collection().update_one(
+        {"_id": document["_id"], f"{WRITING_FIELD}.id": lease["id"]},
+        {"$unset": {WRITING_FIELD: ""}},
+    )
+    document.pop(WRITING_FIELD, None)
+
+
+async def replace(metadata: Metadata, previous: dict) -> dict | None:
+    """
+    Replace a metadata by a new revision, writing only the annotations that
+    changed, and record the revision in the versions collection.
+
+    Parameters
+    ----------
+    metadata : Metadata
+        The new metadata.
+    previous : dict
+        The global and computed fields of the stored metadata, see
+        get_revision_update. The metadata is only replaced while it is still
+        at the revision of previous.
+
+    Returns
+    -------
+    dict
+        The new revision of the metadata, without its annotations, or None
+        when the stored metadata has changed since previous was read, or
+        another revision of it is being written.
+    """
+    origin = metadata.globalMetadata.traceability_origin
+    document, annotations = to_documents(metadata)
+    update = get_revision_update(document, previous)
+    # annotations embedded by earlier versions of the API are dropped
+    update.setdefault("$unset", {})["annotations"] = ""
+    lease = get_lease()
+    update["$set"][WRITING_FIELD] = lease
+    document = await collection().find_one_and_update(
+        {
+            **origin_query(origin.account, origin.container, origin.file_path),
+            REVISION_FIELD: previous["global"].get("traceability:revision"),
+            **not_writing_query(),
+        },
+        update,
+        return_document=ReturnDocument.AFTER,
+    )
+    if document is None:
+        return None
+    try:
+        upserts, deletes = await annotation_repo.replace_all(
+            origin.account, origin.container, origin.file_path, annotations
+        )
+        await version_repo.insert(document, previous, upserts, deletes, annotations)
+    finally:
+        await release(document, lease)
+    return document
+
+
+async def update(metadata: Metadata, previous: dict) -> dict | None:
+    """
+    Replace the global and captures of a metadata by a new revision, leaving
+    its annotations as they are, and record the revision in the versions
+    collection.
+
+    Parameters
+    ----------
+    metadata : Metadata
+        The new metadata, its annotations are ignored.
+    previous : dict
+        The global and computed fields of the stored metadata, see
+        get_revision_update. The metadata is only updated while it is still
+        at the revision of previous.
+
+    Returns
+    -------
+    dict
+        The new revision of the metadata, without its annotations, or None
+        when the stored metadata has changed since previous was read, or
+        another revision of it is being written.
+    """
+    origin = metadata.globalMetadata.traceability_origin
+    document, _ = to_documents(metadata)
+    update = get_revision_update(document, previous, keep_annotation_fields=True)
+    lease = get_lease()
+    update["$set"][WRITING_FIELD] = lease
+    document = await collection().find_one_and_update(
+        {
+            **origin_query(origin.account, origin.container, origin.file_path),
+            REVISION_FIELD: previous["global"].get("traceability:revision"),
+            **not_writing_query(),
+        },
+        update,
+        return_document=ReturnDocument.AFTER,
     )
-    await versions.insert_one(metadata.dict(by_alias=True, exclude_unset=True))
+    if document is None:
+        return None
+    try:
+        # a checkpoint reads the annotations, which no other revision writes
+        await version_repo.insert(document, previous)
+    finally:
+        await release(document, lease)
+    return document
+
+
+async def write_annotations(
+    account, container, filepath, upserts: list[dict], deletes: list[str]
+) -> dict | None:
+    """
+    Upsert and delete annotations of a metadata, as a new revision of it.
+
+    Parameters
+    ----------
+    account : str
+        The account name.
+    container : str
+        The container name.
+    filepath : str
+        The filepath
+    upserts : list[dict]
+        The SigMF annotations to insert or replace, identified by their
+        core:uuid.
+    deletes : list[str]
+        The core:uuid of the annotations to delete.
+
+    Returns
+    -------
+    dict
+        The new revision of the metadata, without its annotations, or None
+        when there is no such metadata, or another revision of it is being
+        written.
+    """
+    lease = get_lease()
+    document = await collection().find_one_and_update(
+        {**origin_query(account, container, filepath), **not_writing_query()},
+        {"$inc": {REVISION_FIELD: 1}, "$set": {WRITING_FIELD: lease}},
+        return_document=ReturnDocument.AFTER,
+    )
+    if document is None:
+        return None
+    try:
+        await annotation_repo.write(account, container, filepath, upserts, deletes)
+        summary = await annotation_repo.get_label_summary(account, container, filepath)
+        document = await collection().find_one_and_update(
+            {"_id": document["_id"]},
+            {
+                "$set": {
+                    f"{SEARCH_FIELD}.labels": normalize_distinct(summary["labels"]),
+                    f"{SEARCH_FIELD}.comments": normalize_distinct(summary["comments"]),
+                    f"{DERIVED_FIELD}.annotation_count": summary["count"],
+                },
+            },
+            return_document=ReturnDocument.AFTER,
+        )
+        # the global and captures are left as they were at the revision before
+        await version_repo.insert(document, document, upserts, deletes)
+    finally:
+        await release(document, lease)
+    return document
+
+
+def get_migrated_uuid(origin: dict, index: int) -> str:
+    """
+    Get the core:uuid of an annotation embedded in a metadata document, from
+    its recording and position.
+    """
+    name = f"{origin['account']}/{origin['container']}/{origin['file_path']}#{index}"
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, name))
+
+
+async def backfill_computed_fields():
+    """
+    Add the computed fields to the metadata stored before they existed, and
+    move the annotations embedded in metadata documents to the annotations
+    collection. Runs at startup, and does nothing once every metadata is up
+    to date.
+    """
+    metadata_collection: AgnosticCollection = collection()
+    requests: list[UpdateOne] = []
+    try:
+        async for document in metadata_collection.find(
+            {
+                "$or": [
+                    {SEARCH_FIELD: {"$exists": False}},
+                    {DERIVED_FIELD: {"$exists": False}},
+                    {"annotations": {"$exists": True}},
+                    # search fields stored before accounts were searchable
+                    {
+                        f"{SEARCH_FIELD}.account": {"$exists": False},
+                        "global.traceability:origin.account": {"$exists": True},
+                    },
+                ]
+            },
+            {"global": 1, "captures": 1, "annotations": 1},
+        ):
+            origin = document.get("global", {}).get("traceability:origin")
+            update: dict = {}
+            if origin is None:
+                # without an origin the annotations cannot be moved
+                annotations = document.get("annotations") or []
+            elif "annotations" in document:
+                # the same uuids on every run, so that a migration that is
+                # interrupted, or run by several workers, rewrites the same
+                # annotations rather than duplicating them
+                annotations = [
+                    {
+                        **annotation,
+                        "core:uuid": annotation.get("core:uuid")
+                        or get_migrated_uuid(origin, index),
+                    }
+                    for index, annotation in enumerate(document["annotations"])
+                ]
+                await annotation_repo.write(
+                    origin["account"],
+                    origin["container"],
+                    origin["file_path"],
+                    annotations,
+                    [],
+                )
+                update["$unset"] = {"annotations": ""}
+            else:
+                annotations = await annotation_repo.get_all(
+                    origin["account"],
+                    origin["container"],
+                    origin["file_path"],
+                    {"core:label": 1, "core:comment": 1},
+                )
+            update["$set"] = get_computed_fields(
+                {**document, "annotations": annotations}
+            )
+            requests.append(UpdateOne({"_id": document["_id"]}, update))
+            if len(requests) >= BACKFILL_BATCH_SIZE:
+                await metadata_collection.bulk_write(requests, ordered=False)
+                requests = []
+        if requests:
+            await metadata_collection.bulk_write(requests, ordered=False)
+    except PyMongoError as e:
+        logger.error("Could not add the computed fields of the metadata: %s", e)
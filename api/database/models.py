@@ -81,6 +81,27 @@ class Metadata(BaseModel):
     annotations: list[MetadataAnnotation]
 
 
+class AnnotationChanges(BaseModel):
+    upsert: list[MetadataAnnotation] = []
+    delete: list[str] = []
+
+
+class MetadataSummary(BaseModel):
+    account: str
+    container: str
+    file_path: str
+    datatype: str | None
+    sample_rate: float | None
+    frequency: float | None
+    description: str | None
+    annotation_count: int
+
+
+class MetadataUpload(BaseModel):
+    file_path: str
+    metadata: Metadata
+
+
 class Plugin(BaseModel):
     name: str
     url: str
@@ -0,0 +1,82 @@
+import re
+import unicodedata
+
+# Normalized copies of the searchable fields of a metadata, maintained on
+# every write so that exact and prefix searches are served by an index
+SEARCH_FIELD = "_search"
+
+MATCH_MODES = ["exact", "prefix", "contains"]
+
+
+def normalize(text: str) -> str:
+    """
+    Normalize a text for searching: case folded, compatibility decomposed
+    and with its whitespace collapsed.
+    """
+    return " ".join(unicodedata.normalize("NFKC", text).casefold().split())
+
+
+def normalize_distinct(values) -> list[str]:
+    """
+    Normalize values, skipping empty ones, and get the distinct results in
+    order.
+    """
+    return sorted({normalize(value) for value in values if value})
+
+
+def get_search_fields(document: dict) -> dict:
+    """
+    Get the normalized search fields of a metadata document.
+
+    Parameters
+    ----------
+    document : dict
+        The metadata, as stored in the database.
+
+    Returns
+    -------
+    dict
+        The normalized account, container, author, description, and the
+        distinct labels and comments of the annotations.
+    """
+    global_metadata = document.get("global") or {}
+    origin = global_metadata.get("traceability:origin") or {}
+    annotations = document.get("annotations") or []
+    fields: dict = {
+        "labels": normalize_distinct(
+            annotation.get("core:label") for annotation in annotations
+        ),
+        "comments": normalize_distinct(
+            annotation.get("core:comment") for annotation in annotations
+        ),
+    }
+    for name in ["author", "description"]:
+        if global_metadata.get(f"core:{name}"):
+            fields[name] = normalize(global_metadata[f"core:{name}"])
+    for name in ["account", "container"]:
+        if origin.get(name):
+            fields[name] = normalize(origin[name])
+    return fields
+
+
+def get_match(value: str, match: str):
+    """
+    Get the condition matching a value against a normalized search field,
+    exactly, as a prefix or anywhere in the field. Exact values and
+    prefixes, anchored regular expressions, are served by the index of the
+    field, while "contains" is an unanchored regular expression that MongoDB
+    checks against every value of the field.
+
+    Parameters
+    ----------
+    value : str
+        The searched value, normalized like the field.
+    match : str
+        "exact", "prefix" or "contains".
+    """
+    value = normalize(value)
+    if match == "exact":
+        return value
+    if match == "prefix":
+        return re.compile("^" + re.escape(value))
+    return re.compile(re.escape(value))
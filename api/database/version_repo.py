@@ -0,0 +1,254 @@
+import logging
+import os
+
+from database import annotation_repo
+from database.database import db
+from helpers.jsonpatch import apply_patch, make_patch
+from motor.core import AgnosticCollection
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import PyMongoError
+
+logger = logging.getLogger("api")
+
+# Every CHECKPOINT_INTERVAL revisions of a metadata, its version is stored
+# whole, with its annotations. The versions in between only store what
+# changed since the revision before, so that a revision is rebuilt from at
+# most CHECKPOINT_INTERVAL versions
+CHECKPOINT_INTERVAL = max(int(os.getenv("IQENGINE_VERSION_CHECKPOINT_INTERVAL", 20)), 1)
+
+ORIGIN_FIELD = "global.traceability:origin"
+REVISION_FIELD = "global.traceability:revision"
+
+
+def collection() -> AgnosticCollection:
+    collection: AgnosticCollection = db().versions
+    return collection
+
+
+def origin_query(account, container, filepath) -> dict:
+    return {
+        f"{ORIGIN_FIELD}.account": account,
+        f"{ORIGIN_FIELD}.container": container,
+        f"{ORIGIN_FIELD}.file_path": filepath,
+    }
+
+
+def get_state(document: dict) -> dict:
+    """
+    Get the global and captures of a metadata document, without its
+    revision, which versions tell apart.
+    """
+    return {
+        "global": {
+            key: value
+            for key, value in document["global"].items()
+            if key != "traceability:revision"
+        },
+        "captures": document.get("captures", []),
+    }
+
+
+def to_checkpoint(document: dict, annotations: list[dict]) -> dict:
+    """
+    Get the version of a metadata stored whole: its global, captures and
+    annotations.
+    """
+    return {
+        "global": document["global"],
+        "captures": document.get("captures", []),
+        "annotations": annotations,
+    }
+
+
+def to_delta(
+    document: dict, previous: dict, upserts: list[dict], deletes: list[str]
+) -> dict:
+    """
+    Get the version of a metadata stored as the changes since the revision
+    before: a JSON patch of its global and captures, and the annotations it
+    upserted and deleted.
+    """
+    return {
+        "global": {
+            "traceability:origin": document["global"]["traceability:origin"],
+            "traceability:revision": document["global"]["traceability:revision"],
+        },
+        "patch": make_patch(get_state(previous), get_state(document)),
+        "annotation_changes": {"upsert": upserts, "delete": deletes},
+    }
+
+
+async def insert(
+    document: dict,
+    previous: dict | None = None,
+    upserts: list[dict] | None = None,
+    deletes: list[str] | None = None,
+    annotations: list[dict] | None = None,
+):
+    """
+    Record a revision of a metadata in the versions collection.
+
+    Parameters
+    ----------
+    document : dict
+        The new revision of the metadata, without its annotations.
+    previous : dict, optional
+        The global and captures of the revision before, None for the first
+        revision.
+    upserts : list[dict], optional
+        The annotations upserted by the revision.
+    deletes : list[str], optional
+        The core:uuid of the annotations deleted by the revision.
+    annotations : list[dict], optional
+        All the annotations of the revision, read from the annotations
+        collection when a checkpoint needs them and they are not given.
+    """
+    revision = document["global"].get("traceability:revision") or 0
+    if previous is None or revision % CHECKPOINT_INTERVAL == 0:
+        if annotations is None:
+            origin = document["global"]["traceability:origin"]
+            annotations = await annotation_repo.get_all(
+                origin["account"], origin["container"], origin["file_path"]
+            )
+        version = to_checkpoint(document, annotations)
+    else:
+        version = to_delta(document, previous, upserts or [], deletes or [])
+    await collection().insert_one(version)
+
+
+async def insert_many(revisions: list[tuple[dict, list[dict]]]):
+    """
+    Record the first revisions of new metadata, as checkpoints, in one
+    unordered write.
+
+    Parameters
+    ----------
+    revisions : list[tuple[dict, list[dict]]]
+        Each metadata, without its annotations, and its annotations.
+    """
+    if revisions:
+        await collection().insert_many(
+            [
+                to_checkpoint(document, annotations)
+                for document, annotations in revisions
+            ],
+            ordered=False,
+        )
+
+
+async def get(account, container, filepath, revision: int) -> dict | None:
+    """
+    Rebuild a revision of a metadata from its versions: the last checkpoint
+    up to the revision, and the changes of the versions after it.
+
+    Parameters
+    ----------
+    account : str
+        The account name.
+    container : str
+        The container name.
+    filepath : str
+        The filepath
+    revision : int
+        The revision.
+
+    Returns
+    -------
+    dict
+        The metadata at that revision, with its annotations, or None when
+        the revision, or one it is rebuilt from, is not stored.
+    """
+    query = origin_query(account, container, filepath)
+    checkpoint = await collection().find_one(
+        {**query, REVISION_FIELD: {"$lte": revision}, "annotations": {"$exists": True}},
+        sort=[(REVISION_FIELD, DESCENDING)],
+    )
+    if checkpoint is None:
+        return None
+    state = get_state(checkpoint)
+    annotations = {
+        annotation.get("core:uuid") or index: annotation
+        for index, annotation in enumerate(checkpoint["annotations"])
+    }
+    expected = checkpoint["global"]["traceability:revision"] + 1
+    versions = collection().find(
+        {**query, REVISION_FIELD: {"$gt": expected - 1, "$lte": revision}},
+        sort=[(REVISION_FIELD, ASCENDING)],
+    )
+    async for version in versions:
+        if version["global"]["traceability:revision"] != expected:
+            return None
+        expected += 1
+        if "patch" in version:
+            state = apply_patch(state, version["patch"])
+        else:
+            # versions stored whole before they were stored as changes
+            state = get_state(version)
+        changes = version.get("annotation_changes", {})
+        for annotation_uuid in changes.get("delete", []):
+            annotations.pop(annotation_uuid, None)
+        for annotation in changes.get("upsert", []):
+            annotations[annotation["core:uuid"]] = annotation
+    if expected != revision + 1:
+        return None
+    state["global"]["traceability:revision"] = revision
+    state["annotations"] = sorted(
+        annotations.values(),
+        key=lambda annotation: annotation.get("core:sample_start", 0),
+    )
+    return state
+
+
+async def compact(keep: int):
+    """
+    Prune the versions of every metadata but its last keep revisions. The
+    oldest revision kept is rewritten as a checkpoint, so that it no longer
+    depends on the versions pruned.
+    """
+    recordings = collection().aggregate(
+        [
+            {
+                "$group": {
+                    "_id": f"${ORIGIN_FIELD}",
+                    "first": {"$min": f"${REVISION_FIELD}"},
+                    "last": {"$max": f"${REVISION_FIELD}"},
+                }
+            }
+        ]
+    )
+    async for recording in recordings:
+        origin = recording["_id"]
+        oldest = recording["last"] - keep + 1
+        if origin is None or recording["first"] >= oldest:
+            continue
+        query = origin_query(
+            origin["account"], origin["container"], origin["file_path"]
+        )
+        checkpoint = await get(
+            origin["account"], origin["container"], origin["file_path"], oldest
+        )
+        if checkpoint is None:
+            logger.warning(
+                "Versions of %s/%s/%s cannot be compacted, revision %s is missing",
+                origin["account"],
+                origin["container"],
+                origin["file_path"],
+                oldest,
+            )
+            continue
+        await collection().replace_one({**query, REVISION_FIELD: oldest}, checkpoint)
+        await collection().delete_many({**query, REVISION_FIELD: {"$lt": oldest}})
+
+
+async def compact_versions():
+    """
+    Prune old versions when IQENGINE_VERSION_RETENTION is set to the number
+    of revisions of each metadata to keep. Runs at startup.
+    """
+    keep = int(os.getenv("IQENGINE_VERSION_RETENTION", 0))
+    if keep <= 0:
+        return
+    try:
+        await compact(keep)
+    except PyMongoError as e:
+        logger.error("Could not compact the versions of the metadata: %s", e)
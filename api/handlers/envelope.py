@@ -0,0 +1,206 @@
+import asyncio
+from typing import Optional
+
+import numpy as np
+from blob.client_factory import get_storage_client
+from blob.storage_client import BlobStorageClient
+from cachetools import LRUCache
+from database import datasource_repo
+from database.models import DataSource
+from fastapi import APIRouter, Depends, HTTPException, Query
+from handlers.spectrogram import get_data_type
+from helpers.authorization import required_roles
+from helpers.cipher import decrypt
+from helpers.compute import compute_pool
+from helpers.concurrency import download_limiter
+from helpers.singleflight import SingleFlight
+from helpers.urlmapping import ApiType, get_file_name
+from rf.envelope import (
+    BLOCK_SIZE,
+    POINT_BYTES,
+    build_levels,
+    decode_header,
+    encode_envelope,
+    get_block_envelope,
+    get_level_range,
+)
+from rf.samples import get_bytes_per_iq_sample
+
+router = APIRouter()
+
+# Headers of envelope sidecars keyed by (account, container, filepath, data etag)
+envelope_headers: LRUCache[tuple, dict] = LRUCache(maxsize=1024)
+envelope_flights: SingleFlight[dict] = SingleFlight()
+
+# Bytes read to find the header at the start of a sidecar
+HEADER_READ_BYTES = 64 * 1024
+
+# Blocks of a recording reduced at once by the compute pool
+ENVELOPE_PIECE_BLOCKS = 1024
+
+# Most points returned for one request
+MAX_WIDTH = 65536
+
+
+def build_envelope(
+    pieces: list[np.ndarray], sample_count: int, block_size: int, source_etag: str
+) -> bytes:
+    return encode_envelope(
+        build_levels(np.concatenate(pieces)), sample_count, block_size, source_etag
+    )
+
+
+async def create_envelope(
+    storage_client: BlobStorageClient,
+    filepath: str,
+    data_type: str,
+    sample_count: int,
+    source_etag: str,
+) -> dict:
+    """
+    Compute the envelope pyramid of a recording by streaming it once, then
+    upload it as a sidecar next to the .sigmf-data blob.
+
+    Returns
+    -------
+    dict
+        The header of the uploaded sidecar.
+    """
+    piece_bytes = (
+        ENVELOPE_PIECE_BLOCKS * BLOCK_SIZE * get_bytes_per_iq_sample(data_type)
+    )
+    buffer = bytearray()
+    pieces: list[np.ndarray] = []
+    pending: list[asyncio.Future] = []
+
+    def reduce_buffer(length: int):
+        piece = bytes(buffer[:length])
+        del buffer[:length]
+        pending.append(
+            asyncio.ensure_future(
+                compute_pool.run(get_block_envelope, piece, data_type, BLOCK_SIZE)
+            )
+        )
+
+    try:
+        async with download_limiter.limit(storage_client.account):
+            stream = await storage_client.get_blob_stream(
+                get_file_name(filepath, ApiType.IQDATA)
+            )
+            async for chunk in stream.chunks():
+                buffer.extend(chunk)
+                while len(buffer) >= piece_bytes:
+                    reduce_buffer(piece_bytes)
+                # download the next piece while the previous ones are reduced
+                while len(pending) > 1:
+                    pieces.append(await pending.pop(0))
+        if buffer:
+            reduce_buffer(len(buffer))
+        for task in pending:
+            pieces.append(await task)
+    finally:
+        for task in pending:
+            task.cancel()
+
+    envelope = await compute_pool.run(
+        build_envelope, pieces, sample_count, BLOCK_SIZE, source_etag
+    )
+    await storage_client.upload_blob(
+        filepath=get_file_name(filepath, ApiType.ENVELOPE), data=envelope
+    )
+    return decode_header(envelope)
+
+
+async def get_envelope_header(
+    storage_client: BlobStorageClient,
+    filepath: str,
+    data_type: str,
+    sample_count: int,
+    source_etag: str,
+) -> dict:
+    """
+    Get the header of the envelope sidecar of a recording, creating the
+    sidecar when it is missing or was computed from a previous version of
+    the recording.
+    """
+    envelope_path = get_file_name(filepath, ApiType.ENVELOPE)
+    if await storage_client.blob_exist(envelope_path):
+        content = await storage_client.get_blob_content(
+            envelope_path, offset=0, length=HEADER_READ_BYTES
+        )
+        header = decode_header(content)
+        if header is not None and header["source_etag"] == source_etag:
+            return header
+    return await create_envelope(
+        storage_client, filepath, data_type, sample_count, source_etag
+    )
+
+
+@router.get("/api/datasources/{account}/{container}/{filepath:path}/envelope")
+async def get_envelope(
+    filepath: str,
+    start: int = Query(0, ge=0),
+    count: Optional[int] = Query(None, ge=1),
+    width: int = Query(1000, ge=1, le=MAX_WIDTH),
+    datasource: DataSource = Depends(datasource_repo.get),
+    storage_client: BlobStorageClient = Depends(get_storage_client),
+    current_user: Optional[dict] = Depends(required_roles()),
+):
+    """
+    Get the min, max and RMS of the I and Q channels of a range of samples,
+    in at most width points, for drawing time plots without the raw IQ.
+    The values come from an envelope pyramid stored as a .sigmf-envelope
+    sidecar, created by the first request for a recording.
+    """
+    if not datasource:
+        raise HTTPException(status_code=404, detail="Datasource not found")
+    data_type = await get_data_type(datasource, filepath)
+
+    storage_client.set_sas_token(decrypt(datasource.sasToken.get_secret_value()))
+    properties = await storage_client.get_blob_properties(
+        get_file_name(filepath, ApiType.IQDATA)
+    )
+    key = (datasource.account, datasource.container, filepath, properties.etag)
+    header = envelope_headers.get(key)
+    if header is None:
+        header = await envelope_flights.do(
+            key,
+            lambda: get_envelope_header(
+                storage_client,
+                filepath,
+                data_type,
+                properties.size // get_bytes_per_iq_sample(data_type),
+                properties.etag,
+            ),
+        )
+        envelope_headers[key] = header
+
+    if count is None:
+        count = header["sample_count"] - start
+    level, first, points = get_level_range(header, start, count, width)
+    samples_per_point = header["block_size"] * header["level_factor"] ** level
+    if points > 0:
+        content = await storage_client.get_blob_content(
+            get_file_name(filepath, ApiType.ENVELOPE),
+            offset=header["data_start"]
+            + header["levels"][level]["offset"]
+            + first * POINT_BYTES,
+            length=points * POINT_BYTES,
+        )
+        values = np.frombuffer(content, dtype="<f4").reshape(-1, 2, 3)
+    else:
+        values = np.zeros((0, 2, 3), dtype=np.float32)
+
+    return {
+        "level": level,
+        "start": first * samples_per_point,
+        "samples_per_point": samples_per_point,
+        **{
+            channel: {
+                "min": values[:, index, 0].tolist(),
+                "max": values[:, index, 1].tolist(),
+                "rms": values[:, index, 2].tolist(),
+            }
+            for index, channel in enumerate(["i", "q"])
+        },
+    }
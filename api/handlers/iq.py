@@ -2,28 +2,41 @@ import asyncio
 import base64
 import io
 import logging
+import struct
+import uuid
+from email.utils import format_datetime
 from typing import List, Optional
 
-from blob.azure_client import AzureBlobClient
+from blob.client_factory import get_storage_client
+from blob.storage_client import BlobStorageClient
 from database import datasource_repo
 from database.models import DataSource
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, Header, HTTPException
 from fastapi.responses import StreamingResponse
 from helpers.authorization import required_roles
 from helpers.cipher import decrypt
+from helpers.concurrency import download_limiter
 
 from helpers.conversions import find_smallest_and_largest_next_to_each_other
+from helpers.ranges import RangeNotSatisfiable, is_strong_match, parse_range_header
 from helpers.urlmapping import ApiType, get_content_type, get_file_name
 from pydantic import BaseModel, SecretStr
 from rf.samples import get_bytes_per_iq_sample
 
 router = APIRouter()
 
+# Header of each tile frame in the binary /iqslices response: index, byte count
+TILE_FRAME_HEADER = struct.Struct("<II")
+
+# Largest range downloaded at once when adjacent tiles are merged
+MAX_TILE_RANGE_BYTES = 32 * 1024 * 1024
+
 
 class IQData(BaseModel):
     indexes: List[int]
     tile_size: int
     bytes_per_sample: int
+    max_gap: int = 0
 
 
 async def get_sas_token(
@@ -48,7 +61,7 @@ async def get_iq_data(
     block_size: int,
     format: str,
     datasource: DataSource = Depends(datasource_repo.get),
-    azure_client: AzureBlobClient = Depends(AzureBlobClient),
+    storage_client: BlobStorageClient = Depends(get_storage_client),
 ):
     if not datasource:
         raise HTTPException(status_code=404, detail="Datasource not found")
@@ -60,7 +73,7 @@ async def get_iq_data(
                 block_size,
                 get_bytes_per_iq_sample(format),
                 get_file_name(filepath, ApiType.IQDATA),
-                azure_client,
+                storage_client,
             ),
             media_type="application/octet-stream",
         )
@@ -69,9 +82,10 @@ async def get_iq_data(
 
 
 async def get_byte_stream(
-    block_indexes, block_size, bytes_per_iq_sample, iq_file, azure_client
+    block_indexes, block_size, bytes_per_iq_sample, iq_file, storage_client
 ):
     block_indexes_arrs = find_smallest_and_largest_next_to_each_other(block_indexes)
+    blob_size = await storage_client.get_file_length(iq_file)
 
     for block_index_arr in block_indexes_arrs:
         offsetBytes = block_index_arr[0] * block_size * bytes_per_iq_sample
@@ -81,13 +95,12 @@ async def get_byte_stream(
             * bytes_per_iq_sample
         )
 
-        blob_size = await azure_client.get_file_length(iq_file)
         if blob_size < offsetBytes:
             return
         if blob_size < offsetBytes + countBytes:
             countBytes = blob_size - offsetBytes
 
-        content = await azure_client.get_blob_content(
+        content = await storage_client.get_blob_content(
             filepath=iq_file, offset=offsetBytes, length=countBytes
         )
 
@@ -101,21 +114,111 @@ async def get_byte_stream(
 async def get_iqfile(
     filepath: str,
     datasource: DataSource = Depends(datasource_repo.get),
-    azure_client: AzureBlobClient = Depends(AzureBlobClient),
+    storage_client: BlobStorageClient = Depends(get_storage_client),
+    range_header: Optional[str] = Header(None, alias="Range"),
+    if_range: Optional[str] = Header(None, alias="If-Range"),
     current_user: Optional[dict] = Depends(required_roles()),
 ):
+    """
+    Download a .sigmf-data file. Honors Range and If-Range requests: a single
+    range is returned as 206 Partial Content and several ranges as a
+    multipart/byteranges body.
+    """
     # Create the imageURL with sasToken
     if not datasource:
         raise HTTPException(status_code=404, detail="Datasource not found")
 
-    azure_client.set_sas_token(decrypt(datasource.sasToken.get_secret_value()))
+    storage_client.set_sas_token(decrypt(datasource.sasToken.get_secret_value()))
     content_type = get_content_type(ApiType.IQDATA)
     iq_path = get_file_name(filepath, ApiType.IQDATA)
-    if not azure_client.blob_exist(iq_path):
+    if not await storage_client.blob_exist(iq_path):
         raise HTTPException(status_code=404, detail="File not found")
 
-    response = await azure_client.get_blob_stream(iq_path)
-    return StreamingResponse(response.chunks(), media_type=content_type)
+    properties = await storage_client.get_blob_properties(iq_path)
+    blob_size = int(properties.size)
+    headers = {"Accept-Ranges": "bytes"}
+    if properties.etag:
+        headers["ETag"] = properties.etag
+    if properties.last_modified:
+        headers["Last-Modified"] = format_datetime(
+            properties.last_modified, usegmt=True
+        )
+
+    # a Range is only valid for the version of the file named in If-Range
+    if if_range and not is_strong_match(
+        if_range, headers.get("ETag"), headers.get("Last-Modified")
+    ):
+        range_header = None
+    try:
+        ranges = parse_range_header(range_header, blob_size)
+    except RangeNotSatisfiable:
+        raise HTTPException(
+            status_code=416,
+            detail="Range not satisfiable",
+            headers={"Content-Range": f"bytes */{blob_size}"},
+        )
+
+    if ranges is None:
+        headers["Content-Length"] = str(blob_size)
+        response = await storage_client.get_blob_stream(iq_path)
+        return StreamingResponse(
+            response.chunks(), media_type=content_type, headers=headers
+        )
+
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        headers["Content-Range"] = f"bytes {start}-{end}/{blob_size}"
+        headers["Content-Length"] = str(end - start + 1)
+        response = await storage_client.get_blob_stream(
+            iq_path, offset=start, length=end - start + 1
+        )
+        return StreamingResponse(
+            response.chunks(),
+            status_code=206,
+            media_type=content_type,
+            headers=headers,
+        )
+
+    boundary = uuid.uuid4().hex
+    part_headers = [
+        (
+            f"--{boundary}\r\nContent-Type: {content_type}\r\n"
+            f"Content-Range: bytes {start}-{end}/{blob_size}\r\n\r\n"
+        ).encode()
+        for start, end in ranges
+    ]
+    closing = f"--{boundary}--\r\n".encode()
+    headers["Content-Length"] = str(
+        sum(
+            len(part_header) + end - start + 1 + 2
+            for part_header, (start, end) in zip(part_headers, ranges)
+        )
+        + len(closing)
+    )
+    return StreamingResponse(
+        get_byteranges_stream(storage_client, iq_path, ranges, part_headers, closing),
+        status_code=206,
+        media_type=f"multipart/byteranges; boundary={boundary}",
+        headers=headers,
+    )
+
+
+async def get_byteranges_stream(
+    storage_client: BlobStorageClient,
+    iq_path: str,
+    ranges: list[tuple[int, int]],
+    part_headers: list[bytes],
+    closing: bytes,
+):
+    for part_header, (start, end) in zip(part_headers, ranges):
+        yield part_header
+        response = await storage_client.get_blob_stream(
+            iq_path, offset=start, length=end - start + 1
+        )
+        async for chunk in response.chunks():
+            yield chunk
+        yield b"\r\n"
+    yield closing
 
 
 @router.get(
@@ -127,15 +230,15 @@ async def get_iq(
     offsetBytes: int,
     countBytes: int,
     datasource: DataSource = Depends(datasource_repo.get),
-    azure_client: AzureBlobClient = Depends(AzureBlobClient),
+    storage_client: BlobStorageClient = Depends(get_storage_client),
     current_user: Optional[dict] = Depends(required_roles()),
 ):
     if not datasource:
         raise HTTPException(status_code=404, detail="Datasource not found")
     try:
-        azure_client.set_sas_token(decrypt(datasource.sasToken.get_secret_value()))
+        storage_client.set_sas_token(decrypt(datasource.sasToken.get_secret_value()))
         iq_file = get_file_name(filepath, ApiType.IQDATA)
-        blob = await azure_client.get_blob_content(
+        blob = await storage_client.get_blob_content(
             filepath=iq_file, offset=offsetBytes, length=countBytes
         )
         data = io.BytesIO(blob)
@@ -146,24 +249,96 @@ async def get_iq(
         raise HTTPException(status_code=400, detail=str(e))
 
 
-async def download_blob(
-    azure_client: AzureBlobClient,
+def plan_tile_ranges(
+    indexes: List[int], tile_bytes: int, max_gap: int = 0
+) -> List[List[int]]:
+    """
+    Plan the ranged downloads needed for a set of tiles. Adjacent tiles, and
+    tiles separated by at most max_gap missing tiles, share one download as
+    long as it stays under MAX_TILE_RANGE_BYTES.
+
+    Parameters
+    ----------
+    indexes : List[int]
+        The requested tile indexes.
+    tile_bytes : int
+        The size of a tile in bytes.
+    max_gap : int, optional
+        The number of unrequested tiles that may be downloaded to merge two
+        ranges. Defaults to 0.
+
+    Returns
+    -------
+    List[List[int]]
+        The inclusive [start, end] tile index of each download.
+    """
+    max_tiles = max(MAX_TILE_RANGE_BYTES // tile_bytes, 1)
+    tile_ranges = []
+    for start, end in find_smallest_and_largest_next_to_each_other(
+        list(set(indexes)), max(max_gap, 0)
+    ):
+        for range_start in range(start, end + 1, max_tiles):
+            tile_ranges.append([range_start, min(range_start + max_tiles - 1, end)])
+    return tile_ranges
+
+
+async def download_tile_range(
+    storage_client: BlobStorageClient,
     filepath: str,
-    index: int,
-    tile_size: int,
-    bytes_per_sample: int,
+    tile_range: List[int],
+    indexes: set[int],
+    tile_bytes: int,
     blob_size: int,
-):
-    offsetBytes = index * tile_size * bytes_per_sample * 2
-    countBytes = tile_size * bytes_per_sample * 2
-    if (offsetBytes + countBytes) > blob_size:
-        countBytes = blob_size - offsetBytes
-    blob = await azure_client.get_blob_content(
-        filepath=filepath, offset=offsetBytes, length=countBytes
-    )
-    data = io.BytesIO(blob)
-    encoded_data = base64.b64encode(data.getvalue()).decode("utf-8")
-    return {"index": index, "data": encoded_data}
+) -> List[tuple[int, bytes]]:
+    """
+    Download a range of tiles with one request and split it back into the
+    requested tiles. Tiles past the end of the blob are returned empty.
+    """
+    offsetBytes = tile_range[0] * tile_bytes
+    countBytes = min((tile_range[1] + 1) * tile_bytes, blob_size) - offsetBytes
+    content = b""
+    if countBytes > 0:
+        content = await storage_client.get_blob_content(
+            filepath=filepath, offset=offsetBytes, length=countBytes
+        )
+    tiles = []
+    for index in range(tile_range[0], tile_range[1] + 1):
+        if index in indexes:
+            start = (index - tile_range[0]) * tile_bytes
+            tiles.append((index, content[start : start + tile_bytes]))
+    return tiles
+
+
+async def get_tile_frames(account: str, range_downloads):
+    """
+    Stream tiles as binary frames in the order their downloads finish. Each
+    frame is a little-endian uint32 tile index, a little-endian uint32 byte
+    count and then the raw bytes of the tile.
+
+    Parameters
+    ----------
+    account : str
+        The storage account the tiles are downloaded from.
+    range_downloads : list
+        The download_tile_range coroutines of the requested tiles.
+
+    Yields
+    ------
+    bytes
+        The frame headers and tile contents.
+    """
+    tasks = [
+        asyncio.ensure_future(download_limiter.run(account, download))
+        for download in range_downloads
+    ]
+    try:
+        for task in asyncio.as_completed(tasks):
+            for index, content in await task:
+                yield TILE_FRAME_HEADER.pack(index, len(content))
+                yield content
+    finally:
+        for task in tasks:
+            task.cancel()
 
 
 @router.post(
@@ -173,36 +348,56 @@ async def get_iq_data_slices(
     iq_data: IQData,
     filepath: str,
     datasource: DataSource = Depends(datasource_repo.get),
-    azure_client: AzureBlobClient = Depends(AzureBlobClient),
+    storage_client: BlobStorageClient = Depends(get_storage_client),
+    accept: Optional[str] = Header(None),
     current_user: Optional[dict] = Depends(required_roles()),
 ):
+    """
+    Get the tiles of IQ data at the requested indexes. By default the tiles are
+    returned as a JSON list of base64 encoded tiles; a request that accepts
+    application/octet-stream receives a stream of binary frames instead, see
+    get_tile_frames.
+    """
     if not datasource:
         raise HTTPException(status_code=404, detail="Datasource not found")
     try:
-        azure_client.set_sas_token(decrypt(datasource.sasToken.get_secret_value()))
+        storage_client.set_sas_token(decrypt(datasource.sasToken.get_secret_value()))
         logger = logging.getLogger("api")
         logger.info(f"tile_size: {iq_data.tile_size}")
         iq_file = get_file_name(filepath, ApiType.IQDATA)
-        blob_properties = await azure_client.get_blob_properties(iq_file)
+        blob_properties = await storage_client.get_blob_properties(iq_file)
         blob_size = blob_properties.size
+        tile_bytes = iq_data.tile_size * iq_data.bytes_per_sample * 2
+        indexes = set(iq_data.indexes)
 
-        data_list = []
-
-        # asyncio solution. Much faster
-        tasks = [
-            download_blob(
-                azure_client,
-                iq_file,
-                index,
-                iq_data.tile_size,
-                iq_data.bytes_per_sample,
-                blob_size,
+        range_downloads = [
+            download_tile_range(
+                storage_client, iq_file, tile_range, indexes, tile_bytes, blob_size
+            )
+            for tile_range in plan_tile_ranges(
+                iq_data.indexes, tile_bytes, iq_data.max_gap
             )
-            for index in iq_data.indexes
         ]
-        data_list = await asyncio.gather(*tasks)
 
-        return data_list
+        if accept and get_content_type(ApiType.IQDATA) in accept:
+            return StreamingResponse(
+                get_tile_frames(storage_client.account, range_downloads),
+                media_type=get_content_type(ApiType.IQDATA),
+            )
+
+        tiles = {}
+        for range_tiles in await download_limiter.gather(
+            storage_client.account, range_downloads
+        ):
+            tiles.update(range_tiles)
+
+        return [
+            {
+                "index": index,
+                "data": base64.b64encode(tiles[index]).decode("utf-8"),
+            }
+            for index in iq_data.indexes
+        ]
 
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
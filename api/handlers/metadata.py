@@ -1,18 +1,100 @@
+import asyncio
+import json
+import logging
+import os
 from datetime import datetime
-from typing import Any, Dict, List, Optional
+from typing import Any, AsyncIterator, Dict, List, Optional
 
-from blob.azure_client import AzureBlobClient
-from database import datasource_repo, metadata_repo
-from database.models import DataSource, DataSourceReference, Metadata
-from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query, Response
-from fastapi.responses import StreamingResponse
+from blob.client_factory import get_storage_client
+from blob.storage_client import BlobStorageClient
+from cachetools import LRUCache
+from database import annotation_repo, datasource_repo, metadata_repo, version_repo
+from database.models import (
+    AnnotationChanges,
+    DataSource,
+    DataSourceReference,
+    Metadata,
+    MetadataSummary,
+    MetadataUpload,
+)
+from database.derived import DERIVED_FIELD, to_utc
+from database.search import SEARCH_FIELD, get_match
+from fastapi import (
+    APIRouter,
+    Body,
+    Depends,
+    Header,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+)
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, StreamingResponse
+from helpers.annotation_index import AnnotationIndex
 from helpers.authorization import required_roles
 from helpers.cipher import decrypt
+from helpers.jsonpatch import (
+    JSON_PATCH_MEDIA_TYPE,
+    MERGE_PATCH_MEDIA_TYPE,
+    apply_merge_patch,
+    apply_patch,
+)
+from helpers.pagination import (
+    MAX_PAGE_SIZE,
+    NEXT_CURSOR_HEADER,
+    decode_cursor,
+    encode_cursor,
+)
+from helpers.singleflight import SingleFlight
 from helpers.urlmapping import ApiType, get_content_type, get_file_name
-from motor.core import AgnosticCollection
+from motor.core import AgnosticCollection, AgnosticCursor
+from pydantic import ValidationError
+from pymongo import ASCENDING
 
 router = APIRouter()
 
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+# Returned with any fields= projection so that partial metadata stay identifiable
+ORIGIN_FIELD = "global.traceability:origin"
+
+# Thumbnails generated by this worker, served from memory until their upload
+# to storage has finished, keyed by (account, container, filepath)
+thumbnail_cache: LRUCache[tuple[str, str, str], bytes] = LRUCache(
+    maxsize=max(int(os.getenv("IQENGINE_THUMBNAIL_CACHE_SIZE", 32 * 1024 * 1024)), 1),
+    getsizeof=len,
+)
+thumbnail_flights: SingleFlight[bytes] = SingleFlight()
+# Uploads of generated thumbnails, referenced until they are done so that
+# they are not garbage collected while they run
+thumbnail_uploads: set[asyncio.Task] = set()
+
+# Annotation indexes keyed by (account, container, filepath, revision), a new
+# revision of a metadata gets a new index
+annotation_indexes: LRUCache[tuple, AnnotationIndex] = LRUCache(
+    maxsize=max(int(os.getenv("IQENGINE_ANNOTATION_INDEX_CACHE_SIZE", 64)), 1)
+)
+annotation_index_flights: SingleFlight[AnnotationIndex] = SingleFlight()
+
+# Most annotations returned for one viewport
+MAX_ANNOTATIONS = 10000
+
+# Metadata whose annotations are read at once when listing a container
+ANNOTATION_BATCH_SIZE = 100
+
+# Most metadata created by one bulk request
+MAX_BULK_SIZE = 1000
+
+# Times a write is attempted when the metadata changes, or another revision
+# of it is being written, and the seconds waited, times the attempt, before
+# trying again
+WRITE_ATTEMPTS = 3
+WRITE_RETRY_DELAY = 0.05
+
+# Mean radius of the Earth in meters, to convert distances to radians
+EARTH_RADIUS = 6378100
+
 
 @router.get(
     "/api/datasources/{account}/{container}/meta",
@@ -22,25 +104,245 @@ router = APIRouter()
 async def get_all_meta(
     account,
     container,
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = Query(None),
+    fields: Optional[str] = Query(None),
+    summary: bool = Query(False),
+    accept: Optional[str] = Header(None),
     metadatas: AgnosticCollection = Depends(metadata_repo.collection),
     current_user: Optional[dict] = Depends(required_roles()),
 ):
+    """
+    List the metadata of a container, ordered by creation. With limit, one
+    page is returned and the X-Next-Cursor header, when there are more,
+    holds the cursor to pass to get the next one. Without limit, the whole
+    listing is streamed as it is read rather than held in memory. Asking for
+    application/x-ndjson streams one document per line.
+
+    fields, a comma separated list of dotted paths such as
+    global.core:datatype, returns only those fields and the origin of each
+    metadata. summary returns a MetadataSummary of each metadata instead,
+    computed by the database.
+    """
     # TODO: Should we validate datasource_id?
 
     # Return all metadata for this datasource, could be an empty
     # list
-    metadata = metadatas.find(
-        {
-            "global.traceability:origin.account": account,
-            "global.traceability:origin.container": container,
-        }
-    )
+    query: Dict[str, Any] = {
+        "global.traceability:origin.account": account,
+        "global.traceability:origin.container": container,
+    }
+    if cursor is not None:
+        query["_id"] = {"$gt": decode_cursor(cursor)}
+    projection = parse_fields(fields) if fields and not summary else None
+    annotation_projection = get_annotation_projection(projection)
+    ndjson = accept is not None and NDJSON_MEDIA_TYPE in accept
+    # one more document than the page tells whether there is a next one
+    page_size = None if limit is None else limit if ndjson else limit + 1
+
+    if summary:
+        metadata = metadatas.aggregate(
+            metadata_repo.get_summary_pipeline(query, page_size)
+        )
+    else:
+        metadata = metadatas.find(query, get_metadata_projection(projection)).sort(
+            "_id", ASCENDING
+        )
+        if page_size is not None:
+            metadata = metadata.limit(page_size)
+
+    if ndjson or limit is None:
+        headers = {}
+        if ndjson and limit is not None:
+            # find the last document of the page before streaming it
+            last = (
+                await metadatas.find(query, {"_id": 1})
+                .sort("_id", ASCENDING)
+                .skip(limit - 1)
+                .limit(2)
+                .to_list(2)
+            )
+            if len(last) == 2:
+                headers[NEXT_CURSOR_HEADER] = encode_cursor(last[0]["_id"])
+        lines = stream_ndjson(
+            account,
+            container,
+            metadata,
+            summary,
+            projection is not None,
+            annotation_projection,
+        )
+        if ndjson:
+            return StreamingResponse(
+                lines, media_type=NDJSON_MEDIA_TYPE, headers=headers
+            )
+        return StreamingResponse(
+            stream_json_array(lines), media_type="application/json"
+        )
+
     result = []
     async for datum in metadata:
         result.append(datum)
+    headers = {}
+    if len(result) > limit:
+        result = result[:limit]
+        headers[NEXT_CURSOR_HEADER] = encode_cursor(result[-1]["_id"])
+    if not summary and annotation_projection is not False:
+        for start in range(0, len(result), ANNOTATION_BATCH_SIZE):
+            await add_annotations(
+                account,
+                container,
+                result[start : start + ANNOTATION_BATCH_SIZE],
+                annotation_projection,
+            )
+    if summary or projection is not None:
+        # partial documents do not validate as Metadata
+        return JSONResponse(
+            [encode_partial(datum, summary) for datum in result],
+            headers=headers,
+        )
+    response.headers.update(headers)
     return result
 
 
+async def stream_ndjson(
+    account: str,
+    container: str,
+    metadata: AgnosticCursor,
+    summary: bool,
+    projected: bool,
+    annotation_projection: dict | None | bool,
+):
+    def encode(datum: dict) -> str:
+        if summary or projected:
+            return json.dumps(encode_partial(datum, summary)) + "\n"
+        return Metadata(**datum).json(by_alias=True) + "\n"
+
+    if summary or annotation_projection is False:
+        async for datum in metadata:
+            yield encode(datum)
+        return
+
+    # the annotations of a batch of metadata are read at once
+    batch = []
+    async for datum in metadata:
+        batch.append(datum)
+        if len(batch) >= ANNOTATION_BATCH_SIZE:
+            await add_annotations(account, container, batch, annotation_projection)
+            for datum in batch:
+                yield encode(datum)
+            batch = []
+    await add_annotations(account, container, batch, annotation_projection)
+    for datum in batch:
+        yield encode(datum)
+
+
+async def stream_json_array(lines: AsyncIterator[str]):
+    """
+    Stream documents encoded one per line as the items of a JSON array.
+    """
+    separator = "["
+    async for line in lines:
+        yield separator + line
+        separator = ","
+    yield "[]" if separator == "[" else "]"
+
+
+def get_annotation_projection(projection: dict | None) -> dict | None | bool:
+    """
+    Get the projection of the annotations collection for a projection of
+    the metadata, None for whole annotations and False when the annotations
+    are not wanted.
+    """
+    if projection is None or "annotations" in projection:
+        return None
+    annotation_fields = {
+        path[len("annotations.") :]: 1
+        for path in projection
+        if path.startswith("annotations.")
+    }
+    return annotation_fields or False
+
+
+def get_metadata_projection(projection: dict | None) -> dict:
+    """
+    Get the projection of the metadata collection for a projection of the
+    metadata, the annotations being in their own collection.
+    """
+    if projection is None:
+        return {SEARCH_FIELD: 0, DERIVED_FIELD: 0, metadata_repo.WRITING_FIELD: 0}
+    return {
+        path: 1
+        for path in projection
+        if path != "annotations" and not path.startswith("annotations.")
+    }
+
+
+async def add_annotations(
+    account: str,
+    container: str,
+    documents: list[dict],
+    annotation_projection: dict | None,
+):
+    """
+    Add their annotations to documents of the metadata collection.
+    """
+    if not documents:
+        return
+    annotations = await annotation_repo.get_by_file_paths(
+        account,
+        container,
+        [datum["global"]["traceability:origin"]["file_path"] for datum in documents],
+        annotation_projection,
+    )
+    for datum in documents:
+        datum["annotations"] = annotations[
+            datum["global"]["traceability:origin"]["file_path"]
+        ]
+
+
+def parse_fields(fields: str) -> dict:
+    """
+    Parse the fields query parameter of the metadata endpoints into a
+    MongoDB projection, which always includes the origin of the metadata.
+
+    Raises
+    ------
+    HTTPException
+        400 when a field is not a path in the global, captures or
+        annotations of a metadata.
+    """
+    paths = {ORIGIN_FIELD}
+    for field in fields.split(","):
+        field = field.strip()
+        if (
+            not field
+            or "$" in field
+            or field.split(".")[0] not in ["global", "captures", "annotations"]
+        ):
+            raise HTTPException(status_code=400, detail=f"Invalid field: {field}")
+        paths.add(field)
+    # a path inside another one would collide with it in the projection
+    return {
+        path: 1
+        for path in paths
+        if not any(path.startswith(other + ".") for other in paths)
+    }
+
+
+def encode_partial(datum: dict, summary: bool) -> dict:
+    """
+    Get the JSON compatible content of a summary or of a projected metadata,
+    which do not validate as Metadata.
+    """
+    if summary:
+        return MetadataSummary(**datum).dict()
+    return jsonable_encoder(
+        {key: value for key, value in datum.items() if key != "_id"}
+    )
+
+
 @router.get(
     "/api/datasources/{account}/{container}/meta/paths",
     status_code=200,
@@ -73,12 +375,162 @@ async def get_all_meta_name(
     response_model=Metadata,
 )
 async def get_meta(
-    metadata: Metadata = Depends(metadata_repo.get),
+    account: str,
+    container: str,
+    filepath: str,
+    fields: Optional[str] = Query(None),
+    summary: bool = Query(False),
+    current_user: Optional[dict] = Depends(required_roles()),
+):
+    """
+    Get the metadata of a recording. fields and summary restrict it as for
+    the metadata listing of a container.
+    """
+    if summary:
+        datum = await metadata_repo.get_summary(account, container, filepath)
+    elif fields:
+        projection = parse_fields(fields)
+        datum = await metadata_repo.get_fields(
+            account, container, filepath, get_metadata_projection(projection)
+        )
+        annotation_projection = get_annotation_projection(projection)
+        if datum and annotation_projection is not False:
+            datum["annotations"] = await annotation_repo.get_all(
+                account, container, filepath, annotation_projection
+            )
+    else:
+        metadata = await metadata_repo.get(account, container, filepath)
+        if not metadata:
+            raise HTTPException(status_code=404, detail="Metadata not found")
+        return metadata
+    if not datum:
+        raise HTTPException(status_code=404, detail="Metadata not found")
+    return JSONResponse(encode_partial(datum, summary))
+
+
+@router.get("/api/datasources/{account}/{container}/{filepath:path}/meta/annotations")
+async def get_meta_annotations(
+    account: str,
+    container: str,
+    filepath: str,
+    sample_start: int = Query(0, ge=0),
+    sample_end: Optional[int] = Query(None, ge=0),
+    freq_lo: Optional[float] = Query(None),
+    freq_hi: Optional[float] = Query(None),
+    limit: int = Query(1000, ge=1, le=MAX_ANNOTATIONS),
     current_user: Optional[dict] = Depends(required_roles()),
 ):
-    if not metadata:
+    """
+    Get the annotations of a recording overlapping a window of samples
+    [sample_start, sample_end) and of frequencies [freq_lo, freq_hi], in
+    sample order. count is the number of overlapping annotations, of which
+    at most limit are returned.
+    """
+    current = await get_annotation_revision(account, container, filepath)
+    if not current:
         raise HTTPException(status_code=404, detail="Metadata not found")
-    return metadata
+    revision = current.get("global", {}).get("traceability:revision")
+    key = (account, container, filepath, revision)
+    index = annotation_indexes.get(key)
+    if index is None:
+        index = await annotation_index_flights.do(
+            key, lambda: load_annotation_index(key, current)
+        )
+
+    positions = index.search(sample_start, sample_end, freq_lo, freq_hi)
+    return {
+        "revision": revision,
+        "count": len(positions),
+        "annotations": [index.annotations[position] for position in positions[:limit]],
+    }
+
+
+@router.post("/api/datasources/{account}/{container}/{filepath:path}/meta/annotations")
+async def update_meta_annotations(
+    account: str,
+    container: str,
+    filepath: str,
+    changes: AnnotationChanges,
+    current_user: Optional[dict] = Depends(required_roles()),
+):
+    """
+    Insert or replace annotations of a recording by core:uuid, and delete
+    others, as one new revision of its metadata. Annotations without a
+    core:uuid are given one, returned in upserted.
+    """
+    annotation_repo.assign_uuids(changes.upsert)
+    upserts = [
+        annotation.dict(by_alias=True, exclude_unset=True, exclude_none=True)
+        for annotation in changes.upsert
+    ]
+    if not await metadata_repo.exists(account, container, filepath):
+        raise HTTPException(status_code=404, detail="Metadata not found")
+    for attempt in range(WRITE_ATTEMPTS):
+        if attempt:
+            await asyncio.sleep(WRITE_RETRY_DELAY * attempt)
+        document = await metadata_repo.write_annotations(
+            account, container, filepath, upserts, changes.delete
+        )
+        if document is not None:
+            return {
+                "revision": document["global"]["traceability:revision"],
+                "upserted": [annotation["core:uuid"] for annotation in upserts],
+                "deleted": changes.delete,
+            }
+    raise HTTPException(status_code=409, detail="Metadata is being modified")
+
+
+async def get_annotation_revision(account, container, filepath) -> dict | None:
+    """
+    Read the revision of a metadata, and whether a new one is being written.
+    """
+    return await metadata_repo.get_fields(
+        account,
+        container,
+        filepath,
+        {"global.traceability:revision": 1, metadata_repo.WRITING_FIELD: 1},
+    )
+
+
+async def load_annotation_index(key: tuple, current: dict) -> AnnotationIndex:
+    """
+    Build the annotation index of a recording at the revision current was
+    read at, keyed by (account, container, filepath, revision). It is only
+    cached when no write started before the annotations were read nor
+    finished after, so that the index cached under a revision holds the
+    annotations of that revision.
+    """
+    account, container, filepath, revision = key
+    index = AnnotationIndex(await annotation_repo.get_all(account, container, filepath))
+    after = await get_annotation_revision(account, container, filepath)
+    if (
+        after
+        and after.get("global", {}).get("traceability:revision") == revision
+        and not metadata_repo.is_writing(current)
+        and not metadata_repo.is_writing(after)
+    ):
+        annotation_indexes[key] = index
+    return index
+
+
+@router.get(
+    "/api/datasources/{account}/{container}/{filepath:path}/meta/versions/{revision}",
+    response_model=Metadata,
+)
+async def get_meta_version(
+    account: str,
+    container: str,
+    filepath: str,
+    revision: int,
+    current_user: Optional[dict] = Depends(required_roles()),
+):
+    """
+    Get a past revision of a metadata, rebuilt from its version history.
+    """
+    metadata = await version_repo.get(account, container, filepath, revision)
+    if metadata is None:
+        raise HTTPException(status_code=404, detail="Metadata version not found")
+    return Metadata(**metadata)
 
 
 @router.get(
@@ -87,49 +539,88 @@ async def get_meta(
 )
 async def get_meta_thumbnail(
     filepath: str,
-    background_tasks: BackgroundTasks,
     datasource: DataSource = Depends(datasource_repo.get),
-    azure_client: AzureBlobClient = Depends(AzureBlobClient),
+    storage_client: BlobStorageClient = Depends(get_storage_client),
     current_user: Optional[dict] = Depends(required_roles()),
 ):
     if not datasource:
         raise HTTPException(status_code=404, detail="Datasource not found")
 
-    azure_client.set_sas_token(decrypt(datasource.sasToken.get_secret_value()))
+    storage_client.set_sas_token(decrypt(datasource.sasToken.get_secret_value()))
     thumbnail_path = get_file_name(filepath, ApiType.THUMB)
     content_type = get_content_type(ApiType.THUMB)
-    if not await azure_client.blob_exist(thumbnail_path):
-        metadata = await metadata_repo.get(
-            datasource.account,
-            datasource.container,
-            filepath,
-        )
-        if not metadata:
-            raise HTTPException(status_code=404, detail="Metadata not found")
-        datatype = metadata.globalMetadata.core_datatype
-        image = await azure_client.get_new_thumbnail(
-            data_type=datatype, filepath=filepath
-        )
-        # Upload the thumbnail in the background
-        background_tasks.add_task(
-            azure_client.upload_blob, filepath=thumbnail_path, data=image
-        )
+    key = (datasource.account, datasource.container, filepath)
+    image = thumbnail_cache.get(key)
+    if image is not None:
         return Response(content=image, media_type=content_type)
-    content = await azure_client.get_blob_content(thumbnail_path)
+    if not await storage_client.blob_exist(thumbnail_path):
+
+        async def generate_thumbnail() -> bytes:
+            datatype = await metadata_repo.get_datatype(
+                datasource.account,
+                datasource.container,
+                filepath,
+            )
+            if not datatype:
+                raise HTTPException(status_code=404, detail="Metadata not found")
+            image = await storage_client.get_new_thumbnail(
+                data_type=datatype, filepath=filepath
+            )
+            thumbnail_cache[key] = image
+            # Upload the thumbnail in the background, apart from the requests
+            # sharing this generation, which may all be gone by then
+            upload = asyncio.create_task(
+                upload_thumbnail(storage_client, key, thumbnail_path, image)
+            )
+            thumbnail_uploads.add(upload)
+            upload.add_done_callback(thumbnail_uploads.discard)
+            return image
+
+        # concurrent requests for the same thumbnail share one generation
+        image = await thumbnail_flights.do(key, generate_thumbnail)
+        return Response(content=image, media_type=content_type)
+    content = await storage_client.get_blob_content(thumbnail_path)
     return Response(content=content, media_type=content_type)
 
 
+async def upload_thumbnail(
+    storage_client: BlobStorageClient,
+    key: tuple[str, str, str],
+    thumbnail_path: str,
+    image: bytes,
+):
+    try:
+        await storage_client.upload_blob(filepath=thumbnail_path, data=image)
+    except Exception as e:
+        # the thumbnail stays served from memory until it is evicted
+        logging.getLogger("api").error(
+            "Could not upload the thumbnail %s: %s", thumbnail_path, e
+        )
+        return
+    # the thumbnail is now served from storage
+    thumbnail_cache.pop(key, None)
+
+
 async def process_geolocation(target: str, geolocation: str):
     try:
         geo_long_str, geo_lat_str, geo_radius_str = geolocation.split(",")
         geo_long = float(geo_long_str)
         geo_lat = float(geo_lat_str)
         geo_radius = float(geo_radius_str)
-        target_field = ""
-        if target == "captures":
-            target_field = "captures.core:geolocation"
         if target == "annotations":
-            target_field = "annotations.core:geolocation"
+            # annotations are queried in their own collection, in which
+            # $near cannot group the annotations by recording
+            return {
+                "core:geolocation": {
+                    "$geoWithin": {
+                        "$centerSphere": [
+                            [geo_long, geo_lat],
+                            geo_radius / EARTH_RADIUS,
+                        ]
+                    }
+                }
+            }
+        target_field = "captures.core:geolocation"
 
         return {
             target_field: {
@@ -150,6 +641,31 @@ async def process_geolocation(target: str, geolocation: str):
         )
 
 
+def get_overlap_condition(
+    name: str, lower_field: str, upper_field: str, start, end
+) -> dict:
+    """
+    Get the condition for the interval [lower_field, upper_field] of the
+    derived fields of a metadata to overlap [start, end], either end of
+    which may be None.
+
+    Raises
+    ------
+    HTTPException
+        400 when start is after end.
+    """
+    if start is not None and end is not None and start > end:
+        raise HTTPException(
+            status_code=400, detail=f"{name}_from must not be after {name}_to"
+        )
+    condition: Dict[str, Any] = {}
+    if start is not None:
+        condition[f"{DERIVED_FIELD}.{upper_field}"] = {"$gte": start}
+    if end is not None:
+        condition[f"{DERIVED_FIELD}.{lower_field}"] = {"$lte": end}
+    return condition
+
+
 @router.get(
     "/api/datasources/query",
     status_code=200,
@@ -169,74 +685,110 @@ async def query_meta(
     text: Optional[str] = Query(None),
     captures_geo: Optional[str] = Query(None),
     annotations_geo: Optional[str] = Query(None),
+    match: str = Query("contains", regex="^(exact|prefix|contains)$"),
+    frequency_from: Optional[float] = Query(None),
+    frequency_to: Optional[float] = Query(None),
+    datetime_from: Optional[datetime] = Query(None),
+    datetime_to: Optional[datetime] = Query(None),
+    min_duration: Optional[float] = Query(None, ge=0),
+    max_duration: Optional[float] = Query(None, ge=0),
     metadataSet: AgnosticCollection = Depends(metadata_repo.collection),
     current_user: Optional[dict] = Depends(required_roles()),
 ):
+    """
+    Search the metadata of every datasource. The account, container, author,
+    label, comment and description filters ignore case, and match:
+
+    - match=contains, the default: the values anywhere. This is not served
+      by an index, every stored value of the filtered fields is checked, so
+      prefer prefix, exact or text on large databases.
+    - match=prefix: the start of the values, served by an index.
+    - match=exact: whole values, served by an index.
+
+    text searches descriptions, labels and comments for words, served by the
+    text index, most relevant first.
+
+    frequency_from and frequency_to select the recordings whose band, their
+    center frequencies -/+ half the sample rate, overlaps that range, and
+    datetime_from and datetime_to the recordings whose time span overlaps
+    that one. Either end of both ranges can be left open.
+    """
     query_condition: Dict[str, Any] = {}
     if account:
-        query_condition.update(
-            {
-                "$or": [
-                    {
-                        "global.traceability:origin.account": {
-                            "$regex": a,
-                            "$options": "i",
-                        }
-                    }
-                    for a in account
-                ]
-            }
-        )
+        query_condition[f"{SEARCH_FIELD}.account"] = {
+            "$in": [get_match(a, match) for a in account]
+        }
     if container:
-        query_condition.update(
-            {
-                "$or": [
-                    {
-                        "global.traceability:origin.container": {
-                            "$regex": c,
-                            "$options": "i",
-                        }
-                    }
-                    for c in container
-                ]
-            }
-        )
-    if min_frequency is not None:
-        query_condition.update({"captures.core:frequency": {"$gte": min_frequency}})
-    if max_frequency is not None:
-        query_condition.update({"captures.core:frequency": {"$lte": max_frequency}})
-    if author is not None:
-        query_condition.update(
-            {"global.core:author": {"$regex": author, "$options": "i"}}
-        )
-    # global description
-    if description is not None:
-        query_condition.update(
-            {"global.core:description": {"$regex": description, "$options": "i"}}
-        )
-    if label is not None:
-        query_condition.update(
-            {"annotations.core:label": {"$regex": label, "$options": "i"}}
+        query_condition[f"{SEARCH_FIELD}.container"] = {
+            "$in": [get_match(c, match) for c in container]
+        }
+    if min_frequency is not None or max_frequency is not None:
+        frequency_query = {}
+        if min_frequency is not None:
+            frequency_query["$gte"] = min_frequency
+        if max_frequency is not None:
+            frequency_query["$lte"] = max_frequency
+        query_condition["captures.core:frequency"] = frequency_query
+    query_condition.update(
+        get_overlap_condition(
+            "frequency", "min_frequency", "max_frequency", frequency_from, frequency_to
         )
-    if comment is not None:
-        query_condition.update(
-            {"annotations.core:description": {"$regex": comment, "$options": "i"}}
+    )
+    query_condition.update(
+        get_overlap_condition(
+            "datetime",
+            "start_datetime",
+            "end_datetime",
+            datetime_from and to_utc(datetime_from),
+            datetime_to and to_utc(datetime_to),
         )
+    )
+    if min_duration is not None or max_duration is not None:
+        duration_query = {}
+        if min_duration is not None:
+            duration_query["$gte"] = min_duration
+        if max_duration is not None:
+            duration_query["$lte"] = max_duration
+        query_condition[f"{DERIVED_FIELD}.duration"] = duration_query
+    for field, value in [
+        ("author", author),
+        ("description", description),  # global description
+        ("labels", label),
+        ("comments", comment),
+    ]:
+        if value is not None:
+            query_condition[f"{SEARCH_FIELD}.{field}"] = get_match(value, match)
 
     if captures_geo:
         query_condition.update(await process_geolocation("captures", captures_geo))
     if annotations_geo:
-        query_condition.update(
+        recordings = await annotation_repo.find_recordings(
             await process_geolocation("annotations", annotations_geo)
         )
+        if not recordings:
+            return []
+        query_condition["$or"] = [
+            metadata_repo.origin_query(
+                recording["account"], recording["container"], recording["file_path"]
+            )
+            for recording in recordings
+        ]
 
+    projection: Dict[str, Any] = {
+        "global.traceability:origin.type": 1,
+        "global.traceability:origin.account": 1,
+        "global.traceability:origin.container": 1,
+        "global.traceability:origin.file_path": 1,
+        "_id": 0,
+    }
     if text is not None:
-        or_condition = [
-            {"global.core:description": {"$regex": text, "$options": "i"}},
-            {"annotations.core:label": {"$regex": text, "$options": "i"}},
-            {"annotations.core:description": {"$regex": text, "$options": "i"}},
-        ]
-        query_condition.update({"$or": or_condition})
+        if captures_geo:
+            raise HTTPException(
+                status_code=400,
+                detail="text cannot be combined with captures_geo",
+            )
+        query_condition["$text"] = {"$search": text}
+        projection["score"] = {"$meta": "textScore"}
 
     if min_datetime is not None or max_datetime is not None:
         datetime_query = {}
@@ -248,16 +800,9 @@ async def query_meta(
             datetime_query.update({"$lte": max_datetime_formatted})
         query_condition.update({"captures.core:datetime": datetime_query})
 
-    metadata = metadataSet.find(
-        query_condition,
-        {
-            "global.traceability:origin.type": 1,
-            "global.traceability:origin.account": 1,
-            "global.traceability:origin.container": 1,
-            "global.traceability:origin.file_path": 1,
-            "_id": 0,
-        },
-    )
+    metadata = metadataSet.find(query_condition, projection)
+    if text is not None:
+        metadata = metadata.sort([("score", {"$meta": "textScore"})])
 
     result = []
     async for datum in metadata:
@@ -284,7 +829,6 @@ async def create_meta(
     metadata: Metadata,
     datasources: AgnosticCollection = Depends(datasource_repo.collection),
     metadatas: AgnosticCollection = Depends(metadata_repo.collection),
-    versions: AgnosticCollection = Depends(metadata_repo.versions_collection),
     current_user: Optional[dict] = Depends(required_roles()),
 ):
     # Check datasource id is valid
@@ -314,13 +858,136 @@ async def create_meta(
         }
     )
     metadata.globalMetadata.traceability_revision = 0
-    await metadatas.insert_one(
-        metadata.dict(by_alias=True, exclude_unset=True, exclude_none=True)
+    await metadata_repo.insert(metadata)
+    return metadata
+
+
+@router.post("/api/datasources/{account}/{container}/meta/bulk")
+async def create_meta_bulk(
+    account: str,
+    container: str,
+    request: Request,
+    content_type: Optional[str] = Header(None),
+    current_user: Optional[dict] = Depends(required_roles()),
+):
+    """
+    Create many metadata of a datasource at once. The body is a JSON array,
+    or application/x-ndjson lines, of objects with the file_path and the
+    metadata of a recording. Every item is validated, then the valid ones
+    are written together.
+
+    Returns the number of metadata created, and the status of each item in
+    order: 201 when it was created, 409 when it already exists, 422 when it
+    is invalid, such as when two of its annotations share a core:uuid, and
+    500 when it could not be written, with the reason in detail.
+    """
+    if not await datasource_repo.datasource_exists(account, container):
+        raise HTTPException(status_code=404, detail="Datasource not found")
+    body = await request.body()
+    try:
+        if content_type is not None and NDJSON_MEDIA_TYPE in content_type:
+            items = [json.loads(line) for line in body.splitlines() if line.strip()]
+        else:
+            items = json.loads(body)
+    except json.JSONDecodeError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid JSON: {e}")
+    if not isinstance(items, list):
+        raise HTTPException(status_code=400, detail="Expected an array of metadata")
+    if len(items) > MAX_BULK_SIZE:
+        raise HTTPException(
+            status_code=413, detail=f"At most {MAX_BULK_SIZE} metadata at once"
+        )
+
+    results: list[dict] = []
+    uploads: dict[int, MetadataUpload] = {}
+    for index, item in enumerate(items):
+        file_path = item.get("file_path") if isinstance(item, dict) else None
+        results.append({"file_path": file_path, "status": 201})
+        try:
+            upload = MetadataUpload.parse_obj(item)
+        except ValidationError as e:
+            results[index].update(status=422, detail=e.errors())
+            continue
+        annotation_uuids = [
+            annotation.core_uuid
+            for annotation in upload.metadata.annotations
+            if annotation.core_uuid
+        ]
+        if len(annotation_uuids) != len(set(annotation_uuids)):
+            results[index].update(status=422, detail="Duplicate annotation core:uuid")
+            continue
+        uploads[index] = upload
+
+    existing = await metadata_repo.get_existing_file_paths(
+        account, container, [upload.file_path for upload in uploads.values()]
     )
-    await versions.insert_one(
-        metadata.dict(by_alias=True, exclude_unset=True, exclude_none=True)
+    metadatas: dict[int, Metadata] = {}
+    for index, upload in uploads.items():
+        if upload.file_path in existing:
+            results[index].update(status=409, detail="Metadata already exists")
+            continue
+        # later items for the same recording are duplicates
+        existing.add(upload.file_path)
+        upload.metadata.globalMetadata.traceability_origin = DataSourceReference(
+            type="api", account=account, container=container, file_path=upload.file_path
+        )
+        upload.metadata.globalMetadata.traceability_revision = 0
+        metadatas[index] = upload.metadata
+
+    errors = await metadata_repo.insert_many(list(metadatas.values()))
+    for position, index in enumerate(metadatas):
+        if position in errors:
+            # a recording created since it was checked
+            duplicate = (
+                errors[position].get("code") == 11000
+                and errors[position].get("collection") != "annotations"
+            )
+            results[index].update(
+                status=409 if duplicate else 500,
+                detail="Metadata already exists"
+                if duplicate
+                else errors[position].get("errmsg"),
+            )
+    return {
+        "created": sum(result["status"] == 201 for result in results),
+        "results": results,
+    }
+
+
+def get_expected_revision(if_match: Optional[str] = Header(None)) -> int | None:
+    """
+    Get the revision a write expects to replace, from an If-Match header
+    holding it as an entity tag, or None to write over any revision.
+    """
+    if if_match is None or if_match.strip() == "*":
+        return None
+    try:
+        return int(if_match.strip().removeprefix("W/").strip('"'))
+    except ValueError:
+        raise HTTPException(
+            status_code=400, detail="If-Match must be a metadata revision"
+        )
+
+
+async def get_previous(account, container, filepath, expected_revision) -> dict:
+    """
+    Get the stored global, captures and computed fields of a metadata about
+    to be written, checking it is at the expected revision.
+    """
+    previous = await metadata_repo.get_fields(
+        account,
+        container,
+        filepath,
+        {"global": 1, "captures": 1, SEARCH_FIELD: 1, DERIVED_FIELD: 1},
     )
-    return metadata
+    if previous is None:
+        raise HTTPException(status_code=404, detail="Metadata not found")
+    revision = previous["global"].get("traceability:revision")
+    if expected_revision is not None and revision != expected_revision:
+        raise HTTPException(
+            status_code=412, detail=f"Metadata is at revision {revision}"
+        )
+    return previous
 
 
 @router.put(
@@ -331,37 +998,107 @@ async def update_meta(
     container,
     filepath,
     metadata: Metadata,
-    metadatas: AgnosticCollection = Depends(metadata_repo.collection),
-    versions: AgnosticCollection = Depends(metadata_repo.versions_collection),
+    expected_revision: int | None = Depends(get_expected_revision),
     current_user: Optional[dict] = Depends(required_roles()),
 ):
-    current = await metadatas.find_one(
-        {
-            "global.traceability:origin.account": account,
-            "global.traceability:origin.container": container,
-            "global.traceability:origin.file_path": filepath,
-        }
-    )
-    if current is None:
-        raise HTTPException(status_code=404, detail="Metadata not found")
-    else:
-        id = current["_id"]
-        version = current["global"]["traceability:revision"]
-        # This is going to be a race condition
-        version_number = version + 1
-        metadata.globalMetadata.traceability_revision = version_number
-        metadata.globalMetadata.traceability_origin = current["global"][
-            "traceability:origin"
+    """
+    Replace a metadata by a new revision. With an If-Match header, the
+    metadata is only replaced while it is at that revision.
+    """
+    for attempt in range(WRITE_ATTEMPTS):
+        if attempt:
+            await asyncio.sleep(WRITE_RETRY_DELAY * attempt)
+        previous = await get_previous(account, container, filepath, expected_revision)
+        metadata.globalMetadata.traceability_origin = DataSourceReference(
+            **previous["global"]["traceability:origin"]
+        )
+        if await metadata_repo.replace(metadata, previous) is not None:
+            return
+    raise HTTPException(status_code=409, detail="Metadata is being modified")
+
+
+@router.patch("/api/datasources/{account}/{container}/{filepath:path}/meta")
+async def patch_meta(
+    account,
+    container,
+    filepath,
+    response: Response,
+    patch: Any = Body(...),
+    content_type: Optional[str] = Header(None),
+    expected_revision: int | None = Depends(get_expected_revision),
+    current_user: Optional[dict] = Depends(required_roles()),
+):
+    """
+    Edit the global and captures of a metadata with a JSON patch (RFC 6902,
+    application/json-patch+json) or a JSON merge patch (RFC 7396,
+    application/merge-patch+json), as a new revision of it. The revision is
+    incremented by the database server, and the patch is applied again to a
+    metadata modified while it was being patched. With an If-Match header,
+    the metadata is only patched while it is at that revision.
+
+    Annotations are edited with the meta/annotations endpoint.
+    """
+    media_type = (content_type or "").split(";")[0].strip().lower()
+    if media_type == JSON_PATCH_MEDIA_TYPE or (
+        media_type != MERGE_PATCH_MEDIA_TYPE and isinstance(patch, list)
+    ):
+        if not isinstance(patch, list):
+            raise HTTPException(
+                status_code=400, detail="A JSON patch is an array of operations"
+            )
+        paths = [
+            operation.get(key)
+            for operation in patch
+            if isinstance(operation, dict)
+            for key in ["path", "from"]
         ]
-        await versions.insert_one(
-            metadata.dict(by_alias=True, exclude_unset=True, exclude_none=True)
+        patches_annotations = any(
+            path in ["", "/annotations"] or path.startswith("/annotations/")
+            for path in paths
+            if isinstance(path, str)
         )
-        await metadatas.update_one(
-            {"_id": id},
-            {
-                "$set": metadata.dict(
-                    by_alias=True, exclude_unset=True, exclude_none=True
-                )
-            },
+
+        def apply(document):
+            return apply_patch(document, patch)
+
+    else:
+        if not isinstance(patch, dict):
+            raise HTTPException(
+                status_code=400, detail="A JSON merge patch is an object"
+            )
+        patches_annotations = "annotations" in patch
+
+        def apply(document):
+            return apply_merge_patch(document, patch)
+
+    if patches_annotations:
+        raise HTTPException(
+            status_code=400,
+            detail="Annotations are edited with the meta/annotations endpoint",
         )
-        return
+
+    for attempt in range(WRITE_ATTEMPTS):
+        if attempt:
+            await asyncio.sleep(WRITE_RETRY_DELAY * attempt)
+        previous = await get_previous(account, container, filepath, expected_revision)
+        target = {
+            "global": previous["global"],
+            "captures": previous.get("captures", []),
+        }
+        try:
+            patched = apply(target)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        try:
+            metadata = Metadata(**patched, annotations=[])
+        except ValidationError as e:
+            raise HTTPException(status_code=422, detail=e.errors())
+        for key in ["traceability:origin", "traceability:revision"]:
+            if patched["global"].get(key) != previous["global"].get(key):
+                raise HTTPException(status_code=400, detail=f"{key} cannot be patched")
+        document = await metadata_repo.update(metadata, previous)
+        if document is not None:
+            revision = document["global"]["traceability:revision"]
+            response.headers["ETag"] = f'"{revision}"'
+            return {"revision": revision}
+    raise HTTPException(status_code=409, detail="Metadata is being modified")
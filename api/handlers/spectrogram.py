@@ -0,0 +1,319 @@
+import asyncio
+import os
+from typing import Optional
+
+import numpy as np
+from blob.client_factory import get_storage_client
+from blob.storage_client import BlobStorageClient
+from cachetools import LRUCache
+from database import datasource_repo, metadata_repo
+from database.models import DataSource
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from helpers.authorization import required_roles
+from helpers.cipher import decrypt
+from helpers.compute import compute_pool
+from helpers.concurrency import download_limiter
+from helpers.singleflight import SingleFlight
+from helpers.urlmapping import ApiType, get_file_name
+from rf.psd import PowerSpectrum, get_power_stats
+from rf.samples import get_bytes_per_iq_sample
+from rf.spectrogram import WINDOWS
+from rf.tiles import SpectrogramPyramid, compute_band, encode_tile
+
+router = APIRouter()
+
+# Encoded tiles keyed by (account, container, filepath, etag, fft_size, z, x, y),
+# bounded by their total size in bytes
+tile_cache: LRUCache[tuple, bytes] = LRUCache(
+    maxsize=max(int(os.getenv("IQENGINE_TILE_CACHE_SIZE", 64 * 1024 * 1024)), 1),
+    getsizeof=len,
+)
+
+# Tiles in dB keyed by (account, container, filepath, etag, fft_size, z, x, y),
+# bounded by their total size in bytes. Zoomed out tiles are reduced from the
+# tiles of the level below, which are kept here so that a level is computed
+# once from the one below rather than from the samples
+tile_db_cache: LRUCache[tuple, np.ndarray] = LRUCache(
+    maxsize=max(int(os.getenv("IQENGINE_TILE_DB_CACHE_SIZE", 256 * 1024 * 1024)), 1),
+    getsizeof=lambda tile: tile.nbytes,
+)
+tile_db_flights: SingleFlight[np.ndarray] = SingleFlight()
+
+# Power spectra keyed by (account, container, filepath, etag, fft_size, window)
+psd_cache: LRUCache[tuple, dict] = LRUCache(maxsize=256)
+
+# Bytes of a recording reduced at once by the compute pool for /psd
+PSD_PIECE_BYTES = 4 * 1024 * 1024
+
+# (db_min, db_max) of each recording keyed by (account, container, filepath, etag, fft_size)
+tile_scales: LRUCache[tuple, tuple[float, float]] = LRUCache(maxsize=1024)
+
+
+def check_fft_size(fft_size: int):
+    if fft_size < 16 or fft_size > 65536 or fft_size & (fft_size - 1):
+        raise HTTPException(
+            status_code=400, detail="fft_size must be a power of 2 up to 65536"
+        )
+
+
+async def get_data_type(datasource: DataSource, filepath: str) -> str:
+    """
+    Get the datatype of a recording from its metadata, checking that its
+    samples can be decoded.
+    """
+    data_type = await metadata_repo.get_datatype(
+        datasource.account, datasource.container, filepath
+    )
+    if not data_type:
+        raise HTTPException(status_code=404, detail="Metadata not found")
+    try:
+        get_bytes_per_iq_sample(data_type)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return data_type
+
+
+async def get_tile_db(
+    storage_client: BlobStorageClient,
+    data_path: str,
+    data_type: str,
+    pyramid: SpectrogramPyramid,
+    recording_key: tuple,
+    z: int,
+    x: int,
+    y: int,
+) -> np.ndarray:
+    """
+    Get a spectrogram tile in dB from the cache, or compute it, once for the
+    concurrent requests that need it.
+    """
+    key = recording_key + (z, x, y)
+    tile = tile_db_cache.get(key)
+    if tile is not None:
+        return tile
+    return await tile_db_flights.do(
+        key,
+        lambda: compute_tile_db(
+            storage_client, data_path, data_type, pyramid, recording_key, z, x, y
+        ),
+    )
+
+
+async def compute_tile_db(
+    storage_client: BlobStorageClient,
+    data_path: str,
+    data_type: str,
+    pyramid: SpectrogramPyramid,
+    recording_key: tuple,
+    z: int,
+    x: int,
+    y: int,
+) -> np.ndarray:
+    """
+    Compute a spectrogram tile in dB. Tiles of the most detailed level are
+    computed from their FFT rows, along with the other tiles of their row,
+    and zoomed out tiles are reduced from the tiles of the level below, so a
+    zoomed out tile reads every sample it covers once, and its level is
+    cached for the levels above it. The FFTs run in the compute pool.
+    """
+    if z == pyramid.max_zoom:
+        bytes_per_row = pyramid.fft_size * get_bytes_per_iq_sample(data_type)
+        first_row, row_count = pyramid.get_row_range(y)
+        # the samples are kept as tiles in dB rather than in the block cache
+        content = await download_limiter.run(
+            storage_client.account,
+            storage_client.get_blob_content(
+                filepath=data_path,
+                offset=first_row * bytes_per_row,
+                length=row_count * bytes_per_row,
+                cached=False,
+            ),
+        )
+        tiles = await compute_pool.run(compute_band, pyramid, content, data_type)
+        for column, tile in enumerate(tiles):
+            tile_db_cache[recording_key + (z, column, y)] = tile
+        return tiles[x]
+
+    children_x, children_y = pyramid.get_children(z, x, y)
+    children = []
+    # one child after another, a zoomed out tile would otherwise queue jobs
+    # for all of its most detailed tiles at once
+    for child_y in children_y:
+        row = []
+        for child_x in children_x:
+            row.append(
+                await get_tile_db(
+                    storage_client,
+                    data_path,
+                    data_type,
+                    pyramid,
+                    recording_key,
+                    z + 1,
+                    child_x,
+                    child_y,
+                )
+            )
+        children.append(row)
+    tile = await compute_pool.run(pyramid.combine_tiles, z, children)
+    tile_db_cache[recording_key + (z, x, y)] = tile
+    return tile
+
+
+@router.get(
+    "/api/datasources/{account}/{container}/{filepath:path}/spectrogram-tiles/{z}/{x}/{y}",
+    response_class=Response,
+)
+async def get_spectrogram_tile(
+    filepath: str,
+    z: int,
+    x: int,
+    y: int,
+    fft_size: int = Query(1024),
+    db_min: Optional[float] = Query(None),
+    db_max: Optional[float] = Query(None),
+    datasource: DataSource = Depends(datasource_repo.get),
+    storage_client: BlobStorageClient = Depends(get_storage_client),
+    current_user: Optional[dict] = Depends(required_roles()),
+):
+    """
+    Get a tile of the spectrogram of a recording as an 8 bit greyscale PNG.
+    Tiles follow the z/x/y layout of tools/pmtiles/create_pmtiles.py, with x
+    along frequency and y along time. Unless db_min and db_max are given, the
+    dB range of the whole recording is mapped to the 0-255 pixel values.
+    """
+    if not datasource:
+        raise HTTPException(status_code=404, detail="Datasource not found")
+    check_fft_size(fft_size)
+    data_type = await get_data_type(datasource, filepath)
+    bytes_per_iq_sample = get_bytes_per_iq_sample(data_type)
+
+    storage_client.set_sas_token(decrypt(datasource.sasToken.get_secret_value()))
+    data_path = get_file_name(filepath, ApiType.IQDATA)
+    properties = await storage_client.get_blob_properties(data_path)
+    recording_key = (
+        datasource.account,
+        datasource.container,
+        filepath,
+        properties.etag,
+        fft_size,
+    )
+    tile_key = recording_key + (z, x, y)
+    custom_scale = db_min is not None and db_max is not None
+    tile = None if custom_scale else tile_cache.get(tile_key)
+    if tile is not None:
+        return Response(content=tile, media_type="image/png")
+
+    pyramid = SpectrogramPyramid(properties.size // bytes_per_iq_sample, fft_size)
+    if pyramid.total_rows == 0 or not pyramid.contains(z, x, y):
+        raise HTTPException(status_code=404, detail="Tile not found")
+
+    tile_db = await get_tile_db(
+        storage_client, data_path, data_type, pyramid, recording_key, z, x, y
+    )
+    if custom_scale:
+        tile = await compute_pool.run(encode_tile, tile_db, db_min, db_max)
+        return Response(content=tile, media_type="image/png")
+
+    scale = tile_scales.get(recording_key)
+    if scale is None:
+        overview = (
+            tile_db
+            if z == 0
+            else await get_tile_db(
+                storage_client, data_path, data_type, pyramid, recording_key, 0, 0, 0
+            )
+        )
+        finite = overview[np.isfinite(overview)]
+        # same scaling as create_pmtiles.py: from min + 20 dB up to max
+        scale = (
+            (float(finite.min()) + 20, float(finite.max()))
+            if finite.size
+            else (0.0, 1.0)
+        )
+        tile_scales[recording_key] = scale
+    tile = await compute_pool.run(encode_tile, tile_db, scale[0], scale[1])
+    tile_cache[tile_key] = tile
+    return Response(content=tile, media_type="image/png")
+
+
+@router.get("/api/datasources/{account}/{container}/{filepath:path}/psd")
+async def get_power_spectral_density(
+    filepath: str,
+    fft_size: int = Query(1024),
+    window: str = Query("hann"),
+    datasource: DataSource = Depends(datasource_repo.get),
+    storage_client: BlobStorageClient = Depends(get_storage_client),
+    current_user: Optional[dict] = Depends(required_roles()),
+):
+    """
+    Get the average (Welch), max-hold and min-hold power spectra in dB of a
+    whole recording. The recording is streamed from storage and reduced a
+    piece at a time, so memory does not grow with its size. Windowed FFTs
+    overlap by half, "rectangular" disables the window and the overlap.
+    """
+    if not datasource:
+        raise HTTPException(status_code=404, detail="Datasource not found")
+    check_fft_size(fft_size)
+    if window != "rectangular" and window not in WINDOWS:
+        raise HTTPException(status_code=400, detail="Unknown window " + window)
+    data_type = await get_data_type(datasource, filepath)
+
+    storage_client.set_sas_token(decrypt(datasource.sasToken.get_secret_value()))
+    data_path = get_file_name(filepath, ApiType.IQDATA)
+    properties = await storage_client.get_blob_properties(data_path)
+    key = (
+        datasource.account,
+        datasource.container,
+        filepath,
+        properties.etag,
+        fft_size,
+        window,
+    )
+    result = psd_cache.get(key)
+    if result is not None:
+        return result
+
+    fft_window = None if window == "rectangular" else window
+    hop = fft_size // 2 if fft_window else fft_size
+    bytes_per_iq_sample = get_bytes_per_iq_sample(data_type)
+    frame_bytes = fft_size * bytes_per_iq_sample
+    hop_bytes = hop * bytes_per_iq_sample
+    spectrum = PowerSpectrum(fft_size)
+    buffer = bytearray()
+    pending: list[asyncio.Future] = []
+
+    def reduce_buffer():
+        # send the whole FFTs of the buffer to the compute pool, keeping the
+        # samples the next FFT overlaps with
+        frames = (len(buffer) - frame_bytes) // hop_bytes + 1
+        piece = bytes(buffer[: (frames - 1) * hop_bytes + frame_bytes])
+        del buffer[: frames * hop_bytes]
+        pending.append(
+            asyncio.ensure_future(
+                compute_pool.run(
+                    get_power_stats, piece, data_type, fft_size, fft_window, hop
+                )
+            )
+        )
+
+    try:
+        async with download_limiter.limit(storage_client.account):
+            stream = await storage_client.get_blob_stream(data_path)
+            async for chunk in stream.chunks():
+                buffer.extend(chunk)
+                if len(buffer) >= PSD_PIECE_BYTES:
+                    reduce_buffer()
+                # download the next piece while the previous ones are reduced
+                if len(pending) > 1:
+                    spectrum.add(await pending.pop(0))
+        if len(buffer) >= frame_bytes:
+            reduce_buffer()
+        for task in pending:
+            spectrum.add(await task)
+    finally:
+        for task in pending:
+            task.cancel()
+
+    result = {"fft_size": fft_size, "window": window, **spectrum.to_dict()}
+    psd_cache[key] = result
+    return result
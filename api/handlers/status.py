@@ -1,5 +1,20 @@
+from typing import Optional
+
+from blob.block_cache import block_cache
+from blob.properties_cache import properties_cache
 from database import datasource_repo
+from database.indexes import get_index_report
 from fastapi import APIRouter, Depends
+from helpers.authorization import required_roles
+from handlers.metadata import (
+    annotation_index_flights,
+    annotation_indexes,
+    thumbnail_cache,
+    thumbnail_flights,
+)
+from handlers.spectrogram import tile_cache
+from helpers.compute import compute_pool
+from helpers.concurrency import download_limiter
 from motor.motor_asyncio import AsyncIOMotorCollection
 from pymongo.errors import ServerSelectionTimeoutError
 
@@ -18,3 +33,42 @@ async def get_status(
     except ServerSelectionTimeoutError:
         return "No Database Connection Available"
     return "OK"
+
+
+@router.get("/api/status/metrics")
+async def get_metrics(
+    current_user: Optional[dict] = Depends(required_roles()),
+):
+    """
+    Get the counters of the in-process caches of this API worker.
+    """
+    return {
+        "block_cache": block_cache.stats(),
+        "properties_cache": properties_cache.stats(),
+        "download_limiter": download_limiter.stats(),
+        "compute_pool": compute_pool.stats(),
+        "thumbnails": {
+            "cached": len(thumbnail_cache),
+            "bytes": thumbnail_cache.currsize,
+            **thumbnail_flights.stats(),
+        },
+        "annotation_indexes": {
+            "cached": len(annotation_indexes),
+            **annotation_index_flights.stats(),
+        },
+        "tile_cache": {
+            "tiles": len(tile_cache),
+            "bytes": tile_cache.currsize,
+            "max_bytes": tile_cache.maxsize,
+        },
+    }
+
+
+@router.get("/api/status/indexes")
+async def get_indexes(
+    current_user: Optional[dict] = Depends(required_roles()),
+):
+    """
+    Get the database indexes and the query plans of the main queries.
+    """
+    return await get_index_report()
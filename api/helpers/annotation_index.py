@@ -0,0 +1,95 @@
+import numpy as np
+
+
+class AnnotationIndex:
+    """
+    AnnotationIndex finds the annotations of a recording that overlap a
+    window of samples and frequencies. Annotations are sorted by their first
+    sample, alongside the running maximum of their last sample, so that a
+    window is narrowed down with two binary searches before its candidates
+    are filtered at once.
+
+    Parameters
+    ----------
+    annotations : list[dict]
+        The SigMF annotations. An annotation without frequency edges covers
+        every frequency.
+    """
+
+    def __init__(self, annotations: list[dict]):
+        starts = np.array(
+            [annotation.get("core:sample_start", 0) for annotation in annotations],
+            dtype=np.int64,
+        )
+        order = np.argsort(starts, kind="stable")
+        self.annotations = [annotations[index] for index in order]
+        self.starts = starts[order]
+        self.ends = self.starts + np.array(
+            [annotation.get("core:sample_count", 0) for annotation in self.annotations],
+            dtype=np.int64,
+        )
+        self.max_ends = np.maximum.accumulate(self.ends)
+        self.lower_edges = np.array(
+            [
+                annotation.get("core:freq_lower_edge", -np.inf)
+                for annotation in self.annotations
+            ],
+            dtype=np.float64,
+        )
+        self.upper_edges = np.array(
+            [
+                annotation.get("core:freq_upper_edge", np.inf)
+                for annotation in self.annotations
+            ],
+            dtype=np.float64,
+        )
+        # edges stored as null
+        self.lower_edges[np.isnan(self.lower_edges)] = -np.inf
+        self.upper_edges[np.isnan(self.upper_edges)] = np.inf
+
+    def __len__(self) -> int:
+        return len(self.annotations)
+
+    def search(
+        self,
+        sample_start: int = 0,
+        sample_end: int | None = None,
+        freq_lo: float | None = None,
+        freq_hi: float | None = None,
+    ) -> np.ndarray:
+        """
+        Get the positions, in sample order, of the annotations overlapping a
+        window.
+
+        Parameters
+        ----------
+        sample_start : int
+            The first sample of the window.
+        sample_end : int, optional
+            The sample after the window, the end of the recording if None.
+        freq_lo : float, optional
+            The lowest frequency of the window, in Hz.
+        freq_hi : float, optional
+            The highest frequency of the window, in Hz.
+
+        Returns
+        -------
+        np.ndarray
+            The positions in self.annotations.
+        """
+        # annotations before first all end before the window, and those
+        # from last on start after it
+        first = int(np.searchsorted(self.max_ends, sample_start, side="right"))
+        last = (
+            len(self.starts)
+            if sample_end is None
+            else int(np.searchsorted(self.starts, sample_end, side="left"))
+        )
+        if first >= last:
+            return np.zeros(0, dtype=np.int64)
+        overlaps = self.ends[first:last] > sample_start
+        if freq_lo is not None:
+            overlaps &= self.upper_edges[first:last] >= freq_lo
+        if freq_hi is not None:
+            overlaps &= self.lower_edges[first:last] <= freq_hi
+        return first + np.flatnonzero(overlaps)
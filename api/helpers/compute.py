@@ -0,0 +1,124 @@
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from typing import Callable, TypeVar
+
+from fastapi import HTTPException
+
+T = TypeVar("T")
+
+
+class ComputePool:
+    """
+    ComputePool runs CPU bound RF work (FFTs, rendering, decoding) in a pool
+    of worker processes, so that the event loop of an API worker only waits
+    on I/O. Jobs over the queue depth are rejected with a 503 instead of
+    piling up behind a busy pool.
+
+    Parameters
+    ----------
+    max_workers : int
+        The number of worker processes. 0 runs the jobs in a thread of this
+        process instead, which still keeps them off the event loop.
+    max_queue : int
+        The maximum number of jobs waiting for a worker.
+    """
+
+    def __init__(self, max_workers: int, max_queue: int):
+        self.max_workers = max(max_workers, 0)
+        self.max_queue = max(max_queue, 0)
+        self.executor: ProcessPoolExecutor | None = None
+        self.pending = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    def get_executor(self) -> ProcessPoolExecutor:
+        if self.executor is None:
+            # workers are spawned rather than forked from a process running
+            # an event loop and database client threads
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self.executor
+
+    async def run(self, function: Callable[..., T], *args, **kwargs) -> T:
+        """
+        Run a function in the pool.
+
+        Parameters
+        ----------
+        function : Callable
+            A module level function, its arguments and result must be
+            picklable.
+
+        Returns
+        -------
+        The result of the function.
+
+        Raises
+        ------
+        HTTPException
+            503 when the queue of the pool is full.
+        """
+        if self.pending >= max(self.max_workers, 1) + self.max_queue:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=503,
+                detail="Too many compute jobs queued, try again later",
+                headers={"Retry-After": "1"},
+            )
+
+        self.pending += 1
+        executor = None
+        try:
+            if self.max_workers == 0:
+                result = await asyncio.to_thread(function, *args, **kwargs)
+            else:
+                loop = asyncio.get_running_loop()
+                executor = self.get_executor()
+                result = await loop.run_in_executor(
+                    executor, partial(function, *args, **kwargs)
+                )
+        except BrokenProcessPool:
+            # a worker died, release the broken pool, its management thread
+            # and surviving workers, and start a new pool for the next jobs,
+            # unless another job failing with it already did
+            self.failed += 1
+            if executor is not None:
+                executor.shutdown(wait=False, cancel_futures=True)
+                if self.executor is executor:
+                    self.executor = None
+            raise
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.pending -= 1
+        self.completed += 1
+        return result
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    def stats(self) -> dict:
+        return {
+            "pending": self.pending,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "max_workers": self.max_workers,
+            "max_queue": self.max_queue,
+        }
+
+
+compute_pool = ComputePool(
+    max_workers=int(os.getenv("IQENGINE_COMPUTE_WORKERS", min(os.cpu_count() or 1, 4))),
+    max_queue=int(os.getenv("IQENGINE_COMPUTE_QUEUE_SIZE", 64)),
+)
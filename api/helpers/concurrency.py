@@ -0,0 +1,101 @@
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from typing import Awaitable, Iterable, TypeVar
+
+T = TypeVar("T")
+
+
+class ConcurrencyLimiter:
+    """
+    ConcurrencyLimiter bounds how many storage operations run at the same time,
+    both in the whole process and per storage account. Callers over the limit
+    wait for a slot, which keeps fan-out requests from opening thousands of
+    connections and being throttled by storage.
+
+    Parameters
+    ----------
+    max_concurrency : int
+        The maximum number of operations running in this process.
+    max_per_account : int
+        The maximum number of operations running against one storage account.
+    """
+
+    def __init__(self, max_concurrency: int, max_per_account: int):
+        self.max_concurrency = max(max_concurrency, 1)
+        self.max_per_account = max(max_per_account, 1)
+        self.running = 0
+        self.waiting = 0
+        self.loop = None
+        self.process_semaphore = None
+        self.account_semaphores: dict[str, asyncio.Semaphore] = {}
+
+    def get_semaphores(self, account: str):
+        # semaphores belong to the event loop they are first used on
+        loop = asyncio.get_running_loop()
+        if loop is not self.loop:
+            self.loop = loop
+            self.process_semaphore = asyncio.Semaphore(self.max_concurrency)
+            self.account_semaphores = {}
+        if account not in self.account_semaphores:
+            self.account_semaphores[account] = asyncio.Semaphore(self.max_per_account)
+        return self.account_semaphores[account], self.process_semaphore
+
+    @asynccontextmanager
+    async def limit(self, account: str):
+        account_semaphore, process_semaphore = self.get_semaphores(account)
+        self.waiting += 1
+        try:
+            await account_semaphore.acquire()
+            try:
+                await process_semaphore.acquire()
+            except BaseException:
+                account_semaphore.release()
+                raise
+        finally:
+            self.waiting -= 1
+        self.running += 1
+        try:
+            yield
+        finally:
+            self.running -= 1
+            process_semaphore.release()
+            account_semaphore.release()
+
+    async def run(self, account: str, operation: Awaitable[T]) -> T:
+        async with self.limit(account):
+            return await operation
+
+    async def gather(self, account: str, operations: Iterable[Awaitable[T]]) -> list[T]:
+        """
+        Run operations against a storage account with bounded concurrency.
+
+        Parameters
+        ----------
+        account : str
+            The storage account the operations read from.
+        operations : Iterable[Awaitable]
+            The operations to run.
+
+        Returns
+        -------
+        list
+            The results, in the same order as the operations.
+        """
+        return await asyncio.gather(
+            *[self.run(account, operation) for operation in operations]
+        )
+
+    def stats(self) -> dict:
+        return {
+            "running": self.running,
+            "waiting": self.waiting,
+            "max_concurrency": self.max_concurrency,
+            "max_per_account": self.max_per_account,
+        }
+
+
+download_limiter = ConcurrencyLimiter(
+    max_concurrency=int(os.getenv("IQENGINE_MAX_CONCURRENT_DOWNLOADS", 64)),
+    max_per_account=int(os.getenv("IQENGINE_MAX_CONCURRENT_DOWNLOADS_PER_ACCOUNT", 16)),
+)
@@ -1,11 +1,27 @@
-def find_smallest_and_largest_next_to_each_other(lst):
+def find_smallest_and_largest_next_to_each_other(lst, max_gap=0):
+    """
+    Group a list of indexes into [start, end] runs of consecutive indexes.
+
+    Parameters
+    ----------
+    lst : list[int]
+        The indexes, sorted in place.
+    max_gap : int, optional
+        The number of missing indexes allowed between two indexes of the same
+        run. Defaults to 0, only strictly consecutive indexes are grouped.
+
+    Returns
+    -------
+    list[list[int]]
+        The inclusive [start, end] of each run.
+    """
     result = []
     i = 0
     list.sort(lst)
     while i < len(lst) - 1:
-        if lst[i + 1] - lst[i] == 1:
+        if 1 <= lst[i + 1] - lst[i] <= max_gap + 1:
             start = lst[i]
-            while i < len(lst) - 1 and lst[i + 1] - lst[i] == 1:
+            while i < len(lst) - 1 and 1 <= lst[i + 1] - lst[i] <= max_gap + 1:
                 i += 1
             end = lst[i]
             result.append([start, end])
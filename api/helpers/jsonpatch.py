@@ -0,0 +1,200 @@
+import copy
+from typing import Any
+
+JSON_PATCH_MEDIA_TYPE = "application/json-patch+json"
+MERGE_PATCH_MEDIA_TYPE = "application/merge-patch+json"
+
+
+def parse_pointer(pointer: str) -> list[str]:
+    """
+    Split a JSON pointer (RFC 6901) into its unescaped tokens.
+    """
+    if pointer == "":
+        return []
+    if not pointer.startswith("/"):
+        raise ValueError(f"Invalid JSON pointer: {pointer}")
+    return [
+        token.replace("~1", "/").replace("~0", "~") for token in pointer[1:].split("/")
+    ]
+
+
+def to_pointer(path: str, token: str) -> str:
+    return f"{path}/{token.replace('~', '~0').replace('/', '~1')}"
+
+
+def get_array_index(array: list, token: str, insert: bool = False) -> int:
+    if insert and token == "-":
+        return len(array)
+    if not token.isdigit() or (len(token) > 1 and token[0] == "0"):
+        raise ValueError(f"Invalid array index: {token}")
+    index = int(token)
+    if index > len(array) or (not insert and index == len(array)):
+        raise ValueError(f"Array index out of range: {token}")
+    return index
+
+
+def resolve(document: Any, tokens: list[str]) -> Any:
+    for token in tokens:
+        if isinstance(document, dict):
+            if token not in document:
+                raise ValueError(f"Path not found: /{'/'.join(tokens)}")
+            document = document[token]
+        elif isinstance(document, list):
+            document = document[get_array_index(document, token)]
+        else:
+            raise ValueError(f"Path not found: /{'/'.join(tokens)}")
+    return document
+
+
+def add(document: Any, tokens: list[str], value: Any) -> Any:
+    if not tokens:
+        return value
+    parent = resolve(document, tokens[:-1])
+    if isinstance(parent, dict):
+        parent[tokens[-1]] = value
+    elif isinstance(parent, list):
+        parent.insert(get_array_index(parent, tokens[-1], insert=True), value)
+    else:
+        raise ValueError(f"Cannot add to /{'/'.join(tokens[:-1])}")
+    return document
+
+
+def remove(document: Any, tokens: list[str]) -> Any:
+    if not tokens:
+        raise ValueError("Cannot remove the whole document")
+    parent = resolve(document, tokens[:-1])
+    if isinstance(parent, dict):
+        if tokens[-1] not in parent:
+            raise ValueError(f"Path not found: /{'/'.join(tokens)}")
+        return parent.pop(tokens[-1])
+    if isinstance(parent, list):
+        return parent.pop(get_array_index(parent, tokens[-1]))
+    raise ValueError(f"Path not found: /{'/'.join(tokens)}")
+
+
+def apply_patch(document: dict, operations: list[dict]) -> dict:
+    """
+    Apply a JSON patch (RFC 6902) to a document.
+
+    Parameters
+    ----------
+    document : dict
+        The document, left unchanged.
+    operations : list[dict]
+        The add, remove, replace, move, copy and test operations.
+
+    Returns
+    -------
+    dict
+        The patched copy of the document.
+
+    Raises
+    ------
+    ValueError
+        When an operation is invalid, fails or its test does not hold, in
+        which case no operation is applied.
+    """
+    if not isinstance(operations, list):
+        raise ValueError("A JSON patch is an array of operations")
+    document = copy.deepcopy(document)
+    for operation in operations:
+        if not isinstance(operation, dict) or "path" not in operation:
+            raise ValueError(f"Invalid operation: {operation}")
+        op = operation.get("op")
+        tokens = parse_pointer(operation["path"])
+        if op in ["add", "replace", "test"] and "value" not in operation:
+            raise ValueError(f"Missing value in operation: {operation}")
+        if op == "add":
+            document = add(document, tokens, copy.deepcopy(operation["value"]))
+        elif op == "remove":
+            remove(document, tokens)
+        elif op == "replace":
+            resolve(document, tokens)
+            if tokens:
+                remove(document, tokens)
+            document = add(document, tokens, copy.deepcopy(operation["value"]))
+        elif op in ["move", "copy"]:
+            if "from" not in operation:
+                raise ValueError(f"Missing from in operation: {operation}")
+            source = parse_pointer(operation["from"])
+            if op == "move":
+                if tokens[: len(source)] == source and tokens != source:
+                    raise ValueError("Cannot move a value into itself")
+                value = remove(document, source)
+            else:
+                value = copy.deepcopy(resolve(document, source))
+            document = add(document, tokens, value)
+        elif op == "test":
+            if resolve(document, tokens) != operation["value"]:
+                raise ValueError(f"Test failed: {operation['path']}")
+        else:
+            raise ValueError(f"Invalid operation: {op}")
+    return document
+
+
+def apply_merge_patch(target: Any, patch: Any) -> Any:
+    """
+    Apply a JSON merge patch (RFC 7396) to a document: objects are merged
+    recursively, null removes a member and any other value replaces it.
+
+    Returns
+    -------
+    The patched copy of the document.
+    """
+    if not isinstance(patch, dict):
+        return copy.deepcopy(patch)
+    result = copy.deepcopy(target) if isinstance(target, dict) else {}
+    for key, value in patch.items():
+        if value is None:
+            result.pop(key, None)
+        else:
+            result[key] = apply_merge_patch(result.get(key), value)
+    return result
+
+
+def make_patch(source: Any, target: Any, path: str = "") -> list[dict]:
+    """
+    Get a JSON patch (RFC 6902) turning a document into another. Objects are
+    compared member by member and arrays of the same length item by item,
+    other values that differ are replaced whole.
+
+    Parameters
+    ----------
+    source : Any
+        The original document.
+    target : Any
+        The document the patch leads to.
+    path : str
+        The JSON pointer of the documents, within a larger document.
+
+    Returns
+    -------
+    list[dict]
+        The add, remove and replace operations.
+    """
+    if isinstance(source, dict) and isinstance(target, dict):
+        operations = []
+        for key in source:
+            if key not in target:
+                operations.append({"op": "remove", "path": to_pointer(path, key)})
+        for key, value in target.items():
+            if key in source:
+                operations += make_patch(source[key], value, to_pointer(path, key))
+            else:
+                operations.append(
+                    {"op": "add", "path": to_pointer(path, key), "value": value}
+                )
+        return operations
+    if (
+        isinstance(source, list)
+        and isinstance(target, list)
+        and len(source) == len(target)
+    ):
+        operations = []
+        for index, (item, target_item) in enumerate(zip(source, target)):
+            operations += make_patch(item, target_item, to_pointer(path, str(index)))
+        return operations
+    # 1 == 1.0 == True in Python, but not in JSON
+    if type(source) is type(target) and source == target:
+        return []
+    return [{"op": "replace", "path": path, "value": target}]
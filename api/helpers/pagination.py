@@ -0,0 +1,33 @@
+import base64
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from fastapi import HTTPException
+
+# Largest page a listing returns at once
+MAX_PAGE_SIZE = 1000
+
+# Response header carrying the cursor of the next page
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(last_id: ObjectId) -> str:
+    """
+    Encode the _id of the last document of a page as an opaque cursor.
+    """
+    return base64.urlsafe_b64encode(last_id.binary).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> ObjectId:
+    """
+    Decode a cursor made by encode_cursor back to the _id to resume after.
+
+    Raises
+    ------
+    HTTPException
+        400 when the cursor is not one made by encode_cursor.
+    """
+    try:
+        return ObjectId(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (InvalidId, TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
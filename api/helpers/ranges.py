@@ -0,0 +1,108 @@
+from typing import Optional
+
+# Range headers with more ranges than this are ignored and the whole file is sent
+MAX_RANGES = 64
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range_header(
+    range_header: Optional[str], size: int
+) -> Optional[list[tuple[int, int]]]:
+    """
+    Parse an HTTP Range header (RFC 7233) against a resource of a known size.
+
+    Parameters
+    ----------
+    range_header : str
+        The value of the Range header, e.g. "bytes=0-499,1000-".
+    size : int
+        The size of the resource in bytes.
+
+    Returns
+    -------
+    list[tuple[int, int]]
+        The inclusive (first byte, last byte) of each satisfiable range, in
+        order, overlapping and adjacent ranges coalesced into one. None when
+        the header is missing, malformed, not in bytes or when its ranges add
+        up to more than the resource, in which case the whole resource should
+        be sent.
+
+    Raises
+    ------
+    RangeNotSatisfiable
+        When none of the ranges overlaps the resource.
+    """
+    if not range_header:
+        return None
+    unit, _, range_set = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or not range_set.strip():
+        return None
+    specs = range_set.split(",")
+    if len(specs) > MAX_RANGES:
+        return None
+
+    ranges = []
+    for spec in specs:
+        first, dash, last = spec.strip().partition("-")
+        if not dash:
+            return None
+        try:
+            if first == "":
+                # suffix range: the last N bytes
+                suffix_length = int(last)
+                if suffix_length <= 0:
+                    continue
+                ranges.append((max(size - suffix_length, 0), size - 1))
+                continue
+            start = int(first)
+            end = int(last) if last != "" else None
+        except ValueError:
+            return None
+        if start < 0 or (end is not None and end < start):
+            return None
+        if start >= size:
+            continue
+        ranges.append((start, size - 1 if end is None else min(end, size - 1)))
+
+    if not ranges or size == 0:
+        raise RangeNotSatisfiable()
+    # overlapping ranges would send the same bytes several times
+    if sum(end - start + 1 for start, end in ranges) > size:
+        return None
+    return coalesce_ranges(ranges)
+
+
+def coalesce_ranges(ranges: list[tuple[int, int]]) -> list[tuple[int, int]]:
+    """
+    Sort inclusive byte ranges and merge those that overlap or are adjacent,
+    as RFC 7233 section 4.1 recommends.
+    """
+    coalesced: list[tuple[int, int]] = []
+    for start, end in sorted(ranges):
+        if coalesced and start <= coalesced[-1][1] + 1:
+            coalesced[-1] = (coalesced[-1][0], max(coalesced[-1][1], end))
+        else:
+            coalesced.append((start, end))
+    return coalesced
+
+
+def is_strong_match(
+    if_range: str, etag: Optional[str], last_modified: Optional[str]
+) -> bool:
+    """
+    Check whether the If-Range validator of a request names the current
+    version of a resource. An entity tag only matches with the strong
+    comparison of RFC 7232 section 2.3.2: neither tag may be weak.
+    """
+    if_range = if_range.strip()
+    if if_range.startswith('"') or if_range.startswith("W/"):
+        return (
+            etag is not None
+            and not if_range.startswith("W/")
+            and not etag.startswith("W/")
+            and if_range == etag
+        )
+    return last_modified is not None and if_range == last_modified
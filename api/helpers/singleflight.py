@@ -0,0 +1,45 @@
+import asyncio
+from typing import Awaitable, Callable, Generic, Hashable, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight(Generic[T]):
+    """
+    SingleFlight runs at most one operation per key at a time. Callers asking
+    for a key that is already in flight wait for that operation and share its
+    result, or its exception, instead of starting their own.
+    """
+
+    def __init__(self):
+        self.flights: dict[Hashable, asyncio.Task] = {}
+        self.shared = 0
+
+    async def do(self, key: Hashable, operation: Callable[[], Awaitable[T]]) -> T:
+        """
+        Run an operation unless one is already in flight for the key.
+
+        Parameters
+        ----------
+        key : Hashable
+            The key identifying the operation.
+        operation : Callable
+            Creates the awaitable to run, only called when nothing is in
+            flight for the key.
+
+        Returns
+        -------
+        The result of the operation in flight.
+        """
+        task = self.flights.get(key)
+        if task is None:
+            task = asyncio.ensure_future(operation())
+            self.flights[key] = task
+            task.add_done_callback(lambda _: self.flights.pop(key, None))
+        else:
+            self.shared += 1
+        # a caller going away does not cancel the operation for the others
+        return await asyncio.shield(task)
+
+    def stats(self) -> dict:
+        return {"in_flight": len(self.flights), "shared": self.shared}
@@ -10,6 +10,7 @@ class ApiType(Enum):
     THUMB = 2
     IQDATA = 3
     METADATA = 4
+    ENVELOPE = 5
 
 
 def get_content_type(apiType: ApiType):
@@ -35,6 +36,8 @@ def get_content_type(apiType: ApiType):
             return "application/octet-stream"
         case ApiType.METADATA:
             return "application/json"
+        case ApiType.ENVELOPE:
+            return "application/octet-stream"
         case _:
             raise ValueError("Invalid ApiType value")
 
@@ -65,6 +68,8 @@ def get_file_name(filepath: str, apiType: ApiType) -> str:
             return filepath + ".sigmf-data"
         case ApiType.METADATA:
             return filepath + ".sigmf-meta"
+        case ApiType.ENVELOPE:
+            return filepath + ".sigmf-envelope"
         case _:
             raise ValueError("Invalid ApiType value")
 
@@ -3,15 +3,21 @@ import os
 from logging.config import dictConfig
 
 from database.database import db
+from database.indexes import create_indexes
+from database.metadata_repo import backfill_computed_fields
+from database.version_repo import compact_versions
 from dotenv import load_dotenv
 from fastapi import FastAPI, Request
 from fastapi.staticfiles import StaticFiles
 from handlers.config import router as config_router
 from handlers.datasources import router as datasources_router
+from handlers.envelope import router as envelope_router
 from handlers.iq import router as iq_router
 from handlers.metadata import router as metadata_router
 from handlers.plugins import router as plugins_router
+from handlers.spectrogram import router as spectrogram_router
 from handlers.status import router as status_router
+from helpers.compute import compute_pool
 from importer.all import import_all_from_env
 from pydantic import BaseModel
 from pymongo.errors import ServerSelectionTimeoutError
@@ -85,12 +91,18 @@ app.include_router(metadata_router)
 app.include_router(status_router)
 app.include_router(config_router)
 app.include_router(plugins_router)
+app.include_router(spectrogram_router)
+app.include_router(envelope_router)
 
 app.mount("/", SPAStaticFiles(directory="iqengine", html=True), name="iqengine")
 
 
 app.add_event_handler("startup", db)
+app.add_event_handler("startup", create_indexes)
+app.add_event_handler("startup", backfill_computed_fields)
+app.add_event_handler("startup", compact_versions)
 app.add_event_handler("startup", import_all_from_env)
+app.add_event_handler("shutdown", compute_pool.shutdown)
 
 
 @app.exception_handler(ServerSelectionTimeoutError)
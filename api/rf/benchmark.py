@@ -0,0 +1,89 @@
+"""
+Compare the batched spectrogram and the complex64 sample decoder with the
+implementations they replaced.
+
+Run from the api directory with: python -m rf.benchmark
+"""
+
+import timeit
+
+import numpy as np
+from rf.samples import get_samples
+from rf.spectrogram import generate_spectrogram
+
+
+def generate_spectrogram_loop(samples, fftSize) -> np.ndarray:
+    num_rows = int(np.floor(len(samples) / fftSize))
+    spectrogram = np.zeros((num_rows, fftSize))
+    for i in range(num_rows):
+        spectrogram[i, :] = 10 * np.log10(
+            np.abs(
+                np.fft.fftshift(np.fft.fft(samples[i * fftSize : (i + 1) * fftSize]))
+            )
+            ** 2
+        )
+    return spectrogram
+
+
+def get_samples_ci16(data_bytes) -> np.ndarray:
+    samples = np.frombuffer(data_bytes, dtype=np.int16)
+    return samples[::2] + 1j * samples[1::2]
+
+
+def benchmark_get_samples(num_samples: int = 2**22, repeat: int = 5):
+    rng = np.random.default_rng(0)
+    data_bytes = rng.integers(-(2**15), 2**15, 2 * num_samples, np.int16).tobytes()
+    out = np.empty(num_samples, dtype=np.complex64)
+    before = min(
+        timeit.repeat(lambda: get_samples_ci16(data_bytes), number=1, repeat=repeat)
+    )
+    after = min(
+        timeit.repeat(
+            lambda: get_samples(data_bytes, "ci16_le"), number=1, repeat=repeat
+        )
+    )
+    reused = min(
+        timeit.repeat(
+            lambda: get_samples(data_bytes, "ci16_le", out=out),
+            number=1,
+            repeat=repeat,
+        )
+    )
+    print(
+        f"ci16 decode: before {before * 1000:6.1f} ms, "
+        f"complex64 {after * 1000:6.1f} ms ({before / after:.1f}x), "
+        f"with out= {reused * 1000:6.1f} ms ({before / reused:.1f}x)"
+    )
+
+
+def benchmark_generate_spectrogram(num_samples: int = 2**22, repeat: int = 5):
+    rng = np.random.default_rng(0)
+    samples = (rng.normal(size=num_samples) + 1j * rng.normal(size=num_samples)).astype(
+        np.complex64
+    )
+    for fftSize in [64, 256, 1024, 8192]:
+        loop = min(
+            timeit.repeat(
+                lambda: generate_spectrogram_loop(samples, fftSize),
+                number=1,
+                repeat=repeat,
+            )
+        )
+        batched = min(
+            timeit.repeat(
+                lambda: generate_spectrogram(samples, fftSize), number=1, repeat=repeat
+            )
+        )
+        print(
+            f"fftSize {fftSize:5}: loop {loop * 1000:8.1f} ms, "
+            f"batched {batched * 1000:8.1f} ms ({loop / batched:.1f}x)"
+        )
+
+
+def main():
+    benchmark_get_samples()
+    benchmark_generate_spectrogram()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+import json
+import math
+import struct
+
+import numpy as np
+from rf.samples import get_samples
+
+# Samples per point of the most detailed level of the envelope
+BLOCK_SIZE = 1024
+
+# Number of points of a level merged into one point of the level above
+LEVEL_FACTOR = 4
+
+# Sidecar layout: magic, header length, JSON header, then every level as
+# float32 (points, channel I/Q, min/max/rms) arrays
+ENVELOPE_MAGIC = b"IQENVLP1"
+ENVELOPE_PREFIX = struct.Struct("<8sI")
+POINT_BYTES = 2 * 3 * 4
+
+
+def get_block_envelope(content: bytes, data_type: str, block_size: int) -> np.ndarray:
+    """
+    Get the min, max and RMS of the I and Q channels of each block of samples.
+
+    Parameters
+    ----------
+    content : bytes
+        The samples, a whole number of blocks except for the last piece of a
+        recording.
+    data_type : str
+        The data type of the samples.
+    block_size : int
+        The number of samples per block.
+
+    Returns
+    -------
+    np.ndarray
+        The (blocks, 2, 3) float32 envelope: channel I/Q, then min/max/rms.
+    """
+    channels = get_samples(content, data_type).view(np.float32).reshape(-1, 2)
+    starts = np.arange(0, len(channels), block_size)
+    if len(starts) == 0:
+        return np.zeros((0, 2, 3), dtype=np.float32)
+    counts = np.diff(np.append(starts, len(channels)))[:, np.newaxis]
+    envelope = np.empty((len(starts), 2, 3), dtype=np.float32)
+    envelope[:, :, 0] = np.minimum.reduceat(channels, starts)
+    envelope[:, :, 1] = np.maximum.reduceat(channels, starts)
+    squares = np.add.reduceat(np.square(channels, dtype=np.float64), starts)
+    envelope[:, :, 2] = np.sqrt(squares / counts)
+    return envelope
+
+
+def build_levels(envelope: np.ndarray) -> list[np.ndarray]:
+    """
+    Build the levels of the envelope pyramid, each one LEVEL_FACTOR times
+    coarser than the one below, up to a single point.
+    """
+    levels = [envelope]
+    while len(levels[-1]) > 1:
+        below = levels[-1]
+        starts = np.arange(0, len(below), LEVEL_FACTOR)
+        counts = np.diff(np.append(starts, len(below)))[:, np.newaxis]
+        level = np.empty((len(starts), 2, 3), dtype=np.float32)
+        level[:, :, 0] = np.minimum.reduceat(below[:, :, 0], starts)
+        level[:, :, 1] = np.maximum.reduceat(below[:, :, 1], starts)
+        squares = np.add.reduceat(np.square(below[:, :, 2], dtype=np.float64), starts)
+        level[:, :, 2] = np.sqrt(squares / counts)
+        levels.append(level)
+    return levels
+
+
+def encode_envelope(
+    levels: list[np.ndarray], sample_count: int, block_size: int, source_etag: str
+) -> bytes:
+    """
+    Encode the levels of an envelope as a sidecar object.
+
+    Parameters
+    ----------
+    levels : list[np.ndarray]
+        The levels built by build_levels.
+    sample_count : int
+        The number of samples of the recording.
+    block_size : int
+        The number of samples per point of the first level.
+    source_etag : str
+        The etag of the .sigmf-data blob the envelope was computed from.
+
+    Returns
+    -------
+    bytes
+        The sidecar data.
+    """
+    offset = 0
+    header_levels = []
+    for level in levels:
+        header_levels.append({"offset": offset, "points": len(level)})
+        offset += level.nbytes
+    header = json.dumps(
+        {
+            "sample_count": sample_count,
+            "block_size": block_size,
+            "level_factor": LEVEL_FACTOR,
+            "source_etag": source_etag,
+            "levels": header_levels,
+        }
+    ).encode()
+    return b"".join(
+        [ENVELOPE_PREFIX.pack(ENVELOPE_MAGIC, len(header)), header]
+        + [level.astype("<f4").tobytes() for level in levels]
+    )
+
+
+def decode_header(content: bytes) -> dict | None:
+    """
+    Decode the header at the start of a sidecar object.
+
+    Parameters
+    ----------
+    content : bytes
+        The first bytes of the sidecar.
+
+    Returns
+    -------
+    dict
+        The header, with "data_start" the offset of the first level, or None
+        when the content does not start with a whole envelope header.
+    """
+    if len(content) < ENVELOPE_PREFIX.size:
+        return None
+    magic, header_length = ENVELOPE_PREFIX.unpack_from(content)
+    data_start = ENVELOPE_PREFIX.size + header_length
+    if magic != ENVELOPE_MAGIC or len(content) < data_start:
+        return None
+    header = json.loads(content[ENVELOPE_PREFIX.size : data_start])
+    header["data_start"] = data_start
+    return header
+
+
+def get_level_range(header: dict, start: int, count: int, width: int):
+    """
+    Choose the most detailed level that shows a range of samples in at most
+    width points.
+
+    Returns
+    -------
+    tuple[int, int, int]
+        The level, its first point and its number of points in the range.
+    """
+    count = max(min(count, header["sample_count"] - start), 0)
+    for index, level in enumerate(header["levels"]):
+        samples_per_point = header["block_size"] * header["level_factor"] ** index
+        first = start // samples_per_point
+        last = math.ceil((start + count) / samples_per_point)
+        points = min(last, level["points"]) - first
+        if points <= width or index == len(header["levels"]) - 1:
+            return index, first, max(points, 0)
+    raise ValueError("Envelope has no levels")
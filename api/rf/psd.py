@@ -0,0 +1,87 @@
+import numpy as np
+from rf.samples import get_samples
+from rf.spectrogram import generate_power
+
+# Power below this is reported as this, so that silent bins stay finite in dB
+POWER_FLOOR = 1e-20
+
+
+def get_power_stats(
+    content: bytes, data_type: str, fft_size: int, window: str | None, hop: int
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, int]:
+    """
+    Get the sum, maximum and minimum of the power spectra of a piece of a
+    recording.
+
+    Parameters
+    ----------
+    content : bytes
+        The samples, a whole number of hops plus fft_size - hop samples long
+        for consecutive pieces to cover the recording without gaps.
+    data_type : str
+        The data type of the samples.
+    fft_size : int
+        The size of the FFT to use.
+    window : str
+        The window to apply to each FFT, see rf.spectrogram.get_window.
+    hop : int
+        The number of samples between the start of consecutive FFTs.
+
+    Returns
+    -------
+    tuple[np.ndarray, np.ndarray, np.ndarray, int]
+        The sum, maximum and minimum of each frequency bin and the number of
+        FFTs.
+    """
+    power = generate_power(get_samples(content, data_type), fft_size, window, hop)
+    if len(power) == 0:
+        empty = np.zeros(fft_size, dtype=np.float32)
+        return empty.astype(np.float64), empty, empty, 0
+    return (
+        power.sum(axis=0, dtype=np.float64),
+        power.max(axis=0),
+        power.min(axis=0),
+        len(power),
+    )
+
+
+class PowerSpectrum:
+    """
+    PowerSpectrum accumulates the average, max-hold and min-hold spectra of
+    a recording one piece at a time, in memory that only depends on the FFT
+    size.
+
+    Parameters
+    ----------
+    fft_size : int
+        The size of the FFT.
+    """
+
+    def __init__(self, fft_size: int):
+        self.rows = 0
+        self.total = np.zeros(fft_size, dtype=np.float64)
+        self.max_hold = np.full(fft_size, -np.inf, dtype=np.float32)
+        self.min_hold = np.full(fft_size, np.inf, dtype=np.float32)
+
+    def add(self, stats: tuple[np.ndarray, np.ndarray, np.ndarray, int]):
+        total, max_hold, min_hold, rows = stats
+        if rows == 0:
+            return
+        self.rows += rows
+        self.total += total
+        np.maximum(self.max_hold, max_hold, out=self.max_hold)
+        np.minimum(self.min_hold, min_hold, out=self.min_hold)
+
+    def to_db(self, power: np.ndarray) -> list[float]:
+        if self.rows == 0:
+            return []
+        power = np.maximum(power, POWER_FLOOR)
+        return np.round(10 * np.log10(power), 2).tolist()
+
+    def to_dict(self) -> dict:
+        return {
+            "rows": self.rows,
+            "average": self.to_db(self.total / max(self.rows, 1)),
+            "max_hold": self.to_db(self.max_hold),
+            "min_hold": self.to_db(self.min_hold),
+        }
@@ -1,7 +1,51 @@
 import numpy as np
 
+# Component dtype and zero offset of each SigMF complex datatype. Datatypes
+# without an endianness suffix are little-endian, as the 8 bit ones have none.
+SAMPLE_FORMATS = {
+    "ci8": ("i1", 0),
+    "i8": ("i1", 0),
+    "cu8": ("u1", 2**7),
+    "ci16_le": ("<i2", 0),
+    "ci16_be": (">i2", 0),
+    "ci16": ("<i2", 0),
+    "cu16_le": ("<u2", 2**15),
+    "cu16_be": (">u2", 2**15),
+    "cu16": ("<u2", 2**15),
+    "ci32_le": ("<i4", 0),
+    "ci32_be": (">i4", 0),
+    "ci32": ("<i4", 0),
+    "cf32_le": ("<f4", 0),
+    "cf32_be": (">f4", 0),
+    "cf32": ("<f4", 0),
+    "cf64_le": ("<f8", 0),
+    "cf64_be": (">f8", 0),
+    "cf64": ("<f8", 0),
+}
 
-def get_samples(data_bytes, data_type) -> np.ndarray:
+
+def get_sample_format(data_type) -> tuple[np.dtype, int]:
+    """
+    Get the dtype of the I and Q components of a datatype and the value
+    subtracted to center unsigned ones on zero.
+
+    Parameters
+    ----------
+    data_type : str
+        The data type of the bytes.
+
+    Returns
+    -------
+    tuple[np.dtype, int]
+        The component dtype and the zero offset.
+    """
+    if data_type not in SAMPLE_FORMATS:
+        raise ValueError("Datatype " + data_type + " not implemented")
+    dtype, offset = SAMPLE_FORMATS[data_type]
+    return np.dtype(dtype), offset
+
+
+def get_samples(data_bytes, data_type, out=None) -> np.ndarray:
     """
     Get samples from bytes.
 
@@ -11,24 +55,36 @@ def get_samples(data_bytes, data_type) -> np.ndarray:
         The bytes to convert to samples.
     data_type : str
         The data type of the bytes.
+    out : np.ndarray, optional
+        A complex64 array to decode into, reused across calls. It must hold
+        at least as many samples as the bytes contain.
 
     Returns
     -------
     np.ndarray
-        The samples.
+        The complex64 samples, a view of out when it is given. Trailing bytes
+        that do not make a whole sample are ignored.
     """
 
-    if data_type == "ci16_le" or data_type == "ci16" or data_type == "ci16_be":
-        samples = np.frombuffer(data_bytes, dtype=np.int16)
-        samples = samples[::2] + 1j * samples[1::2]
-    elif data_type == "cf32_le" or data_type == "cf32" or data_type == "cf32_be":
-        samples = np.frombuffer(data_bytes, dtype=np.complex64)
-    elif data_type == "ci8" or data_type == "i8":
-        samples = np.frombuffer(data_bytes, dtype=np.int8)
-        samples = samples[::2] + 1j * samples[1::2]
+    dtype, offset = get_sample_format(data_type)
+    count = len(data_bytes) // (2 * dtype.itemsize)
+    components = np.frombuffer(data_bytes, dtype=dtype, count=2 * count)
+    if out is None:
+        if dtype == np.dtype("<f4"):
+            # already complex64 in memory, no copy needed
+            return components.view(np.complex64)
+        out = np.empty(count, dtype=np.complex64)
+    elif out.dtype != np.complex64 or len(out) < count:
+        raise ValueError("out must be a complex64 array of at least %d samples" % count)
     else:
-        raise ("Datatype " + data_type + " not implemented")
-    return samples
+        out = out[:count]
+
+    interleaved = out.view(np.float32)
+    if offset:
+        np.subtract(components, offset, out=interleaved, dtype=np.float32)
+    else:
+        interleaved[:] = components
+    return out
 
 
 def get_bytes_per_iq_sample(data_type):
@@ -46,11 +102,5 @@ def get_bytes_per_iq_sample(data_type):
     int
         The number of bytes per I+Q sample.
     """
-    if data_type == "cf32_le" or data_type == "cf32" or data_type == "cf32_be":
-        return 8
-    elif data_type == "ci16_le" or data_type == "ci16" or data_type == "ci16_be":
-        return 4
-    elif data_type == "ci8" or data_type == "i8":
-        return 2
-    else:
-        raise ValueError("Datatype " + data_type + " not implemented")
+    dtype, _ = get_sample_format(data_type)
+    return 2 * dtype.itemsize
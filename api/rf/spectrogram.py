@@ -1,12 +1,131 @@
 import io
+import os
+from functools import lru_cache
 
-import matplotlib.pyplot as plt
 import numpy as np
+from matplotlib import colormaps
+from numpy.lib.stride_tricks import sliding_window_view
 from PIL import Image
 from rf.samples import get_samples
 
+try:
+    # scipy.fft keeps complex64 precision and can use several threads, it is
+    # in requirements.txt and numpy's FFT is only a fallback
+    import scipy.fft as scipy_fft
+except ImportError:
+    scipy_fft = None
 
-def generate_spectrogram(samples, fftSize) -> np.ndarray:
+# Number of threads computing the FFTs of a spectrogram, numpy's fallback FFT
+# is single threaded
+FFT_WORKERS = int(os.getenv("IQENGINE_FFT_WORKERS", 1))
+
+# Number of samples transformed at once by generate_spectrogram
+FFT_BLOCK_SAMPLES = 2**18
+
+# Size in pixels of the images made by generate_image
+IMAGE_SIZE = (640, 480)
+
+WINDOWS = {
+    "hann": np.hanning,
+    "hamming": np.hamming,
+    "blackman": np.blackman,
+    "bartlett": np.bartlett,
+}
+
+
+def get_window(window, fftSize) -> np.ndarray | None:
+    """
+    Get the window to apply to each FFT.
+
+    Parameters
+    ----------
+    window : str or np.ndarray or None
+        The name of the window ("hann", "hamming", "blackman" or "bartlett"),
+        its fftSize coefficients, or None for no window.
+    fftSize : int
+        The size of the FFT to use.
+
+    Returns
+    -------
+    np.ndarray
+        The window coefficients, or None for no window.
+    """
+
+    if window is None or isinstance(window, np.ndarray):
+        return window
+    if window not in WINDOWS:
+        raise ValueError("Window " + window + " not implemented")
+    return WINDOWS[window](fftSize).astype(np.float32)
+
+
+def generate_power(
+    samples, fftSize, window=None, hop=None, workers=FFT_WORKERS
+) -> np.ndarray:
+    """
+    Generate the power spectrum of consecutive FFTs of samples.
+
+    Parameters
+    ----------
+    samples : np.ndarray
+        The samples to transform.
+    fftSize : int
+        The size of the FFT to use.
+    window : str or np.ndarray, optional
+        The window to apply to each FFT, see get_window. Defaults to no window.
+    hop : int, optional
+        The number of samples between the start of consecutive FFTs, smaller
+        than fftSize for overlapping FFTs. Defaults to fftSize.
+    workers : int, optional
+        The number of threads computing the FFTs, ignored by numpy's fallback
+        FFT. Defaults to IQENGINE_FFT_WORKERS, or 1.
+
+    Returns
+    -------
+    np.ndarray
+        The (rows, fftSize) linear power, fftshifted, as float32.
+    """
+
+    samples = np.asarray(samples, dtype=np.complex64)
+    hop = hop or fftSize
+    if len(samples) < fftSize:
+        return np.zeros((0, fftSize), dtype=np.float32)
+    num_rows = (len(samples) - fftSize) // hop + 1
+    if hop == fftSize:
+        frames = samples[: num_rows * fftSize].reshape(num_rows, fftSize)
+    else:
+        frames = sliding_window_view(samples, fftSize)[::hop]
+    coefficients = get_window(window, fftSize)
+    if fftSize % 2 == 0:
+        # multiplying by (-1)^n before the FFT is the same as fftshift after it
+        shift = np.where(np.arange(fftSize) % 2, -1, 1).astype(np.float32)
+        coefficients = shift if coefficients is None else coefficients * shift
+
+    power = np.empty((num_rows, fftSize), dtype=np.float32)
+    # FFT a block of rows at a time so the intermediate arrays stay in cache
+    block_rows = max(FFT_BLOCK_SAMPLES // fftSize, 1)
+    for first_row in range(0, num_rows, block_rows):
+        block = frames[first_row : first_row + block_rows]
+        if coefficients is not None:
+            block = block * coefficients
+        if scipy_fft is not None:
+            spectrum = scipy_fft.fft(block, axis=1, workers=workers)
+        else:
+            # numpy computes in complex128, back to complex64 like scipy
+            spectrum = np.fft.fft(block, axis=1).astype(np.complex64)
+        if fftSize % 2:
+            spectrum = np.fft.fftshift(spectrum, axes=1)
+        np.add(
+            np.square(spectrum.real),
+            np.square(spectrum.imag),
+            out=power[first_row : first_row + block_rows],
+            casting="same_kind",
+        )
+    return power
+
+
+def generate_spectrogram(
+    samples, fftSize, window=None, hop=None, workers=FFT_WORKERS
+) -> np.ndarray:
     """
     Generate a spectrogram from samples.
 
@@ -16,26 +135,52 @@ def generate_spectrogram(samples, fftSize) -> np.ndarray:
         The samples to convert to a spectrogram.
     fftSize : int
         The size of the FFT to use.
+    window : str or np.ndarray, optional
+        The window to apply to each FFT, see get_window. Defaults to no window.
+    hop : int, optional
+        The number of samples between the start of consecutive FFTs, smaller
+        than fftSize for overlapping FFTs. Defaults to fftSize.
+    workers : int, optional
+        The number of threads computing the FFTs, ignored by numpy's fallback
+        FFT. Defaults to IQENGINE_FFT_WORKERS, or 1.
 
     Returns
     -------
     np.ndarray
-        The spectrogram.
+        The (rows, fftSize) spectrogram in dB, as float32.
     """
 
-    num_rows = int(np.floor(len(samples) / fftSize))
-    spectrogram = np.zeros((num_rows, fftSize))
-    for i in range(num_rows):
-        spectrogram[i, :] = 10 * np.log10(
-            np.abs(
-                np.fft.fftshift(np.fft.fft(samples[i * fftSize : (i + 1) * fftSize]))
-            )
-            ** 2
-        )
+    spectrogram = generate_power(samples, fftSize, window, hop, workers)
+    with np.errstate(divide="ignore"):
+        np.log10(spectrogram, out=spectrogram)
+    spectrogram *= 10
     return spectrogram
 
 
-def generate_image(spectrogram, cmap="viridis", format="jpeg") -> bytes:
+@lru_cache(maxsize=None)
+def get_colormap_lut(cmap: str) -> np.ndarray:
+    """
+    Get the 256 entry RGB lookup table of a matplotlib colormap.
+
+    Parameters
+    ----------
+    cmap : str
+        The name of the colormap.
+
+    Returns
+    -------
+    np.ndarray
+        The (256, 3) uint8 lookup table.
+    """
+
+    lut = colormaps[cmap](np.linspace(0, 1, 256), bytes=True)[:, :3]
+    lut.flags.writeable = False
+    return lut
+
+
+def generate_image(
+    spectrogram, cmap="viridis", format="jpeg", size=IMAGE_SIZE
+) -> bytes:
     """
     Generate an image from a spectrogram.
 
@@ -47,6 +192,9 @@ def generate_image(spectrogram, cmap="viridis", format="jpeg") -> bytes:
         The colormap to use. Defaults to "viridis".
     format : str, optional
         The format of the image. Defaults to "jpeg".
+    size : tuple[int, int], optional
+        The (width, height) of the image, or None for one pixel per bin.
+        Defaults to IMAGE_SIZE.
 
     Returns
     -------
@@ -54,19 +202,22 @@ def generate_image(spectrogram, cmap="viridis", format="jpeg") -> bytes:
         The image data.
     """
 
-    fig = plt.figure(frameon=False)
-    ax = plt.Axes(fig, [0.0, 0.0, 1.0, 1.0])
-    ax.set_axis_off()
-    fig.add_axes(ax)
-    ax.imshow(
-        spectrogram, cmap=cmap, aspect="auto", vmin=30 + np.min(np.min(spectrogram))
+    finite = spectrogram[np.isfinite(spectrogram)]
+    # the colormap spans from 30 dB above the noise floor up to the maximum
+    vmin = 30 + finite.min() if finite.size else 0
+    vmax = finite.max() if finite.size else 1
+    scale = 255 / max(vmax - vmin, np.finfo(np.float32).eps)
+    indexes = np.nan_to_num(
+        (np.asarray(spectrogram, dtype=np.float32) - vmin) * scale, nan=0
     )
-    img_buf = io.BytesIO()
-    plt.savefig(img_buf, bbox_inches="tight", pad_inches=0)
-    img_buf.seek(0)
-    im = Image.open(img_buf)
+    indexes = np.clip(indexes, 0, 255, out=indexes).astype(np.uint8)
+
+    im = Image.fromarray(indexes, "L")
+    if size is not None and im.size != size:
+        im = im.resize(size, Image.BILINEAR)
+    rgb = get_colormap_lut(cmap)[np.asarray(im)]
     img_byte_arr = io.BytesIO()
-    im.convert("RGB").save(img_byte_arr, format=format)
+    Image.fromarray(rgb, "RGB").save(img_byte_arr, format=format)
     data = img_byte_arr.getvalue()
     return data
 
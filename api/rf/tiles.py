@@ -0,0 +1,185 @@
+import io
+import math
+
+import numpy as np
+from PIL import Image
+from rf.samples import get_samples
+from rf.spectrogram import generate_spectrogram
+
+# Width and height in pixels of a spectrogram tile
+TILE_SIZE = 256
+
+
+class SpectrogramPyramid:
+    """
+    SpectrogramPyramid describes the zoom levels of the spectrogram of a
+    recording, following the block-max decimation scheme of
+    tools/pmtiles/create_pmtiles.py: the most detailed level is the full
+    resolution spectrogram cut into tiles, and every level above it halves the
+    resolution by keeping the maximum of the 2x2 blocks of the level below, so
+    that every FFT row of the recording, short bursts included, shows on the
+    zoomed out levels.
+
+    Frequency is only decimated until the whole band fits in one tile, so
+    zoomed out tiles keep every frequency bin the tile can display.
+
+    Parameters
+    ----------
+    sample_count : int
+        The number of IQ samples in the recording.
+    fft_size : int
+        The size of the FFT, a power of 2.
+    tile_size : int, optional
+        The size of a tile in pixels, a power of 2. Defaults to TILE_SIZE.
+    """
+
+    def __init__(self, sample_count: int, fft_size: int, tile_size: int = TILE_SIZE):
+        self.fft_size = fft_size
+        self.tile_size = tile_size
+        self.total_rows = sample_count // fft_size
+        largest_axis = max(self.total_rows, fft_size, 1)
+        self.max_zoom = max(math.ceil(math.log2(largest_axis / tile_size)), 0)
+
+    def get_decimation(self, z: int) -> tuple[int, int]:
+        """
+        Get the (time, frequency) decimation factors of a zoom level.
+        """
+        decimation = 2 ** (self.max_zoom - z)
+        return decimation, max(min(decimation, self.fft_size // self.tile_size), 1)
+
+    def get_tile_count(self, z: int) -> tuple[int, int]:
+        """
+        Get the number of (x, y) tiles of a zoom level.
+        """
+        time_decimation, frequency_decimation = self.get_decimation(z)
+        span = self.tile_size * time_decimation
+        columns = self.tile_size * frequency_decimation
+        return (
+            max(math.ceil(self.fft_size / columns), 1),
+            max(math.ceil(self.total_rows / span), 1),
+        )
+
+    def contains(self, z: int, x: int, y: int) -> bool:
+        if z < 0 or z > self.max_zoom or x < 0 or y < 0:
+            return False
+        tiles_x, tiles_y = self.get_tile_count(z)
+        return x < tiles_x and y < tiles_y
+
+    def get_row_range(self, y: int) -> tuple[int, int]:
+        """
+        Get the (first row, number of rows) of the FFT rows of a row of tiles
+        of the most detailed level.
+        """
+        first_row = y * self.tile_size
+        return first_row, min(self.tile_size, self.total_rows - first_row)
+
+    def get_frequency_factor(self, z: int) -> int:
+        """
+        Get how many frequency columns of the level below a zoom level are
+        reduced to one of its columns, 2 or 1 once the band fits in a tile.
+        """
+        return self.get_decimation(z)[1] // self.get_decimation(z + 1)[1]
+
+    def get_children(self, z: int, x: int, y: int) -> tuple[list[int], list[int]]:
+        """
+        Get the x and the y of the tiles of the level below a tile that the
+        tile is reduced from.
+        """
+        factor = self.get_frequency_factor(z)
+        tiles_x, tiles_y = self.get_tile_count(z + 1)
+        return (
+            [child for child in range(x * factor, (x + 1) * factor) if child < tiles_x],
+            [child for child in [2 * y, 2 * y + 1] if child < tiles_y],
+        )
+
+    def combine_tiles(self, z: int, children: list[list[np.ndarray]]) -> np.ndarray:
+        """
+        Reduce the tiles of the level below a tile to the tile itself,
+        keeping the maximum of each decimated block.
+
+        Parameters
+        ----------
+        z : int
+            The zoom level of the tile.
+        children : list[list[np.ndarray]]
+            For each of the children along time, listed by get_children, the
+            children along frequency, in dB.
+
+        Returns
+        -------
+        np.ndarray
+            The (pixel rows, pixel columns) tile in dB.
+        """
+        tile = np.concatenate([np.concatenate(row, axis=1) for row in children])
+        tile = reduce_max(tile, 2, axis=0)
+        return reduce_max(tile, self.get_frequency_factor(z), axis=1)
+
+
+def reduce_max(array: np.ndarray, factor: int, axis: int) -> np.ndarray:
+    """
+    Keep the maximum of each block of factor values along an axis, the last
+    block being padded with -inf.
+    """
+    if factor == 1:
+        return array
+    padding = -array.shape[axis] % factor
+    if padding:
+        pad_width = [(0, 0)] * array.ndim
+        pad_width[axis] = (0, padding)
+        array = np.pad(array, pad_width, constant_values=-np.inf)
+    shape = array.shape[:axis] + (array.shape[axis] // factor, factor)
+    return array.reshape(shape + array.shape[axis + 1 :]).max(axis=axis + 1)
+
+
+def compute_band(
+    pyramid: SpectrogramPyramid, content: bytes, data_type: str
+) -> list[np.ndarray]:
+    """
+    Compute the tiles in dB of a row of tiles of the most detailed level.
+
+    Parameters
+    ----------
+    pyramid : SpectrogramPyramid
+        The pyramid of the recording.
+    content : bytes
+        The samples of the FFT rows listed by get_row_range.
+    data_type : str
+        The data type of the samples.
+
+    Returns
+    -------
+    list[np.ndarray]
+        The (pixel rows, pixel columns) tiles in dB, by x.
+    """
+    spectrogram = generate_spectrogram(
+        get_samples(content, data_type), pyramid.fft_size
+    )
+    return [
+        np.ascontiguousarray(spectrogram[:, column : column + pyramid.tile_size])
+        for column in range(0, pyramid.fft_size, pyramid.tile_size)
+    ]
+
+
+def encode_tile(tile: np.ndarray, db_min: float, db_max: float) -> bytes:
+    """
+    Encode a tile in dB as an 8 bit greyscale PNG.
+
+    Parameters
+    ----------
+    tile : np.ndarray
+        The tile in dB.
+    db_min : float
+        The dB value mapped to 0.
+    db_max : float
+        The dB value mapped to 255.
+
+    Returns
+    -------
+    bytes
+        The PNG image data.
+    """
+    scale = 255 / max(db_max - db_min, np.finfo(np.float32).eps)
+    pixels = np.clip((tile - db_min) * scale, 0, 255).astype(np.uint8)
+    img_byte_arr = io.BytesIO()
+    Image.fromarray(pixels, "L").save(img_byte_arr, format="PNG")
+    return img_byte_arr.getvalue()
@@ -0,0 +1,50 @@
+from helpers.annotation_index import AnnotationIndex
+
+annotations = [
+    {"core:sample_start": 500, "core:sample_count": 100},
+    {
+        "core:sample_start": 0,
+        "core:sample_count": 1000,
+        "core:freq_lower_edge": 100.0,
+        "core:freq_upper_edge": 200.0,
+    },
+    {
+        "core:sample_start": 200,
+        "core:sample_count": 10,
+        "core:freq_lower_edge": 300.0,
+        "core:freq_upper_edge": 400.0,
+    },
+    {"core:sample_start": 2000, "core:sample_count": 1},
+]
+
+
+def search(index, *args):
+    return [
+        index.annotations[position]["core:sample_start"]
+        for position in index.search(*args)
+    ]
+
+
+def test_annotation_index_samples():
+    index = AnnotationIndex(annotations)
+    assert len(index) == 4
+    assert search(index) == [0, 200, 500, 2000]
+    # the long first annotation overlaps windows past later ones
+    assert search(index, 700, 800) == [0]
+    assert search(index, 205, 500) == [0, 200]
+    assert search(index, 600, 2000) == [0]
+    assert search(index, 1000, 2000) == []
+    assert search(index, 1500) == [2000]
+
+
+def test_annotation_index_frequencies():
+    index = AnnotationIndex(annotations)
+    # annotations without edges cover every frequency
+    assert search(index, 0, None, 150.0, 160.0) == [0, 500, 2000]
+    assert search(index, 0, None, 350.0) == [200, 500, 2000]
+    assert search(index, 0, None, None, 100.0) == [0, 500, 2000]
+
+
+def test_annotation_index_empty():
+    index = AnnotationIndex([])
+    assert len(index.search(0, 100)) == 0
@@ -1,9 +1,16 @@
 # vim: tabstop=4 shiftwidth=4 expandtab
+import asyncio
+import copy
+import json
 import os
+from datetime import datetime, timedelta
 from unittest import mock
 
 import pytest
 from database.models import Configuration, Metadata
+from database.database import db
+from database import annotation_repo
+from handlers.metadata import update_meta
 from tests.test_data import test_datasource, valid_metadata
 
 
@@ -190,6 +197,307 @@ async def test_api_get_all_meta(client):
     assert len(response.json()) == 2
 
 
+@pytest.mark.asyncio
+async def test_api_get_all_meta_pages(client):
+    client.post("/api/datasources", json=test_datasource).json()
+    url = (
+        f'/api/datasources/{test_datasource["account"]}/{test_datasource["container"]}'
+    )
+    for name in ["record_a", "record_b", "record_c"]:
+        client.post(f"{url}/{name}/meta", json=valid_metadata)
+
+    response = client.get(f"{url}/meta?limit=2")
+    assert response.status_code == 200
+    assert len(response.json()) == 2
+    cursor = response.headers["x-next-cursor"]
+    response = client.get(f"{url}/meta?limit=2&cursor={cursor}")
+    assert len(response.json()) == 1
+    assert (
+        response.json()[0]["global"]["traceability:origin"]["file_path"] == "record_c"
+    )
+    assert "x-next-cursor" not in response.headers
+
+    response = client.get(f"{url}/meta?limit=2&cursor=not-a-cursor")
+    assert response.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_api_get_all_meta_streams_without_limit(client):
+    client.post("/api/datasources", json=test_datasource).json()
+    url = (
+        f'/api/datasources/{test_datasource["account"]}/{test_datasource["container"]}'
+    )
+    response = client.get(f"{url}/meta")
+    assert response.status_code == 200
+    assert response.json() == []
+
+    for name in ["record_a", "record_b", "record_c"]:
+        client.post(f"{url}/{name}/meta", json=valid_metadata)
+    pages = client.get(f"{url}/meta?limit=3").json()
+    with mock.patch("handlers.metadata.ANNOTATION_BATCH_SIZE", 2):
+        response = client.get(f"{url}/meta")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/json"
+    assert "content-length" not in response.headers
+    assert response.json() == pages
+
+
+@pytest.mark.asyncio
+async def test_api_get_all_meta_ndjson(client):
+    client.post("/api/datasources", json=test_datasource).json()
+    url = (
+        f'/api/datasources/{test_datasource["account"]}/{test_datasource["container"]}'
+    )
+    for name in ["record_a", "record_b", "record_c"]:
+        client.post(f"{url}/{name}/meta", json=valid_metadata)
+
+    headers = {"Accept": "application/x-ndjson"}
+    response = client.get(f"{url}/meta", headers=headers)
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line["global"]["traceability:origin"]["file_path"] for line in lines] == [
+        "record_a",
+        "record_b",
+        "record_c",
+    ]
+
+    response = client.get(f"{url}/meta?limit=1", headers=headers)
+    assert len(response.text.splitlines()) == 1
+    response = client.get(
+        f'{url}/meta?limit=1&cursor={response.headers["x-next-cursor"]}',
+        headers=headers,
+    )
+    assert (
+        json.loads(response.text)["global"]["traceability:origin"]["file_path"]
+        == "record_b"
+    )
+
+
+@pytest.mark.asyncio
+async def test_api_get_all_meta_fields(client):
+    client.post("/api/datasources", json=test_datasource).json()
+    url = (
+        f'/api/datasources/{test_datasource["account"]}/{test_datasource["container"]}'
+    )
+    for name in ["record_a", "record_b"]:
+        client.post(f"{url}/{name}/meta", json=valid_metadata)
+
+    response = client.get(f"{url}/meta?fields=global.core:datatype&limit=1")
+    assert response.status_code == 200
+    assert response.json() == [
+        {
+            "global": {
+                "core:datatype": valid_metadata["global"]["core:datatype"],
+                "traceability:origin": {
+                    "type": "api",
+                    "account": test_datasource["account"],
+                    "container": test_datasource["container"],
+                    "file_path": "record_a",
+                },
+            }
+        }
+    ]
+    assert "x-next-cursor" in response.headers
+
+    response = client.get(f"{url}/meta?fields=global,global.core:datatype")
+    assert len(response.json()) == 2
+    assert "captures" not in response.json()[0]
+
+    response = client.get(f"{url}/meta?fields=$where")
+    assert response.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_api_get_all_meta_summary(client):
+    client.post("/api/datasources", json=test_datasource).json()
+    url = (
+        f'/api/datasources/{test_datasource["account"]}/{test_datasource["container"]}'
+    )
+    for name in ["record_a", "record_b"]:
+        client.post(f"{url}/{name}/meta", json=valid_metadata)
+    summary = {
+        "account": test_datasource["account"],
+        "container": test_datasource["container"],
+        "file_path": "record_a",
+        "datatype": valid_metadata["global"]["core:datatype"],
+        "sample_rate": valid_metadata["global"]["core:sample_rate"],
+        "frequency": valid_metadata["captures"][0].get("core:frequency"),
+        "description": valid_metadata["global"].get("core:description"),
+        "annotation_count": len(valid_metadata["annotations"]),
+    }
+
+    response = client.get(f"{url}/meta?summary=true")
+    assert response.status_code == 200
+    assert response.json()[0] == summary
+    assert response.json()[1]["file_path"] == "record_b"
+
+    response = client.get(
+        f"{url}/meta?summary=true&limit=1",
+        headers={"Accept": "application/x-ndjson"},
+    )
+    assert [json.loads(line) for line in response.text.splitlines()] == [summary]
+
+    response = client.get(f"{url}/record_a/meta?summary=true")
+    assert response.status_code == 200
+    assert response.json() == summary
+    response = client.get(f"{url}/record_a/meta?fields=captures")
+    assert response.json()["captures"] == valid_metadata["captures"]
+    response = client.get(f"{url}/record_c/meta?summary=true")
+    assert response.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_api_get_meta_annotations(client):
+    client.post("/api/datasources", json=test_datasource).json()
+    url = f'/api/datasources/{test_datasource["account"]}/{test_datasource["container"]}/record/meta'
+    metadata = copy.deepcopy(valid_metadata)
+    metadata["annotations"] = [
+        {"core:sample_start": start, "core:sample_count": 10, "core:label": str(start)}
+        for start in range(0, 1000, 10)
+    ]
+    client.post(url, json=metadata)
+
+    response = client.get(f"{url}/annotations?sample_start=95&sample_end=130&limit=2")
+    assert response.status_code == 200
+    assert response.json()["revision"] == 0
+    assert response.json()["count"] == 4
+    assert [a["core:label"] for a in response.json()["annotations"]] == ["90", "100"]
+
+    # a new revision is served from a new index
+    metadata["annotations"] = metadata["annotations"][:5]
+    client.put(url, json=metadata)
+    response = client.get(f"{url}/annotations?sample_start=95")
+    assert response.json()["revision"] == 1
+    assert response.json()["count"] == 0
+
+    response = client.get(f"{url.replace('record', 'missing')}/annotations")
+    assert response.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_api_annotation_index_not_cached_across_a_write(client):
+    client.post("/api/datasources", json=test_datasource).json()
+    url = f'/api/datasources/{test_datasource["account"]}/{test_datasource["container"]}/record/meta'
+    metadata = copy.deepcopy(valid_metadata)
+    metadata["annotations"] = [{"core:sample_start": 0, "core:sample_count": 10}]
+    client.post(url, json=metadata)
+    get_all = annotation_repo.get_all
+
+    async def get_all_during_write(*args):
+        # a new revision is written while the annotations are read
+        annotations = await get_all(*args)
+        await db().metadata.update_one(
+            {}, {"$inc": {"global.traceability:revision": 1}}
+        )
+        return annotations
+
+    with mock.patch("handlers.metadata.annotation_indexes", {}) as indexes:
+        with mock.patch(
+            "handlers.metadata.annotation_repo.get_all", get_all_during_write
+        ):
+            response = client.get(f"{url}/annotations")
+        assert response.json()["revision"] == 0
+        assert response.json()["count"] == 1
+        assert indexes == {}
+
+        response = client.get(f"{url}/annotations")
+        assert response.json()["revision"] == 1
+        assert [key[3] for key in indexes] == [1]
+
+        # nor while another write holds the lease
+        await db().metadata.update_one(
+            {},
+            {
+                "$inc": {"global.traceability:revision": 1},
+                "$set": {
+                    "_writing": {
+                        "id": "id",
+                        "until": datetime.utcnow() + timedelta(seconds=30),
+                    }
+                },
+            },
+        )
+        response = client.get(f"{url}/annotations")
+        assert response.json()["revision"] == 2
+        assert [key[3] for key in indexes] == [1]
+
+
+@pytest.mark.asyncio
+async def test_api_annotations_stored_out_of_document(client):
+    client.post("/api/datasources", json=test_datasource).json()
+    url = f'/api/datasources/{test_datasource["account"]}/{test_datasource["container"]}/record/meta'
+    metadata = copy.deepcopy(valid_metadata)
+    metadata["annotations"] = [
+        {"core:sample_start": 0, "core:sample_count": 10, "core:label": "a"},
+        {"core:sample_start": 20, "core:sample_count": 10, "core:label": "b"},
+    ]
+    response = client.post(url, json=metadata)
+    uuids = [annotation["core:uuid"] for annotation in response.json()["annotations"]]
+    assert all(uuids)
+    stored = await db().metadata.find_one({})
+    assert "annotations" not in stored
+
+    response = client.post(
+        f"{url}/annotations",
+        json={
+            "upsert": [
+                {
+                    "core:uuid": uuids[0],
+                    "core:sample_start": 0,
+                    "core:sample_count": 5,
+                    "core:label": "c",
+                },
+                {"core:sample_start": 40, "core:sample_count": 10},
+            ],
+            "delete": [uuids[1]],
+        },
+    )
+    assert response.status_code == 200
+    assert response.json()["revision"] == 1
+    new_uuid = response.json()["upserted"][1]
+
+    response = client.get(url)
+    assert response.json()["global"]["traceability:revision"] == 1
+    assert [
+        (annotation["core:uuid"], annotation.get("core:label"))
+        for annotation in response.json()["annotations"]
+    ] == [(uuids[0], "c"), (new_uuid, None)]
+    response = client.get(f"{url}?summary=true")
+    assert response.json()["annotation_count"] == 2
+    response = client.get("/api/datasources/query?label=c&match=exact")
+    assert [reference["file_path"] for reference in response.json()] == ["record"]
+
+    # a whole update only writes the annotations that changed
+    metadata = client.get(url).json()
+    metadata["annotations"][1]["core:label"] = "d"
+    client.put(url, json=metadata)
+    version = await db().versions.find_one({"global.traceability:revision": 2})
+    assert version["annotation_changes"] == {
+        "upsert": [
+            {
+                "core:uuid": new_uuid,
+                "core:sample_start": 40,
+                "core:sample_count": 10,
+                "core:label": "d",
+            }
+        ],
+        "delete": [],
+    }
+
+    response = client.get(f"{url}?fields=annotations.core:label")
+    assert response.json()["annotations"] == [{"core:label": "c"}, {"core:label": "d"}]
+    response = client.get(
+        f'{url.removesuffix("/record/meta")}/meta?fields=global.core:datatype'
+    )
+    assert "annotations" not in response.json()[0]
+
+    response = client.post(
+        f"{url.replace('record', 'missing')}/annotations", json={"delete": [new_uuid]}
+    )
+    assert response.status_code == 404
+
+
 @pytest.mark.asyncio
 async def test_api_get_all_meta_path(client):
     client.post("/api/datasources", json=test_datasource).json()
@@ -331,3 +639,287 @@ async def test_api_update_file_version(client):
     )
     assert response_object["global"]["traceability:origin"]["file_path"] == "file/path"
     assert response_object["annotations"][0]["core:sample_start"] == 10000
+
+
+@pytest.mark.asyncio
+async def test_api_patch_meta(client):
+    client.post("/api/datasources", json=test_datasource).json()
+    url = f'/api/datasources/{test_datasource["account"]}/{test_datasource["container"]}/record/meta'
+    metadata = copy.deepcopy(valid_metadata)
+    metadata["annotations"] = [
+        {"core:sample_start": 0, "core:sample_count": 10, "core:label": "a"}
+    ]
+    client.post(url, json=metadata)
+
+    response = client.patch(
+        url,
+        json=[
+            {"op": "add", "path": "/global/core:description", "value": "Patched"},
+            {"op": "replace", "path": "/global/core:sample_rate", "value": 2000000},
+        ],
+        headers={"Content-Type": "application/json-patch+json", "If-Match": '"0"'},
+    )
+    assert response.status_code == 200
+    assert response.json() == {"revision": 1}
+    assert response.headers["ETag"] == '"1"'
+    stored = await db().metadata.find_one({})
+    assert stored["_search"]["description"] == "patched"
+
+    response = client.patch(
+        url,
+        json={"global": {"core:description": None}},
+        headers={"Content-Type": "application/merge-patch+json"},
+    )
+    assert response.json() == {"revision": 2}
+    response = client.get(url)
+    assert response.json()["global"]["traceability:revision"] == 2
+    assert response.json()["global"]["core:sample_rate"] == 2000000
+    assert response.json()["global"]["core:description"] is None
+    assert len(response.json()["annotations"]) == 1
+
+    # computed fields follow the patch, those of the annotations are kept
+    stored = await db().metadata.find_one({})
+    assert "description" not in stored["_search"]
+    assert stored["_search"]["labels"] == ["a"]
+    assert stored["_derived"]["annotation_count"] == 1
+    version = await db().versions.find_one({"global.traceability:revision": 2})
+    assert "core:description" not in version["global"]
+    assert version["annotation_changes"] == {"upsert": [], "delete": []}
+
+    # stale revisions, failed tests and invalid metadata are not written
+    response = client.patch(url, json={}, headers={"If-Match": '"1"'})
+    assert response.status_code == 412
+    response = client.patch(
+        url, json=[{"op": "test", "path": "/global/core:sample_rate", "value": 1}]
+    )
+    assert response.status_code == 400
+    response = client.patch(
+        url, json=[{"op": "remove", "path": "/global/core:datatype"}]
+    )
+    assert response.status_code == 422
+    response = client.patch(
+        url,
+        json=[{"op": "replace", "path": "/global/traceability:revision", "value": 9}],
+    )
+    assert response.status_code == 400
+    response = client.patch(url, json=[{"op": "remove", "path": "/annotations/0"}])
+    assert response.status_code == 400
+    response = client.get(url)
+    assert response.json()["global"]["traceability:revision"] == 2
+
+
+@pytest.mark.asyncio
+async def test_api_patch_meta_not_existing(client):
+    client.post("/api/datasources", json=test_datasource).json()
+    response = client.patch(
+        f'/api/datasources/{test_datasource["account"]}/{test_datasource["container"]}/file_path/meta',
+        json={"global": {"core:description": "Patched"}},
+    )
+    assert response.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_api_put_meta_if_match(client):
+    client.post("/api/datasources", json=test_datasource).json()
+    url = f'/api/datasources/{test_datasource["account"]}/{test_datasource["container"]}/file_path/meta'
+    client.post(url, json=valid_metadata)
+    response = client.put(url, json=valid_metadata, headers={"If-Match": '"0"'})
+    assert response.status_code == 204
+    response = client.put(url, json=valid_metadata, headers={"If-Match": '"0"'})
+    assert response.status_code == 412
+    response = client.put(url, json=valid_metadata, headers={"If-Match": "revision"})
+    assert response.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_api_put_meta_concurrently(client):
+    client.post("/api/datasources", json=test_datasource).json()
+    url = f'/api/datasources/{test_datasource["account"]}/{test_datasource["container"]}/file_path/meta'
+    client.post(url, json=valid_metadata)
+
+    def revision(label):
+        metadata = copy.deepcopy(valid_metadata)
+        metadata["global"]["core:description"] = label
+        metadata["annotations"] = [
+            {"core:sample_start": 0, "core:sample_count": 10, "core:label": label}
+        ]
+        return Metadata.parse_obj(metadata)
+
+    replace_all = annotation_repo.replace_all
+    calls = []
+
+    async def slow_first_replace_all(*args):
+        # the first writer is still writing its annotations when the second
+        # one replaces the metadata
+        calls.append(args)
+        if len(calls) == 1:
+            await asyncio.sleep(0.02)
+        return await replace_all(*args)
+
+    with mock.patch(
+        "database.annotation_repo.replace_all", side_effect=slow_first_replace_all
+    ):
+        await asyncio.gather(
+            *[
+                update_meta(
+                    test_datasource["account"],
+                    test_datasource["container"],
+                    "file_path",
+                    revision(label),
+                    expected_revision=None,
+                    current_user=None,
+                )
+                for label in ["first", "second"]
+            ]
+        )
+
+    response = client.get(url)
+    assert response.json()["global"]["traceability:revision"] == 2
+    assert "_writing" not in response.json()
+    description = response.json()["global"]["core:description"]
+    assert [
+        annotation["core:label"] for annotation in response.json()["annotations"]
+    ] == [description]
+    for revision_number in [1, 2]:
+        version = client.get(f"{url}/versions/{revision_number}").json()
+        assert [annotation["core:label"] for annotation in version["annotations"]] == [
+            version["global"]["core:description"]
+        ]
+
+
+@pytest.mark.asyncio
+async def test_api_put_meta_while_written(client):
+    client.post("/api/datasources", json=test_datasource).json()
+    url = f'/api/datasources/{test_datasource["account"]}/{test_datasource["container"]}/file_path/meta'
+    client.post(url, json=valid_metadata)
+    lease = {"id": "other", "until": datetime.utcnow() + timedelta(minutes=1)}
+    await db().metadata.update_one({}, {"$set": {"_writing": lease}})
+    with mock.patch("handlers.metadata.WRITE_RETRY_DELAY", 0):
+        response = client.put(url, json=valid_metadata)
+        assert response.status_code == 409
+        response = client.post(f"{url}/annotations", json={"delete": ["a"]})
+        assert response.status_code == 409
+
+    # the lease of a writer that stopped expires
+    lease["until"] = datetime.utcnow() - timedelta(seconds=1)
+    await db().metadata.update_one({}, {"$set": {"_writing": lease}})
+    response = client.put(url, json=valid_metadata)
+    assert response.status_code == 204
+    assert "_writing" not in await db().metadata.find_one({})
+
+
+@pytest.mark.asyncio
+async def test_api_create_meta_bulk(client):
+    client.post("/api/datasources", json=test_datasource).json()
+    base_url = (
+        f'/api/datasources/{test_datasource["account"]}/{test_datasource["container"]}'
+    )
+    client.post(f"{base_url}/existing/meta", json=valid_metadata)
+    metadata = copy.deepcopy(valid_metadata)
+    metadata["annotations"] = [
+        {"core:sample_start": 0, "core:sample_count": 10, "core:label": "a"}
+    ]
+    duplicate_uuids = copy.deepcopy(valid_metadata)
+    duplicate_uuids["annotations"] = [
+        {"core:sample_start": 0, "core:sample_count": 10, "core:uuid": "same"},
+        {"core:sample_start": 10, "core:sample_count": 10, "core:uuid": "same"},
+    ]
+    items = [
+        {"file_path": "first", "metadata": metadata},
+        {"file_path": "existing", "metadata": valid_metadata},
+        {"file_path": "invalid", "metadata": {"global": {}}},
+        {"file_path": "dir/second", "metadata": valid_metadata},
+        {"file_path": "first", "metadata": valid_metadata},
+        {"file_path": "duplicate_uuids", "metadata": duplicate_uuids},
+    ]
+    response = client.post(f"{base_url}/meta/bulk", json=items)
+    assert response.status_code == 200
+    assert response.json()["created"] == 2
+    assert [
+        (result["file_path"], result["status"]) for result in response.json()["results"]
+    ] == [
+        ("first", 201),
+        ("existing", 409),
+        ("invalid", 422),
+        ("dir/second", 201),
+        ("first", 409),
+        ("duplicate_uuids", 422),
+    ]
+    assert client.get(f"{base_url}/duplicate_uuids/meta").status_code == 404
+
+    response = client.get(f"{base_url}/first/meta")
+    assert response.json()["global"]["traceability:revision"] == 0
+    assert response.json()["annotations"][0]["core:label"] == "a"
+    assert response.json()["annotations"][0]["core:uuid"]
+    response = client.get(f"{base_url}/first/meta/versions/0")
+    assert response.json()["annotations"][0]["core:label"] == "a"
+    assert client.get(f"{base_url}/dir/second/meta").status_code == 200
+
+    response = client.post(
+        f"{base_url}/meta/bulk",
+        content="\n".join(
+            json.dumps({"file_path": f"ndjson{index}", "metadata": valid_metadata})
+            for index in range(3)
+        ),
+        headers={"Content-Type": "application/x-ndjson"},
+    )
+    assert response.json()["created"] == 3
+
+
+@pytest.mark.asyncio
+async def test_api_create_meta_bulk_invalid(client):
+    response = client.post(
+        f'/api/datasources/{test_datasource["account"]}/{test_datasource["container"]}/meta/bulk',
+        json=[],
+    )
+    assert response.status_code == 404
+    client.post("/api/datasources", json=test_datasource).json()
+    response = client.post(
+        f'/api/datasources/{test_datasource["account"]}/{test_datasource["container"]}/meta/bulk',
+        json={"file_path": "record"},
+    )
+    assert response.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_api_create_meta_bulk_annotation_conflict(client):
+    client.post("/api/datasources", json=test_datasource).json()
+    base_url = (
+        f'/api/datasources/{test_datasource["account"]}/{test_datasource["container"]}'
+    )
+    origin = {
+        "account": test_datasource["account"],
+        "container": test_datasource["container"],
+        "file_path": "stale",
+    }
+    await db().annotations.create_index(
+        [
+            ("traceability:origin.account", 1),
+            ("traceability:origin.container", 1),
+            ("traceability:origin.file_path", 1),
+            ("core:uuid", 1),
+        ],
+        unique=True,
+    )
+    # an annotation left behind by an earlier write of the recording
+    await db().annotations.insert_one(
+        {"core:uuid": "stale", "core:sample_start": 0, "traceability:origin": origin}
+    )
+    metadata = copy.deepcopy(valid_metadata)
+    metadata["annotations"] = [
+        {"core:sample_start": 0, "core:sample_count": 10, "core:uuid": "stale"}
+    ]
+    response = client.post(
+        f"{base_url}/meta/bulk",
+        json=[
+            {"file_path": "stale", "metadata": metadata},
+            {"file_path": "fresh", "metadata": metadata},
+        ],
+    )
+    assert response.status_code == 200
+    assert response.json()["created"] == 1
+    assert [result["status"] for result in response.json()["results"]] == [500, 201]
+    assert client.get(f"{base_url}/stale/meta").status_code == 404
+    assert await db().annotations.count_documents({}) == 1
+    assert await db().versions.count_documents({}) == 1
+    assert client.get(f"{base_url}/fresh/meta/versions/0").status_code == 200
@@ -0,0 +1,113 @@
+from unittest import mock
+from unittest.mock import Mock
+
+import pytest
+from azure.storage.blob import BlobProperties
+from blob.azure_client import AzureBlobClient
+from blob.block_cache import BlockCache
+
+test_binary = bytes(range(100))
+
+
+def get_test_blob_properties(etag='"etag"'):
+    properties = BlobProperties()
+    properties.size = len(test_binary)
+    properties.etag = etag
+    return properties
+
+
+async def download_test_range(filepath, offset=None, length=None, **kwargs):
+    return test_binary[offset : offset + length]
+
+
+def test_block_cache_evicts_least_recently_used():
+    cache = BlockCache(max_bytes=20, block_size=10)
+    cache.put(("a", "c", "f", "e", 0), b"0" * 10)
+    cache.put(("a", "c", "f", "e", 1), b"1" * 10)
+    assert cache.get(("a", "c", "f", "e", 0)) == b"0" * 10
+    cache.put(("a", "c", "f", "e", 2), b"2" * 10)
+    assert cache.get(("a", "c", "f", "e", 1)) is None
+    assert cache.get(("a", "c", "f", "e", 0)) == b"0" * 10
+    assert cache.stats()["hits"] == 2
+    assert cache.stats()["misses"] == 1
+    assert cache.stats()["bytes"] == 20
+
+
+@mock.patch("blob.azure_client.block_cache", BlockCache(max_bytes=1000, block_size=16))
+@mock.patch(
+    "blob.azure_client.AzureBlobClient.download_blob_content",
+    side_effect=download_test_range,
+)
+@mock.patch(
+    "blob.azure_client.AzureBlobClient.get_blob_properties",
+    return_value=get_test_blob_properties(),
+)
+@pytest.mark.asyncio
+async def test_get_blob_content_served_from_block_cache(
+    mock_get_blob_properties: Mock, mock_download_blob_content: Mock
+):
+    client = AzureBlobClient("account", "container")
+
+    content = await client.get_blob_content("file.sigmf-data", offset=10, length=30)
+    assert content == test_binary[10:40]
+    assert mock_download_blob_content.call_count == 1
+    assert mock_download_blob_content.call_args[0][1:] == (0, 48)
+
+    content = await client.get_blob_content("file.sigmf-data", offset=20, length=10)
+    assert content == test_binary[20:30]
+    assert mock_download_blob_content.call_count == 1
+
+    content = await client.get_blob_content("file.sigmf-data", offset=40, length=100)
+    assert content == test_binary[40:]
+    assert mock_download_blob_content.call_count == 2
+    assert mock_download_blob_content.call_args[0][1:] == (48, 52)
+
+
+@mock.patch("blob.azure_client.block_cache", BlockCache(max_bytes=1000, block_size=16))
+@mock.patch(
+    "blob.azure_client.AzureBlobClient.download_blob_content",
+    side_effect=download_test_range,
+)
+@pytest.mark.asyncio
+async def test_get_blob_content_refetches_when_etag_changes(
+    mock_download_blob_content: Mock,
+):
+    client = AzureBlobClient("account", "container")
+
+    with mock.patch(
+        "blob.azure_client.AzureBlobClient.get_blob_properties",
+        return_value=get_test_blob_properties('"first"'),
+    ):
+        await client.get_blob_content("file.sigmf-data", offset=0, length=16)
+    with mock.patch(
+        "blob.azure_client.AzureBlobClient.get_blob_properties",
+        return_value=get_test_blob_properties('"second"'),
+    ):
+        await client.get_blob_content("file.sigmf-data", offset=0, length=16)
+
+    assert mock_download_blob_content.call_count == 2
+
+
+@mock.patch("blob.azure_client.block_cache", BlockCache(max_bytes=1000, block_size=16))
+@mock.patch(
+    "blob.azure_client.AzureBlobClient.download_blob_content",
+    side_effect=download_test_range,
+)
+@mock.patch(
+    "blob.azure_client.AzureBlobClient.get_blob_properties",
+    return_value=get_test_blob_properties(),
+)
+@pytest.mark.asyncio
+async def test_get_blob_content_uncached_reads_only_the_range(
+    mock_get_blob_properties: Mock, mock_download_blob_content: Mock
+):
+    client = AzureBlobClient("account", "container")
+
+    content = await client.get_blob_content(
+        "file.sigmf-data", offset=10, length=4, cached=False
+    )
+    assert content == test_binary[10:14]
+    assert mock_download_blob_content.call_args[0][1:] == (10, 4)
+    assert mock_download_blob_content.call_count == 1
+    await client.get_blob_content("file.sigmf-data", offset=10, length=4)
+    assert mock_download_blob_content.call_count == 2
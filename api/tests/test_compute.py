@@ -0,0 +1,58 @@
+import asyncio
+import math
+import os
+import time
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+from fastapi import HTTPException
+from helpers.compute import ComputePool
+
+
+@pytest.mark.asyncio
+async def test_compute_pool_runs_in_processes():
+    pool = ComputePool(max_workers=1, max_queue=4)
+    try:
+        assert await pool.run(math.factorial, 5) == 120
+        assert pool.stats()["completed"] == 1
+    finally:
+        pool.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_compute_pool_runs_in_thread():
+    pool = ComputePool(max_workers=0, max_queue=4)
+    assert await pool.run(sorted, [3, 1, 2], reverse=True) == [3, 2, 1]
+    with pytest.raises(ValueError):
+        await pool.run(int, "not a number")
+    assert pool.stats()["failed"] == 1
+    assert pool.executor is None
+
+
+@pytest.mark.asyncio
+async def test_compute_pool_rejects_when_queue_is_full():
+    pool = ComputePool(max_workers=0, max_queue=1)
+    jobs = [asyncio.create_task(pool.run(time.sleep, 0.1)) for _ in range(2)]
+    await asyncio.sleep(0)
+    with pytest.raises(HTTPException) as e:
+        await pool.run(time.sleep, 0)
+    assert e.value.status_code == 503
+    await asyncio.gather(*jobs)
+    assert pool.stats()["rejected"] == 1
+    assert pool.stats()["pending"] == 0
+
+
+@pytest.mark.asyncio
+async def test_compute_pool_replaces_a_broken_pool():
+    pool = ComputePool(max_workers=1, max_queue=4)
+    try:
+        executor = pool.get_executor()
+        with pytest.raises(BrokenProcessPool):
+            await pool.run(os._exit, 1)
+        # the broken pool is shut down rather than leaked
+        assert executor._shutdown_thread
+        assert pool.executor is None
+        assert await pool.run(math.factorial, 5) == 120
+        assert pool.executor is not executor
+    finally:
+        pool.shutdown()
@@ -0,0 +1,44 @@
+import asyncio
+
+import pytest
+from helpers.concurrency import ConcurrencyLimiter
+
+
+@pytest.mark.asyncio
+async def test_limiter_bounds_concurrency_per_account_and_process():
+    limiter = ConcurrencyLimiter(max_concurrency=3, max_per_account=2)
+    running = {"a": 0, "b": 0}
+    peaks = {"a": 0, "b": 0, "total": 0}
+
+    async def operation(account, value):
+        running[account] += 1
+        peaks[account] = max(peaks[account], running[account])
+        peaks["total"] = max(peaks["total"], sum(running.values()))
+        await asyncio.sleep(0.01)
+        running[account] -= 1
+        return value
+
+    results_a, results_b = await asyncio.gather(
+        limiter.gather("a", [operation("a", i) for i in range(6)]),
+        limiter.gather("b", [operation("b", i) for i in range(6)]),
+    )
+
+    assert results_a == [0, 1, 2, 3, 4, 5]
+    assert results_b == [0, 1, 2, 3, 4, 5]
+    assert peaks["a"] == 2
+    assert peaks["b"] == 2
+    assert peaks["total"] == 3
+    assert limiter.stats()["running"] == 0
+    assert limiter.stats()["waiting"] == 0
+
+
+@pytest.mark.asyncio
+async def test_limiter_releases_slot_on_error():
+    limiter = ConcurrencyLimiter(max_concurrency=1, max_per_account=1)
+
+    async def failing():
+        raise ValueError("failed")
+
+    with pytest.raises(ValueError):
+        await limiter.run("a", failing())
+    assert await limiter.run("a", asyncio.sleep(0, result="ok")) == "ok"
@@ -44,3 +44,11 @@ async def test_find_smallest_and_largest_next_to_each_other_when_unordered_list(
         [10, 9, 8, 7, 15, 5, 4, 3, 2, 1]
     )
     assert testvalue == [[1, 5], [7, 10], [15, 15]]
+
+
+@pytest.mark.asyncio
+async def test_find_smallest_and_largest_next_to_each_other_with_max_gap():
+    testvalue = find_smallest_and_largest_next_to_each_other(
+        [1, 2, 4, 5, 9, 10, 12], max_gap=1
+    )
+    assert testvalue == [[1, 5], [9, 12]]
@@ -0,0 +1,167 @@
+import copy
+import json
+import os
+from datetime import datetime
+from unittest import mock
+
+import pytest
+from database import annotation_repo, datasource_repo
+from database.database import db
+from database.derived import DERIVED_FIELD, get_derived_fields, parse_datetime
+from database.metadata_repo import backfill_computed_fields
+from database.search import SEARCH_FIELD
+from tests.test_data import test_datasource, valid_metadata
+
+
+def test_get_derived_fields():
+    document = {
+        "global": {
+            "core:sample_rate": 1000,
+            "traceability:sample_length": 4000,
+        },
+        "captures": [
+            {
+                "core:sample_start": 0,
+                "core:frequency": 2.41e9,
+                "core:datetime": "2023-01-01T00:00:00Z",
+            },
+            {
+                "core:sample_start": 2000,
+                "core:frequency": 2.45e9,
+                "core:datetime": "2023-01-01T00:00:02+00:00",
+            },
+        ],
+    }
+    assert get_derived_fields(document) == {
+        "annotation_count": 0,
+        "min_frequency": 2.41e9 - 500,
+        "max_frequency": 2.45e9 + 500,
+        "duration": 4.0,
+        "start_datetime": datetime(2023, 1, 1),
+        "end_datetime": datetime(2023, 1, 1, 0, 0, 4),
+    }
+
+
+def test_parse_datetime_utc_suffix():
+    # parsed the same on Python 3.10, whose fromisoformat rejects Z
+    expected = datetime(2023, 1, 1, 0, 0, 0)
+    assert parse_datetime("2023-01-01T00:00:00Z") == expected
+    assert parse_datetime("2023-01-01T00:00:00.000Z") == expected
+    assert parse_datetime("2023-01-01T01:00:00+01:00") == expected
+    assert parse_datetime("not a datetime") is None
+
+
+def test_get_derived_fields_without_length_or_datetimes():
+    document = {
+        "global": {"core:sample_rate": 1000},
+        "captures": [
+            {"core:sample_start": 0, "core:datetime": "2023-01-01T00:00:00"},
+            {"core:sample_start": 10, "core:datetime": "not a datetime"},
+            {"core:sample_start": 20, "core:datetime": "2023-01-01T00:00:05"},
+        ],
+    }
+    assert get_derived_fields(document) == {
+        "annotation_count": 0,
+        "start_datetime": datetime(2023, 1, 1),
+        "end_datetime": datetime(2023, 1, 1, 0, 0, 5),
+    }
+    assert get_derived_fields({"global": {}, "captures": [], "annotations": [{}]}) == {
+        "annotation_count": 1
+    }
+
+
+@pytest.mark.asyncio
+async def test_backfill_computed_fields(client):
+    origin = {"type": "api", "account": "a", "container": "c", "file_path": "f"}
+    await db().metadata.insert_one(
+        {
+            "global": {
+                "core:author": "Jane",
+                "core:sample_rate": 10,
+                "traceability:origin": origin,
+            },
+            "captures": [{"core:sample_start": 0, "core:frequency": 100}],
+            "annotations": [{"core:sample_start": 0, "core:label": "LTE"}],
+        }
+    )
+    await backfill_computed_fields()
+    document = await db().metadata.find_one({})
+    assert document[SEARCH_FIELD]["labels"] == ["lte"]
+    assert document[DERIVED_FIELD] == {
+        "annotation_count": 1,
+        "min_frequency": 95,
+        "max_frequency": 105,
+    }
+    # the embedded annotations moved to the annotations collection
+    assert "annotations" not in document
+    annotations = await annotation_repo.get_all("a", "c", "f")
+    assert [annotation["core:label"] for annotation in annotations] == ["LTE"]
+    assert annotations[0]["core:uuid"]
+
+
+@pytest.mark.asyncio
+async def test_backfill_computed_fields_is_idempotent(client):
+    origin = {"type": "api", "account": "a", "container": "c", "file_path": "f"}
+    embedded = [
+        {"core:sample_start": 0, "core:label": "LTE"},
+        {"core:sample_start": 10, "core:label": "WiFi"},
+    ]
+    await db().metadata.insert_one(
+        {"global": {"traceability:origin": origin}, "annotations": embedded}
+    )
+    await backfill_computed_fields()
+    first = await annotation_repo.get_all("a", "c", "f")
+    # a run interrupted before the annotations were removed from the
+    # metadata, or another worker migrating it at the same time
+    await db().metadata.update_one({}, {"$set": {"annotations": embedded}})
+    await backfill_computed_fields()
+    assert await annotation_repo.get_all("a", "c", "f") == first
+    assert len(first) == 2
+
+
+@pytest.mark.asyncio
+async def test_backfill_adds_search_fields_of_the_origin(client):
+    origin = {"type": "api", "account": "Acc", "container": "Con", "file_path": "f"}
+    await db().metadata.insert_one(
+        {
+            "global": {"core:author": "Jane", "traceability:origin": origin},
+            SEARCH_FIELD: {"author": "jane"},
+            DERIVED_FIELD: {"annotation_count": 0},
+        }
+    )
+    await backfill_computed_fields()
+    document = await db().metadata.find_one({})
+    assert document[SEARCH_FIELD]["account"] == "acc"
+    assert document[SEARCH_FIELD]["container"] == "con"
+
+
+@pytest.mark.asyncio
+async def test_sync_creates_metadata_with_derived_fields(tmp_path, client):
+    client.post("/api/datasources", json=test_datasource).json()
+    container_path = (
+        tmp_path / test_datasource["account"] / test_datasource["container"]
+    )
+    container_path.mkdir(parents=True)
+    metadata = copy.deepcopy(valid_metadata)
+    metadata["global"]["core:datatype"] = "ci16_le"
+    metadata["global"]["core:sample_rate"] = 100
+    (container_path / "record.sigmf-meta").write_text(json.dumps(metadata))
+    (container_path / "record.sigmf-data").write_bytes(bytes(4 * 1000))
+    (container_path / "orphan.sigmf-meta").write_text(json.dumps(metadata))
+
+    with mock.patch.dict(
+        os.environ, {"IQENGINE_LOCAL_STORAGE_ROOT": str(tmp_path)}
+    ), mock.patch("database.datasource_repo.decrypt", return_value="secret"):
+        await datasource_repo.sync(
+            test_datasource["account"], test_datasource["container"]
+        )
+        # already synced metadata are left untouched
+        await datasource_repo.sync(
+            test_datasource["account"], test_datasource["container"]
+        )
+
+    documents = await db().metadata.find({}).to_list(None)
+    assert len(documents) == 1
+    assert documents[0]["global"]["traceability:origin"]["file_path"] == "record"
+    assert documents[0]["global"]["traceability:sample_length"] == 1000
+    assert documents[0][DERIVED_FIELD]["duration"] == 10.0
@@ -0,0 +1,103 @@
+import copy
+import os
+from unittest import mock
+from unittest.mock import Mock
+
+import numpy as np
+import pytest
+from database import datasource_repo
+from database.models import DataSource
+from rf.envelope import (
+    build_levels,
+    decode_header,
+    encode_envelope,
+    get_block_envelope,
+    get_level_range,
+)
+from tests.test_data import test_datasource, valid_metadata
+
+
+def test_get_block_envelope():
+    components = np.array([1, -1, 3, 0, -2, 4, 0, 0, 5, 5], dtype="<i2")
+    envelope = get_block_envelope(components.tobytes(), "ci16_le", 2)
+    assert envelope.shape == (3, 2, 3)
+    # first block: I = [1, 3], Q = [-1, 0]
+    assert envelope[0, 0].tolist() == [1, 3, pytest.approx(np.sqrt(5))]
+    assert envelope[0, 1].tolist() == [-1, 0, pytest.approx(np.sqrt(0.5))]
+    # the last block holds a single sample
+    assert envelope[2, 0].tolist() == [5, 5, 5]
+
+
+def test_build_levels_and_header():
+    envelope = get_block_envelope(np.arange(20, dtype="<f4").tobytes(), "cf32_le", 1)
+    levels = build_levels(envelope)
+    assert [len(level) for level in levels] == [10, 3, 1]
+    assert levels[1][0, 0, 0] == 0
+    assert levels[1][0, 0, 1] == 6
+    assert levels[2][0, 1, 1] == 19
+
+    content = encode_envelope(levels, 10, 1, '"etag"')
+    header = decode_header(content)
+    assert header["source_etag"] == '"etag"'
+    assert [level["points"] for level in header["levels"]] == [10, 3, 1]
+    assert decode_header(content[:10]) is None
+    assert get_level_range(header, 0, 10, 10) == (0, 0, 10)
+    assert get_level_range(header, 4, 6, 6) == (0, 4, 6)
+    assert get_level_range(header, 0, 10, 3) == (1, 0, 3)
+    assert get_level_range(header, 0, 10, 1) == (2, 0, 1)
+
+
+async def mock_get_test_datasource():
+    return DataSource(**test_datasource)
+
+
+@mock.patch("handlers.envelope.ENVELOPE_PIECE_BLOCKS", 2)
+@mock.patch("handlers.envelope.BLOCK_SIZE", 4)
+@mock.patch("handlers.spectrogram.decrypt", return_value="secret")
+@mock.patch("handlers.envelope.decrypt", return_value="secret")
+@pytest.mark.asyncio
+async def test_get_envelope(
+    mock_decrypt: Mock, mock_decrypt_data_type, tmp_path, client
+):
+    container_path = (
+        tmp_path / test_datasource["account"] / test_datasource["container"]
+    )
+    container_path.mkdir(parents=True)
+    samples = np.arange(2 * 100, dtype="<i2")
+    (container_path / "envelope_file.sigmf-data").write_bytes(samples.tobytes())
+    metadata = copy.deepcopy(valid_metadata)
+    metadata["global"]["core:datatype"] = "ci16_le"
+    client.post("/api/datasources", json=test_datasource)
+    client.post(
+        f'/api/datasources/{test_datasource["account"]}/{test_datasource["container"]}/envelope_file/meta',
+        json=metadata,
+    )
+    client.app.dependency_overrides[datasource_repo.get] = mock_get_test_datasource
+    url = (
+        f'/api/datasources/{test_datasource["account"]}/{test_datasource["container"]}'
+        "/envelope_file/envelope"
+    )
+
+    try:
+        with mock.patch.dict(
+            os.environ, {"IQENGINE_LOCAL_STORAGE_ROOT": str(tmp_path)}
+        ):
+            response = client.get(f"{url}?width=100")
+            assert response.status_code == 200
+            result = response.json()
+            assert result["level"] == 0
+            assert result["samples_per_point"] == 4
+            assert len(result["i"]["min"]) == 25
+            assert result["i"]["min"][:2] == [0, 8]
+            assert result["q"]["max"][-1] == 199
+            assert (container_path / "envelope_file.sigmf-envelope").exists()
+
+            response = client.get(f"{url}?start=40&count=40&width=3")
+            result = response.json()
+            assert result["level"] == 1
+            assert result["start"] == 32
+            assert result["samples_per_point"] == 16
+            assert result["i"]["min"] == [64, 96, 128]
+            assert result["i"]["max"] == [94, 126, 158]
+    finally:
+        client.app.dependency_overrides.pop(datasource_repo.get, None)
@@ -0,0 +1,49 @@
+import pytest
+from database.database import db
+from database.indexes import create_indexes, summarize_plan
+
+
+@pytest.mark.asyncio
+async def test_create_indexes_is_idempotent(client):
+    # the indexes were created at startup, creating them again is a no-op
+    await create_indexes()
+    metadata_indexes = await db().metadata.index_information()
+    assert metadata_indexes["origin"]["unique"]
+    assert "captures_geolocation" in metadata_indexes
+    assert "captures_frequency" in metadata_indexes
+    assert "text" in metadata_indexes
+    assert "derived_frequency" in metadata_indexes
+    assert "origin_revision" in await db().versions.index_information()
+    datasource_indexes = await db().datasources.index_information()
+    assert datasource_indexes["account_container"]["unique"]
+
+
+@pytest.mark.asyncio
+async def test_api_get_indexes(client):
+    response = client.get("/api/status/indexes")
+    assert response.status_code == 200
+    report = response.json()
+    assert "origin" in report["metadata"]["indexes"]
+    assert set(report["metadata"]["plans"]) == {
+        "origin",
+        "frequency",
+        "datetime",
+        "frequency_overlap",
+        "datetime_overlap",
+        "label",
+        "account",
+        "text",
+        "captures_geolocation",
+    }
+    assert "account_container" in report["datasources"]["plans"]
+
+
+def test_summarize_plan():
+    plan = {
+        "stage": "FETCH",
+        "inputStage": {"stage": "IXSCAN", "indexName": "origin"},
+    }
+    assert summarize_plan(plan) == {
+        "stages": ["FETCH", "IXSCAN"],
+        "indexes": ["origin"],
+    }
@@ -1,4 +1,6 @@
 import base64
+import os
+import struct
 from unittest import mock
 from unittest.mock import AsyncMock, Mock
 
@@ -15,8 +17,10 @@ test_blob_properties = BlobProperties()
 test_blob_properties.size = 100
 
 
-@mock.patch("handlers.iq.AzureBlobClient.set_sas_token", return_value=None)
-@mock.patch("handlers.iq.AzureBlobClient.get_blob_content", return_value=test_binary)
+@mock.patch("blob.azure_client.AzureBlobClient.set_sas_token", return_value=None)
+@mock.patch(
+    "blob.azure_client.AzureBlobClient.get_blob_content", return_value=test_binary
+)
 @pytest.mark.asyncio
 async def test_get_iq(mock_get_blob_content, mock_set_sas_token, client: TestClient):
     response = client.post("/api/datasources", json=test_datasource).json()
@@ -39,10 +43,13 @@ async def test_get_iq(mock_get_blob_content, mock_set_sas_token, client: TestCli
     assert mock_set_sas_token.call_count == 1
 
 
-@mock.patch("handlers.iq.AzureBlobClient.set_sas_token", return_value=None)
-@mock.patch("handlers.iq.AzureBlobClient.get_blob_content", return_value=test_binary)
+@mock.patch("blob.azure_client.AzureBlobClient.set_sas_token", return_value=None)
+@mock.patch(
+    "blob.azure_client.AzureBlobClient.get_blob_content", return_value=test_binary
+)
 @mock.patch(
-    "handlers.iq.AzureBlobClient.get_blob_properties", return_value=test_blob_properties
+    "blob.azure_client.AzureBlobClient.get_blob_properties",
+    return_value=test_blob_properties,
 )
 @pytest.mark.asyncio
 async def test_get_iq_data_slices(
@@ -64,22 +71,99 @@ async def test_get_iq_data_slices(
     )
     assert response.status_code == 200
     assert isinstance(response.json(), list)
-    assert mock_get_blob_content.call_count == 3
+    assert [item["index"] for item in response.json()] == [0, 1, 2]
+    assert base64.b64decode(response.json()[1]["data"]) == test_binary[16:32]
+    assert mock_get_blob_content.call_count == 1
     assert mock_get_blob_content.call_args_list[0][1]["offset"] == 0
-    assert mock_get_blob_content.call_args_list[0][1]["length"] == 16
-    assert mock_get_blob_content.call_args_list[1][1]["offset"] == 16
-    assert mock_get_blob_content.call_args_list[1][1]["length"] == 16
-    assert mock_get_blob_content.call_args_list[2][1]["offset"] == 32
-    assert mock_get_blob_content.call_args_list[2][1]["length"] == 16
+    assert mock_get_blob_content.call_args_list[0][1]["length"] == 48
     assert mock_set_sas_token.call_count == 1
     assert mock_get_blob_properties.call_count == 1
 
 
-@mock.patch("handlers.iq.AzureBlobClient.set_sas_token", return_value=None)
+async def get_test_binary_range(filepath, offset, length):
+    return (test_binary * 3)[offset : offset + length]
+
+
+@mock.patch("blob.azure_client.AzureBlobClient.set_sas_token", return_value=None)
+@mock.patch(
+    "blob.azure_client.AzureBlobClient.get_blob_content",
+    side_effect=get_test_binary_range,
+)
+@mock.patch(
+    "blob.azure_client.AzureBlobClient.get_blob_properties",
+    return_value=test_blob_properties,
+)
+@pytest.mark.asyncio
+async def test_get_iq_data_slices_merges_ranges(
+    mock_get_blob_properties: Mock,
+    mock_get_blob_content: Mock,
+    mock_set_sas_token: Mock,
+    client,
+):
+    client.post("/api/datasources", json=test_datasource)
+
+    response = client.post(
+        f'/api/datasources/{test_datasource["account"]}/{test_datasource["container"]}/file_path/iqslices',
+        json={
+            "indexes": [6, 0, 1, 3, 12],
+            "tile_size": 1,
+            "bytes_per_sample": 4,
+            "max_gap": 1,
+        },
+    )
+    assert response.status_code == 200
+    assert [item["index"] for item in response.json()] == [6, 0, 1, 3, 12]
+    assert base64.b64decode(response.json()[3]["data"]) == (test_binary * 3)[24:32]
+    assert mock_get_blob_content.call_count == 3
+    ranges = sorted(
+        (call[1]["offset"], call[1]["length"])
+        for call in mock_get_blob_content.call_args_list
+    )
+    # tiles 0-3 in one download, 6 alone, 12 truncated at the end of the blob
+    assert ranges == [(0, 32), (48, 8), (96, 4)]
+
+
+@mock.patch("blob.azure_client.AzureBlobClient.set_sas_token", return_value=None)
 @mock.patch(
-    "handlers.iq.AzureBlobClient.get_blob_properties", return_value=test_blob_properties
+    "blob.azure_client.AzureBlobClient.get_blob_content", return_value=test_binary
+)
+@mock.patch(
+    "blob.azure_client.AzureBlobClient.get_blob_properties",
+    return_value=test_blob_properties,
 )
-@mock.patch("handlers.iq.AzureBlobClient.get_file_length", return_value=100)
+@pytest.mark.asyncio
+async def test_get_iq_data_slices_binary(
+    mock_get_blob_properties: Mock,
+    mock_get_blob_content: Mock,
+    mock_set_sas_token: Mock,
+    client,
+):
+    client.post("/api/datasources", json=test_datasource)
+
+    response = client.post(
+        f'/api/datasources/{test_datasource["account"]}/{test_datasource["container"]}/file_path/iqslices',
+        json={"indexes": [0, 1, 2], "tile_size": 2, "bytes_per_sample": 4},
+        headers={"Accept": "application/octet-stream"},
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/octet-stream"
+    tiles = {}
+    position = 0
+    while position < len(response.content):
+        index, count = struct.unpack_from("<II", response.content, position)
+        position += 8
+        tiles[index] = response.content[position : position + count]
+        position += count
+    assert tiles == {0: test_binary[0:16], 1: test_binary[16:32], 2: test_binary[32:48]}
+    assert mock_get_blob_content.call_count == 1
+
+
+@mock.patch("blob.azure_client.AzureBlobClient.set_sas_token", return_value=None)
+@mock.patch(
+    "blob.azure_client.AzureBlobClient.get_blob_properties",
+    return_value=test_blob_properties,
+)
+@mock.patch("blob.azure_client.AzureBlobClient.get_file_length", return_value=100)
 @pytest.mark.asyncio
 async def test_get_iq_data_invalid_format(
     mock_get_file_length, mock_get_blob_properties, mock_set_sas_token, client
@@ -104,11 +188,12 @@ async def mock_get_test_datasource():
     return DataSource(**test_datasource)
 
 
-@mock.patch("handlers.iq.AzureBlobClient.set_sas_token", return_value=None)
+@mock.patch("blob.azure_client.AzureBlobClient.set_sas_token", return_value=None)
 @mock.patch(
-    "handlers.iq.AzureBlobClient.get_blob_properties", return_value=test_blob_properties
+    "blob.azure_client.AzureBlobClient.get_blob_properties",
+    return_value=test_blob_properties,
 )
-@mock.patch("handlers.iq.AzureBlobClient.get_file_length", return_value=100)
+@mock.patch("blob.azure_client.AzureBlobClient.get_file_length", return_value=100)
 @pytest.mark.asyncio
 async def test_get_iq_data_with_ci16_le(
     mock_get_file_length, mock_get_blob_properties, mock_set_sas_token, client
@@ -129,11 +214,12 @@ async def test_get_iq_data_with_ci16_le(
         assert response.content == arr
 
 
-@mock.patch("handlers.iq.AzureBlobClient.set_sas_token", return_value=None)
+@mock.patch("blob.azure_client.AzureBlobClient.set_sas_token", return_value=None)
 @mock.patch(
-    "handlers.iq.AzureBlobClient.get_blob_properties", return_value=test_blob_properties
+    "blob.azure_client.AzureBlobClient.get_blob_properties",
+    return_value=test_blob_properties,
 )
-@mock.patch("handlers.iq.AzureBlobClient.get_file_length", return_value=100)
+@mock.patch("blob.azure_client.AzureBlobClient.get_file_length", return_value=100)
 @pytest.mark.asyncio
 async def test_get_iq_data_with_ci16(
     mock_get_file_length, mock_get_blob_properties, mock_set_sas_token, client
@@ -154,11 +240,12 @@ async def test_get_iq_data_with_ci16(
         assert response.content == arr
 
 
-@mock.patch("handlers.iq.AzureBlobClient.set_sas_token", return_value=None)
+@mock.patch("blob.azure_client.AzureBlobClient.set_sas_token", return_value=None)
 @mock.patch(
-    "handlers.iq.AzureBlobClient.get_blob_properties", return_value=test_blob_properties
+    "blob.azure_client.AzureBlobClient.get_blob_properties",
+    return_value=test_blob_properties,
 )
-@mock.patch("handlers.iq.AzureBlobClient.get_file_length", return_value=100)
+@mock.patch("blob.azure_client.AzureBlobClient.get_file_length", return_value=100)
 @pytest.mark.asyncio
 async def test_get_iq_data_with_ci16_be(
     mock_get_file_length, mock_get_blob_properties, mock_set_sas_token, client
@@ -179,11 +266,12 @@ async def test_get_iq_data_with_ci16_be(
         assert response.content == arr
 
 
-@mock.patch("handlers.iq.AzureBlobClient.set_sas_token", return_value=None)
+@mock.patch("blob.azure_client.AzureBlobClient.set_sas_token", return_value=None)
 @mock.patch(
-    "handlers.iq.AzureBlobClient.get_blob_properties", return_value=test_blob_properties
+    "blob.azure_client.AzureBlobClient.get_blob_properties",
+    return_value=test_blob_properties,
 )
-@mock.patch("handlers.iq.AzureBlobClient.get_file_length", return_value=100)
+@mock.patch("blob.azure_client.AzureBlobClient.get_file_length", return_value=100)
 @pytest.mark.asyncio
 async def test_get_iq_data_with_cf32_le(
     mock_get_file_length, mock_get_blob_properties, mock_set_sas_token, client
@@ -204,11 +292,12 @@ async def test_get_iq_data_with_cf32_le(
         assert response.content == arr
 
 
-@mock.patch("handlers.iq.AzureBlobClient.set_sas_token", return_value=None)
+@mock.patch("blob.azure_client.AzureBlobClient.set_sas_token", return_value=None)
 @mock.patch(
-    "handlers.iq.AzureBlobClient.get_blob_properties", return_value=test_blob_properties
+    "blob.azure_client.AzureBlobClient.get_blob_properties",
+    return_value=test_blob_properties,
 )
-@mock.patch("handlers.iq.AzureBlobClient.get_file_length", return_value=100)
+@mock.patch("blob.azure_client.AzureBlobClient.get_file_length", return_value=100)
 @pytest.mark.asyncio
 async def test_get_iq_data_with_cf32(
     mock_get_file_length, mock_get_blob_properties, mock_set_sas_token, client
@@ -229,11 +318,12 @@ async def test_get_iq_data_with_cf32(
         assert response.content == arr
 
 
-@mock.patch("handlers.iq.AzureBlobClient.set_sas_token", return_value=None)
+@mock.patch("blob.azure_client.AzureBlobClient.set_sas_token", return_value=None)
 @mock.patch(
-    "handlers.iq.AzureBlobClient.get_blob_properties", return_value=test_blob_properties
+    "blob.azure_client.AzureBlobClient.get_blob_properties",
+    return_value=test_blob_properties,
 )
-@mock.patch("handlers.iq.AzureBlobClient.get_file_length", return_value=100)
+@mock.patch("blob.azure_client.AzureBlobClient.get_file_length", return_value=100)
 @pytest.mark.asyncio
 async def test_get_iq_data_with_cf32_be(
     mock_get_file_length, mock_get_blob_properties, mock_set_sas_token, client
@@ -254,11 +344,12 @@ async def test_get_iq_data_with_cf32_be(
         assert response.content == arr
 
 
-@mock.patch("handlers.iq.AzureBlobClient.set_sas_token", return_value=None)
+@mock.patch("blob.azure_client.AzureBlobClient.set_sas_token", return_value=None)
 @mock.patch(
-    "handlers.iq.AzureBlobClient.get_blob_properties", return_value=test_blob_properties
+    "blob.azure_client.AzureBlobClient.get_blob_properties",
+    return_value=test_blob_properties,
 )
-@mock.patch("handlers.iq.AzureBlobClient.get_file_length", return_value=100)
+@mock.patch("blob.azure_client.AzureBlobClient.get_file_length", return_value=100)
 @pytest.mark.asyncio
 async def test_get_iq_data_with_ci8(
     mock_get_file_length, mock_get_blob_properties, mock_set_sas_token, client
@@ -281,11 +372,12 @@ async def test_get_iq_data_with_ci8(
         assert response.content == arr
 
 
-@mock.patch("handlers.iq.AzureBlobClient.set_sas_token", return_value=None)
+@mock.patch("blob.azure_client.AzureBlobClient.set_sas_token", return_value=None)
 @mock.patch(
-    "handlers.iq.AzureBlobClient.get_blob_properties", return_value=test_blob_properties
+    "blob.azure_client.AzureBlobClient.get_blob_properties",
+    return_value=test_blob_properties,
 )
-@mock.patch("handlers.iq.AzureBlobClient.get_file_length", return_value=100)
+@mock.patch("blob.azure_client.AzureBlobClient.get_file_length", return_value=100)
 @pytest.mark.asyncio
 async def test_get_iq_data_with_i8(
     mock_get_file_length, mock_get_blob_properties, mock_set_sas_token, client
@@ -306,11 +398,12 @@ async def test_get_iq_data_with_i8(
         assert response.content == arr
 
 
-@mock.patch("handlers.iq.AzureBlobClient.set_sas_token", return_value=None)
+@mock.patch("blob.azure_client.AzureBlobClient.set_sas_token", return_value=None)
 @mock.patch(
-    "handlers.iq.AzureBlobClient.get_blob_properties", return_value=test_blob_properties
+    "blob.azure_client.AzureBlobClient.get_blob_properties",
+    return_value=test_blob_properties,
 )
-@mock.patch("handlers.iq.AzureBlobClient.get_file_length", return_value=100)
+@mock.patch("blob.azure_client.AzureBlobClient.get_file_length", return_value=100)
 @pytest.mark.asyncio
 async def test_get_iq_data_with_multiple_arr_elements_returns_data(
     mock_get_file_length, mock_get_blob_properties, mock_set_sas_token, client
@@ -329,13 +422,15 @@ async def test_get_iq_data_with_multiple_arr_elements_returns_data(
         )
         assert response.status_code == 200
         assert response.content == arr + arr
+        assert mock_get_file_length.call_count == 1
 
 
-@mock.patch("handlers.iq.AzureBlobClient.set_sas_token", return_value=None)
+@mock.patch("blob.azure_client.AzureBlobClient.set_sas_token", return_value=None)
 @mock.patch(
-    "handlers.iq.AzureBlobClient.get_blob_properties", return_value=test_blob_properties
+    "blob.azure_client.AzureBlobClient.get_blob_properties",
+    return_value=test_blob_properties,
 )
-@mock.patch("handlers.iq.AzureBlobClient.get_file_length", return_value=2)
+@mock.patch("blob.azure_client.AzureBlobClient.get_file_length", return_value=2)
 @pytest.mark.asyncio
 async def test_get_iq_data_with_offset_larger_than_blob_size(
     mock_get_file_length, mock_get_blob_properties, mock_set_sas_token, client
@@ -356,11 +451,12 @@ async def test_get_iq_data_with_offset_larger_than_blob_size(
         assert response.content == b""
 
 
-@mock.patch("handlers.iq.AzureBlobClient.set_sas_token", return_value=None)
+@mock.patch("blob.azure_client.AzureBlobClient.set_sas_token", return_value=None)
 @mock.patch(
-    "handlers.iq.AzureBlobClient.get_blob_properties", return_value=test_blob_properties
+    "blob.azure_client.AzureBlobClient.get_blob_properties",
+    return_value=test_blob_properties,
 )
-@mock.patch("handlers.iq.AzureBlobClient.get_file_length", return_value=3)
+@mock.patch("blob.azure_client.AzureBlobClient.get_file_length", return_value=3)
 @pytest.mark.asyncio
 async def test_get_iq_data_with_offset_plus_count_larger_than_blob_size(
     mock_get_file_length, mock_get_blob_properties, mock_set_sas_token, client
@@ -380,3 +476,47 @@ async def test_get_iq_data_with_offset_plus_count_larger_than_blob_size(
         )
         assert response.status_code == 200
         assert response.content == arr
+
+
+@mock.patch("handlers.iq.decrypt", return_value="secret")
+@pytest.mark.asyncio
+async def test_get_iqfile_with_range(mock_decrypt: Mock, tmp_path, client):
+    container_path = (
+        tmp_path / test_datasource["account"] / test_datasource["container"]
+    )
+    container_path.mkdir(parents=True)
+    (container_path / "file_path.sigmf-data").write_bytes(test_binary)
+    client.app.dependency_overrides[datasource_repo.get] = mock_get_test_datasource
+    url = (
+        f'/api/datasources/{test_datasource["account"]}/{test_datasource["container"]}'
+        "/file_path.sigmf-data"
+    )
+
+    with mock.patch.dict(os.environ, {"IQENGINE_LOCAL_STORAGE_ROOT": str(tmp_path)}):
+        response = client.get(url)
+        assert response.status_code == 200
+        assert response.headers["accept-ranges"] == "bytes"
+        assert response.content == test_binary
+
+        response = client.get(url, headers={"Range": "bytes=4-8"})
+        assert response.status_code == 206
+        assert response.headers["content-range"] == f"bytes 4-8/{len(test_binary)}"
+        assert response.headers["content-length"] == "5"
+        assert response.content == b"quick"
+
+        response = client.get(url, headers={"Range": "bytes=0-2,-3"})
+        assert response.status_code == 206
+        assert response.headers["content-type"].startswith("multipart/byteranges")
+        assert int(response.headers["content-length"]) == len(response.content)
+        assert b"Content-Range: bytes 0-2/" in response.content
+        assert b"\r\n\r\nthe\r\n" in response.content
+        assert b"\r\n\r\ndog\r\n" in response.content
+
+        response = client.get(
+            url, headers={"Range": "bytes=4-8", "If-Range": '"stale-etag"'}
+        )
+        assert response.status_code == 200
+        assert response.content == test_binary
+
+        response = client.get(url, headers={"Range": "bytes=1000-"})
+        assert response.status_code == 416
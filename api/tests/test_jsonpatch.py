@@ -0,0 +1,80 @@
+import copy
+
+import pytest
+from helpers.jsonpatch import apply_merge_patch, apply_patch, make_patch
+
+document = {
+    "global": {"core:datatype": "cf32_le", "core:description": "a/b~c"},
+    "captures": [{"core:sample_start": 0}, {"core:sample_start": 10}],
+}
+
+
+def test_apply_patch():
+    patched = apply_patch(
+        document,
+        [
+            {"op": "test", "path": "/global/core:datatype", "value": "cf32_le"},
+            {"op": "replace", "path": "/global/core:datatype", "value": "ci16_le"},
+            {"op": "add", "path": "/captures/1", "value": {"core:sample_start": 5}},
+            {"op": "remove", "path": "/captures/0"},
+            {"op": "copy", "from": "/captures/1", "path": "/captures/-"},
+            {"op": "move", "from": "/global/core:description", "path": "/global/a~1b"},
+        ],
+    )
+    assert patched == {
+        "global": {"core:datatype": "ci16_le", "a/b": "a/b~c"},
+        "captures": [
+            {"core:sample_start": 5},
+            {"core:sample_start": 10},
+            {"core:sample_start": 10},
+        ],
+    }
+    # the document is left unchanged
+    assert document["global"]["core:datatype"] == "cf32_le"
+    assert len(document["captures"]) == 2
+
+
+@pytest.mark.parametrize(
+    "operation",
+    [
+        {"op": "test", "path": "/global/core:datatype", "value": "ci16_le"},
+        {"op": "remove", "path": "/global/core:author"},
+        {"op": "replace", "path": "/captures/2", "value": {}},
+        {"op": "add", "path": "/captures/01", "value": {}},
+        {"op": "add", "path": "global", "value": {}},
+        {"op": "move", "from": "/global", "path": "/global/inner"},
+        {"op": "copy", "path": "/global/core:author"},
+        {"op": "increment", "path": "/global"},
+    ],
+)
+def test_apply_patch_invalid(operation):
+    with pytest.raises(ValueError):
+        apply_patch(document, [operation])
+
+
+def test_apply_merge_patch():
+    patched = apply_merge_patch(
+        document,
+        {"global": {"core:description": None, "core:author": "me"}, "captures": []},
+    )
+    assert patched == {
+        "global": {"core:datatype": "cf32_le", "core:author": "me"},
+        "captures": [],
+    }
+    assert "core:description" in document["global"]
+
+
+def test_make_patch():
+    target = {
+        "global": {"core:datatype": 1.0, "a/b": "a/b~c"},
+        "captures": [{"core:sample_start": 5}, {"core:sample_start": 10}],
+    }
+    patch = make_patch(document, target)
+    assert patch == [
+        {"op": "remove", "path": "/global/core:description"},
+        {"op": "replace", "path": "/global/core:datatype", "value": 1.0},
+        {"op": "add", "path": "/global/a~1b", "value": "a/b~c"},
+        {"op": "replace", "path": "/captures/0/core:sample_start", "value": 5},
+    ]
+    assert apply_patch(document, patch) == target
+    assert make_patch(document, copy.deepcopy(document)) == []
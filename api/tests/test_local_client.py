@@ -0,0 +1,109 @@
+import json
+import os
+from unittest import mock
+
+import pytest
+from blob.azure_client import AzureBlobClient
+from blob.client_factory import get_storage_client
+from blob.local_client import LocalBlobClient
+from blob.storage_client import BlobStorageClient
+from helpers.concurrency import download_limiter
+from tests.test_data import valid_metadata
+
+test_binary = b"the quick brown fox jumps over the lazy dog"
+
+
+@pytest.fixture
+def local_client(tmp_path):
+    container_path = tmp_path / "account" / "container"
+    (container_path / "dir").mkdir(parents=True)
+    (container_path / "dir" / "file.sigmf-data").write_bytes(test_binary)
+    (container_path / "dir" / "file.sigmf-meta").write_text(json.dumps(valid_metadata))
+    return LocalBlobClient("account", "container", str(tmp_path))
+
+
+@pytest.mark.asyncio
+async def test_local_client_get_blob_content_range(local_client):
+    content = await local_client.get_blob_content(
+        "dir/file.sigmf-data", offset=4, length=5
+    )
+    assert content == b"quick"
+
+
+@pytest.mark.asyncio
+async def test_local_client_get_blob_content_past_end(local_client):
+    content = await local_client.get_blob_content(
+        "dir/file.sigmf-data", offset=40, length=100
+    )
+    assert content == b"dog"
+    content = await local_client.get_blob_content(
+        "dir/file.sigmf-data", offset=400, length=10
+    )
+    assert content == b""
+
+
+@pytest.mark.asyncio
+async def test_get_new_thumbnail_limits_only_the_download(local_client):
+    running = []
+
+    async def run(function, *args):
+        running.append(download_limiter.running)
+        return b"<thumbnail data>"
+
+    with mock.patch("blob.storage_client.compute_pool.run", side_effect=run):
+        image = await local_client.get_new_thumbnail("cf32_le", "dir/file")
+    assert image == b"<thumbnail data>"
+    # the spectrogram is computed once the storage slot is released
+    assert running == [0]
+
+
+@pytest.mark.asyncio
+async def test_local_client_get_blob_stream(local_client):
+    with mock.patch("blob.local_client.STREAM_CHUNK_SIZE", 8):
+        stream = await local_client.get_blob_stream(
+            "dir/file.sigmf-data", offset=4, length=15
+        )
+        chunks = [chunk async for chunk in stream.chunks()]
+    assert chunks == [b"quick br", b"own fox"]
+
+
+@pytest.mark.asyncio
+async def test_local_client_properties_and_upload(local_client):
+    properties = await local_client.get_blob_properties("dir/file.sigmf-data")
+    assert properties.size == len(test_binary)
+    assert await local_client.get_file_length("dir/file.sigmf-data") == len(test_binary)
+    assert not await local_client.blob_exist("dir/file.jpg")
+    await local_client.upload_blob("dir/file.jpg", b"<image data>")
+    assert await local_client.blob_exist("dir/file.jpg")
+    assert await local_client.get_blob_content("dir/file.jpg") == b"<image data>"
+
+
+@pytest.mark.asyncio
+async def test_local_client_get_metadata_files(local_client):
+    files = [item async for item in local_client.get_metadata_files()]
+    assert len(files) == 1
+    assert files[0][0] == "dir/file.sigmf-meta"
+    assert files[0][1].globalMetadata.core_sample_rate == 1
+
+
+@pytest.mark.asyncio
+async def test_local_client_rejects_path_outside_container(local_client):
+    with pytest.raises(ValueError):
+        await local_client.get_blob_content("../other/file.sigmf-data")
+
+
+@pytest.mark.asyncio
+async def test_get_storage_client(tmp_path):
+    with mock.patch.dict(os.environ, {"IQENGINE_LOCAL_STORAGE_ROOT": str(tmp_path)}):
+        assert isinstance(get_storage_client("account", "container"), LocalBlobClient)
+    with mock.patch.dict(os.environ, {"IQENGINE_LOCAL_STORAGE_ROOT": ""}):
+        assert isinstance(get_storage_client("account", "container"), AzureBlobClient)
+
+
+def test_storage_client_requires_every_method():
+    class PartialClient(BlobStorageClient):
+        async def get_blob_content(self, filepath, offset=None, length=None):
+            return b""
+
+    with pytest.raises(TypeError):
+        PartialClient("account", "container")
@@ -3,21 +3,22 @@ from unittest.mock import Mock
 
 import pytest
 from database import datasource_repo
-from database.models import DataSource, Metadata
-from tests.test_data import test_datasource, valid_metadata
+from database.models import DataSource
+from handlers.metadata import thumbnail_cache
+from tests.test_data import test_datasource
 
 
 def override_dependency_datasource_repo_get():
     return DataSource(**test_datasource)
 
 
-@mock.patch("handlers.metadata.AzureBlobClient.blob_exist", return_value=True)
+@mock.patch("blob.azure_client.AzureBlobClient.blob_exist", return_value=True)
 @mock.patch(
-    "handlers.metadata.AzureBlobClient.get_blob_content", return_value=b"<image data>"
+    "blob.azure_client.AzureBlobClient.get_blob_content", return_value=b"<image data>"
 )
 @mock.patch(
-    "handlers.metadata.metadata_repo.get",
-    return_value=Metadata(**valid_metadata),
+    "handlers.metadata.metadata_repo.get_datatype",
+    return_value="cf32_le",
 )
 @mock.patch("handlers.metadata.decrypt", return_value="secret")
 @pytest.mark.asyncio
@@ -42,16 +43,16 @@ async def test_api_get_thumbnail_with_image(
     mock_decrypt.assert_called_once()
 
 
-@mock.patch("handlers.metadata.AzureBlobClient.blob_exist", return_value=False)
+@mock.patch("blob.azure_client.AzureBlobClient.blob_exist", return_value=False)
 @mock.patch(
-    "handlers.metadata.metadata_repo.get",
-    return_value=Metadata(**valid_metadata),
+    "handlers.metadata.metadata_repo.get_datatype",
+    return_value="cf32_le",
 )
 @mock.patch(
-    "handlers.metadata.AzureBlobClient.get_new_thumbnail",
+    "blob.azure_client.AzureBlobClient.get_new_thumbnail",
     return_value=b"<thumbnail data>",
 )
-@mock.patch("handlers.metadata.AzureBlobClient.upload_blob", return_value=None)
+@mock.patch("blob.azure_client.AzureBlobClient.upload_blob", return_value=None)
 @mock.patch("handlers.metadata.decrypt", return_value="secret")
 @pytest.mark.asyncio
 async def test_api_get_thumbnail_with_no_image(
@@ -74,3 +75,39 @@ async def test_api_get_thumbnail_with_no_image(
     mock_upload_blob.assert_called_once()
     mock_blob_exist.assert_called_once()
     mock_decrypt.assert_called_once()
+
+
+@mock.patch("blob.azure_client.AzureBlobClient.blob_exist", return_value=False)
+@mock.patch(
+    "handlers.metadata.metadata_repo.get_datatype",
+    return_value="cf32_le",
+)
+@mock.patch(
+    "blob.azure_client.AzureBlobClient.get_new_thumbnail",
+    return_value=b"<thumbnail data>",
+)
+@mock.patch("handlers.metadata.upload_thumbnail")
+@mock.patch("handlers.metadata.decrypt", return_value="secret")
+@pytest.mark.asyncio
+async def test_api_get_thumbnail_served_from_memory_until_uploaded(
+    mock_decrypt: Mock,
+    mock_upload_thumbnail: Mock,
+    mock_get_new_thumbnail: Mock,
+    mock_get_metadata: Mock,
+    mock_blob_exist: Mock,
+    client,
+):
+    client.app.dependency_overrides[
+        datasource_repo.get
+    ] = override_dependency_datasource_repo_get
+    url = f'/api/datasources/{test_datasource["account"]}/{test_datasource["container"]}/file_path.jpg'
+    try:
+        for _ in range(2):
+            response = client.get(url)
+            assert response.status_code == 200
+            assert response.content == b"<thumbnail data>"
+        mock_get_new_thumbnail.assert_called_once()
+        mock_upload_thumbnail.assert_called_once()
+        mock_blob_exist.assert_called_once()
+    finally:
+        thumbnail_cache.clear()
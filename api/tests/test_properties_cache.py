@@ -0,0 +1,94 @@
+from unittest import mock
+from unittest.mock import AsyncMock, Mock
+
+import pytest
+from azure.core.exceptions import ResourceNotFoundError
+from azure.storage.blob import BlobProperties
+from blob.azure_client import AzureBlobClient
+from blob.properties_cache import PropertiesCache
+
+test_blob_properties = BlobProperties()
+test_blob_properties.size = 100
+test_blob_properties.etag = '"etag"'
+
+
+def get_mock_blob_client():
+    blob_client = Mock()
+    blob_client.get_blob_properties = AsyncMock(return_value=test_blob_properties)
+    blob_client.exists = AsyncMock(return_value=False)
+    blob_client.upload_blob = AsyncMock(return_value=None)
+    return blob_client
+
+
+@mock.patch("blob.azure_client.properties_cache", PropertiesCache(maxsize=100, ttl=60))
+@pytest.mark.asyncio
+async def test_blob_properties_fetched_once_per_ttl():
+    blob_client = get_mock_blob_client()
+    with mock.patch(
+        "blob.azure_client.AzureBlobClient.get_blob_client", return_value=blob_client
+    ):
+        client = AzureBlobClient("account", "container")
+        assert await client.get_file_length("file.sigmf-data") == 100
+        assert await client.get_file_length("file.sigmf-data") == 100
+        assert (await client.get_blob_properties("file.sigmf-data")).etag == '"etag"'
+
+        # another request for the same blob shares the cached properties
+        other_client = AzureBlobClient("account", "container")
+        assert await other_client.get_file_length("file.sigmf-data") == 100
+
+    assert blob_client.get_blob_properties.call_count == 1
+
+
+@mock.patch("blob.azure_client.properties_cache", PropertiesCache(maxsize=100, ttl=60))
+@pytest.mark.asyncio
+async def test_blob_exist_not_served_from_cache():
+    blob_client = get_mock_blob_client()
+    with mock.patch(
+        "blob.azure_client.AzureBlobClient.get_blob_client", return_value=blob_client
+    ):
+        client = AzureBlobClient("account", "container")
+        await client.get_blob_properties("file.sigmf-data")
+        # the blob is deleted while its properties are cached
+        assert not await client.blob_exist("file.sigmf-data")
+        await client.get_blob_properties("file.sigmf-data")
+
+    blob_client.exists.assert_called_once()
+    assert blob_client.get_blob_properties.call_count == 2
+
+
+@mock.patch("blob.azure_client.properties_cache", PropertiesCache(maxsize=100, ttl=60))
+@pytest.mark.asyncio
+async def test_blob_properties_invalidated_when_not_found():
+    blob_client = get_mock_blob_client()
+    blob_client.download_blob = AsyncMock(side_effect=ResourceNotFoundError())
+    with mock.patch(
+        "blob.azure_client.AzureBlobClient.get_blob_client", return_value=blob_client
+    ):
+        client = AzureBlobClient("account", "container")
+        await client.get_blob_properties("file.sigmf-data")
+        with pytest.raises(ResourceNotFoundError):
+            await client.get_blob_content("file.sigmf-data")
+        await client.get_blob_properties("file.sigmf-data")
+
+    assert blob_client.get_blob_properties.call_count == 2
+
+
+@mock.patch("blob.azure_client.properties_cache", PropertiesCache(maxsize=100, ttl=60))
+@pytest.mark.asyncio
+async def test_blob_properties_invalidated_on_upload():
+    blob_client = get_mock_blob_client()
+    with mock.patch(
+        "blob.azure_client.AzureBlobClient.get_blob_client", return_value=blob_client
+    ):
+        client = AzureBlobClient("account", "container")
+        await client.get_blob_properties("file.jpg")
+        await client.upload_blob("file.jpg", b"<image data>")
+        await client.get_blob_properties("file.jpg")
+
+    assert blob_client.get_blob_properties.call_count == 2
+
+
+def test_properties_cache_disabled():
+    cache = PropertiesCache(maxsize=0, ttl=60)
+    cache.put(("account", "container", "file"), test_blob_properties)
+    assert cache.get(("account", "container", "file")) is None
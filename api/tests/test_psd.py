@@ -0,0 +1,89 @@
+import copy
+import os
+from unittest import mock
+from unittest.mock import Mock
+
+import numpy as np
+import pytest
+from database import datasource_repo
+from database.models import DataSource
+from rf.psd import PowerSpectrum, get_power_stats
+from rf.spectrogram import generate_power
+from tests.test_data import test_datasource, valid_metadata
+
+
+def test_power_spectrum_pieces_match_whole_recording():
+    samples = np.random.default_rng(0).normal(size=2 * 4096).astype(np.float32)
+    content = samples.tobytes()
+    spectrum = PowerSpectrum(64)
+    # pieces overlapping by fft_size - hop samples cover every FFT once
+    spectrum.add(get_power_stats(content[: 8 * 2080], "cf32_le", 64, "hann", 32))
+    spectrum.add(get_power_stats(content[8 * 2048 :], "cf32_le", 64, "hann", 32))
+
+    power = generate_power(samples.view(np.complex64), 64, "hann", 32)
+    assert spectrum.rows == len(power)
+    result = spectrum.to_dict()
+    assert np.allclose(result["average"], 10 * np.log10(power.mean(axis=0)), atol=0.01)
+    assert np.allclose(result["max_hold"], 10 * np.log10(power.max(axis=0)), atol=0.01)
+    assert np.allclose(result["min_hold"], 10 * np.log10(power.min(axis=0)), atol=0.01)
+
+
+def test_power_spectrum_empty():
+    spectrum = PowerSpectrum(64)
+    spectrum.add(get_power_stats(b"", "ci16_le", 64, None, 64))
+    assert spectrum.to_dict() == {
+        "rows": 0,
+        "average": [],
+        "max_hold": [],
+        "min_hold": [],
+    }
+
+
+async def mock_get_test_datasource():
+    return DataSource(**test_datasource)
+
+
+@mock.patch("handlers.spectrogram.PSD_PIECE_BYTES", 4096)
+@mock.patch("handlers.spectrogram.decrypt", return_value="secret")
+@pytest.mark.asyncio
+async def test_get_power_spectral_density(mock_decrypt: Mock, tmp_path, client):
+    container_path = (
+        tmp_path / test_datasource["account"] / test_datasource["container"]
+    )
+    container_path.mkdir(parents=True)
+    tone = np.exp(2j * np.pi * 0.25 * np.arange(8192)).astype(np.complex64)
+    (container_path / "psd_file.sigmf-data").write_bytes(tone.tobytes())
+    metadata = copy.deepcopy(valid_metadata)
+    metadata["global"]["core:datatype"] = "cf32_le"
+    client.post("/api/datasources", json=test_datasource)
+    client.post(
+        f'/api/datasources/{test_datasource["account"]}/{test_datasource["container"]}/psd_file/meta',
+        json=metadata,
+    )
+    client.app.dependency_overrides[datasource_repo.get] = mock_get_test_datasource
+    url = (
+        f'/api/datasources/{test_datasource["account"]}/{test_datasource["container"]}'
+        "/psd_file/psd"
+    )
+
+    try:
+        with mock.patch.dict(
+            os.environ, {"IQENGINE_LOCAL_STORAGE_ROOT": str(tmp_path)}
+        ), mock.patch("blob.local_client.STREAM_CHUNK_SIZE", 1000):
+            response = client.get(f"{url}?fft_size=64")
+            assert response.status_code == 200
+            result = response.json()
+            assert result["fft_size"] == 64
+            assert result["rows"] == 8192 // 32 - 1
+            assert len(result["average"]) == 64
+            # the tone at a quarter of the sample rate is 16 bins above the centre
+            assert int(np.argmax(result["max_hold"])) == 48
+            assert int(np.argmax(result["average"])) == 48
+
+            response = client.get(f"{url}?fft_size=64&window=rectangular")
+            assert response.json()["rows"] == 8192 // 64
+
+            response = client.get(f"{url}?window=kaiser")
+            assert response.status_code == 400
+    finally:
+        client.app.dependency_overrides.pop(datasource_repo.get, None)
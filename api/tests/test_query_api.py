@@ -1,9 +1,15 @@
+import copy
 from unittest.mock import MagicMock
 
 import pytest
 from database import metadata_repo
 
-from .test_data import valid_metadata_array, valid_datasourcereference_array
+from .test_data import (
+    test_datasource,
+    valid_datasourcereference_array,
+    valid_metadata,
+    valid_metadata_array,
+)
 
 
 def override_metadata_collection():
@@ -36,3 +42,114 @@ async def test_query_meta_success(client):
 
     # Reset the dependency overrides after the test
     client.app.dependency_overrides = {}
+
+
+@pytest.mark.asyncio
+async def test_query_meta_search_modes(client):
+    client.post("/api/datasources", json=test_datasource).json()
+    url = (
+        f'/api/datasources/{test_datasource["account"]}/{test_datasource["container"]}'
+    )
+    for name, author, label in [
+        ("record_a", "Jane Doe", "WiFi"),
+        ("record_b", "John Doe", "LTE"),
+    ]:
+        metadata = copy.deepcopy(valid_metadata)
+        metadata["global"]["core:author"] = author
+        metadata["annotations"][0]["core:label"] = label
+        client.post(f"{url}/{name}/meta", json=metadata)
+
+    def search(query):
+        response = client.get(f"/api/datasources/query?{query}")
+        assert response.status_code == 200
+        return sorted(reference["file_path"] for reference in response.json())
+
+    assert search("author=doe") == ["record_a", "record_b"]
+    assert search("author=JANE") == ["record_a"]
+    assert search("author=doe&match=prefix") == []
+    assert search("author=j&match=prefix") == ["record_a", "record_b"]
+    assert search("author=jane&match=exact") == []
+    assert search("author=jane%20doe&match=exact") == ["record_a"]
+    assert search("label=wifi&match=exact") == ["record_a"]
+    assert search(f'account={test_datasource["account"]}&match=exact') == [
+        "record_a",
+        "record_b",
+    ]
+    assert search(f'account={test_datasource["account"].upper()}&match=exact') == [
+        "record_a",
+        "record_b",
+    ]
+    assert search("account=acc&match=exact") == []
+    assert search("account=other&account=ACC&match=prefix") == [
+        "record_a",
+        "record_b",
+    ]
+    assert search(f'container={test_datasource["container"][1:].upper()}') == [
+        "record_a",
+        "record_b",
+    ]
+
+    response = client.get("/api/datasources/query?label=wifi&match=regex")
+    assert response.status_code == 422
+
+
+@pytest.mark.asyncio
+async def test_query_meta_text_is_ranked(client):
+    collection = override_metadata_collection()
+    cursor = MagicMock()
+    cursor.sort.return_value = collection.find.return_value
+    collection.find.return_value = cursor
+    client.app.dependency_overrides[metadata_repo.collection] = lambda: collection
+    try:
+        response = client.get("/api/datasources/query?text=wifi%20beacon")
+        assert response.status_code == 200
+        query, projection = collection.find.call_args.args
+        assert query == {"$text": {"$search": "wifi beacon"}}
+        assert projection["score"] == {"$meta": "textScore"}
+        cursor.sort.assert_called_once_with([("score", {"$meta": "textScore"})])
+
+        response = client.get("/api/datasources/query?text=wifi&captures_geo=1,2,3")
+        assert response.status_code == 400
+    finally:
+        client.app.dependency_overrides = {}
+
+
+@pytest.mark.asyncio
+async def test_query_meta_overlaps(client):
+    client.post("/api/datasources", json=test_datasource).json()
+    url = (
+        f'/api/datasources/{test_datasource["account"]}/{test_datasource["container"]}'
+    )
+    for name, frequency, start in [
+        ("wifi", 2.44e9, "2023-01-01T00:00:00Z"),
+        ("lte", 1.8e9, "2023-01-02T00:00:00Z"),
+    ]:
+        metadata = copy.deepcopy(valid_metadata)
+        metadata["global"]["core:sample_rate"] = 20e6
+        metadata["global"]["traceability:sample_length"] = 20e6 * 60
+        metadata["captures"][0]["core:sample_start"] = 0
+        metadata["captures"][0]["core:frequency"] = frequency
+        metadata["captures"][0]["core:datetime"] = start
+        client.post(f"{url}/{name}/meta", json=metadata)
+
+    def search(query):
+        response = client.get(f"/api/datasources/query?{query}")
+        assert response.status_code == 200
+        return sorted(reference["file_path"] for reference in response.json())
+
+    # the band of wifi is 2.43 to 2.45 GHz
+    assert search("frequency_from=2.449e9&frequency_to=2.5e9") == ["wifi"]
+    assert search("frequency_from=2.451e9") == []
+    assert search("frequency_to=2.0e9") == ["lte"]
+    assert search("min_frequency=1e9&max_frequency=2e9") == ["lte"]
+    assert search("min_duration=60&max_duration=60") == ["lte", "wifi"]
+    assert search("datetime_from=2023-01-01T00:00:30") == ["lte", "wifi"]
+    assert search("datetime_from=2023-01-01T00:01:01") == ["lte"]
+    assert search(
+        "datetime_from=2023-01-01T00:30:00Z&datetime_to=2023-01-02T00:00:00Z"
+    ) == ["lte"]
+
+    response = client.get(
+        "/api/datasources/query?frequency_from=2.5e9&frequency_to=2.4e9"
+    )
+    assert response.status_code == 400
@@ -0,0 +1,46 @@
+import pytest
+from helpers.ranges import RangeNotSatisfiable, is_strong_match, parse_range_header
+
+
+def test_parse_range_header_single_and_open_ranges():
+    assert parse_range_header("bytes=0-9", 100) == [(0, 9)]
+    assert parse_range_header("bytes=90-", 100) == [(90, 99)]
+    assert parse_range_header("bytes=95-200", 100) == [(95, 99)]
+    assert parse_range_header("bytes=-10", 100) == [(90, 99)]
+
+
+def test_parse_range_header_multiple_ranges():
+    assert parse_range_header("bytes=0-1, 10-19, 500-", 100) == [(0, 1), (10, 19)]
+
+
+def test_parse_range_header_ignored_when_invalid():
+    assert parse_range_header(None, 100) is None
+    assert parse_range_header("items=0-9", 100) is None
+    assert parse_range_header("bytes=9-0", 100) is None
+    assert parse_range_header("bytes=a-b", 100) is None
+
+
+def test_parse_range_header_not_satisfiable():
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range_header("bytes=100-", 100)
+
+
+def test_parse_range_header_coalesces_ranges():
+    assert parse_range_header("bytes=20-29, 0-9, 5-14, 15-16", 100) == [
+        (0, 16),
+        (20, 29),
+    ]
+    # the same bytes asked for again and again are sent once, as a whole
+    assert parse_range_header(",".join(["bytes=0-"] + ["0-"] * 63), 100) is None
+    assert parse_range_header("bytes=0-59, 40-99", 100) is None
+
+
+def test_is_strong_match():
+    last_modified = "Wed, 01 Jan 2023 00:00:00 GMT"
+    assert is_strong_match('"etag"', '"etag"', last_modified)
+    assert not is_strong_match('"other"', '"etag"', last_modified)
+    assert not is_strong_match('W/"etag"', '"etag"', last_modified)
+    assert not is_strong_match('W/"etag"', 'W/"etag"', last_modified)
+    assert not is_strong_match('"etag"', 'W/"etag"', last_modified)
+    assert is_strong_match(last_modified, '"etag"', last_modified)
+    assert not is_strong_match(last_modified, '"etag"', None)
@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+from rf.samples import get_bytes_per_iq_sample, get_samples
+
+expected = np.array([1 - 2j, -3 + 4j], dtype=np.complex64)
+
+
+@pytest.mark.parametrize(
+    "data_type, dtype, offset",
+    [
+        ("ci8", "i1", 0),
+        ("cu8", "u1", 128),
+        ("ci16_le", "<i2", 0),
+        ("ci16_be", ">i2", 0),
+        ("cu16_le", "<u2", 2**15),
+        ("cu16_be", ">u2", 2**15),
+        ("ci32_le", "<i4", 0),
+        ("ci32_be", ">i4", 0),
+        ("cf32_le", "<f4", 0),
+        ("cf32_be", ">f4", 0),
+        ("cf64_le", "<f8", 0),
+        ("cf64_be", ">f8", 0),
+    ],
+)
+def test_get_samples(data_type, dtype, offset):
+    components = np.array([1, -2, -3, 4]) + offset
+    data_bytes = components.astype(dtype).tobytes()
+    samples = get_samples(data_bytes, data_type)
+    assert samples.dtype == np.complex64
+    assert np.array_equal(samples, expected)
+    assert get_bytes_per_iq_sample(data_type) == 2 * np.dtype(dtype).itemsize
+
+
+def test_get_samples_out():
+    data_bytes = np.array([1, -2, -3, 4, 5], dtype="<i2").tobytes()
+    out = np.zeros(4, dtype=np.complex64)
+    samples = get_samples(data_bytes, "ci16", out=out)
+    # the trailing component is not a whole sample
+    assert np.array_equal(samples, expected)
+    assert np.shares_memory(samples, out)
+    with pytest.raises(ValueError):
+        get_samples(data_bytes, "ci16", out=np.zeros(1, dtype=np.complex64))
+
+
+def test_get_samples_unknown_datatype():
+    with pytest.raises(ValueError):
+        get_samples(b"", "ri16_le")
+    with pytest.raises(ValueError):
+        get_bytes_per_iq_sample("ri16_le")
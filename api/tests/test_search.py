@@ -0,0 +1,31 @@
+from database.search import get_match, get_search_fields
+
+
+def test_get_search_fields():
+    document = {
+        "global": {
+            "core:author": "Jane  DOE",
+            "core:description": "WiFi Capture",
+            "traceability:origin": {"account": "MyAccount", "container": "Box"},
+        },
+        "annotations": [
+            {"core:label": "WiFi"},
+            {"core:label": "wifi", "core:comment": "Beacon"},
+            {"core:label": None},
+        ],
+    }
+    assert get_search_fields(document) == {
+        "author": "jane doe",
+        "description": "wifi capture",
+        "labels": ["wifi"],
+        "comments": ["beacon"],
+        "account": "myaccount",
+        "container": "box",
+    }
+
+
+def test_get_match():
+    assert get_match(" WiFi ", "exact") == "wifi"
+    assert get_match("Wi.Fi", "prefix").pattern == "^wi\\.fi"
+    assert get_match("Wi.Fi", "contains").pattern == "wi\\.fi"
+    assert get_match("Account", "exact") == "account"
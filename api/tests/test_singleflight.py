@@ -0,0 +1,45 @@
+import asyncio
+
+import pytest
+from helpers.singleflight import SingleFlight
+
+
+@pytest.mark.asyncio
+async def test_single_flight_shares_result():
+    flights = SingleFlight()
+    calls = []
+
+    async def operation(value):
+        calls.append(value)
+        await asyncio.sleep(0.01)
+        return value
+
+    results = await asyncio.gather(
+        flights.do("a", lambda: operation(1)),
+        flights.do("a", lambda: operation(2)),
+        flights.do("b", lambda: operation(3)),
+    )
+    assert results == [1, 1, 3]
+    assert calls == [1, 3]
+    assert flights.stats() == {"in_flight": 0, "shared": 1}
+
+    # once finished, the key runs again
+    assert await flights.do("a", lambda: operation(4)) == 4
+
+
+@pytest.mark.asyncio
+async def test_single_flight_shares_exception_and_survives_cancel():
+    flights = SingleFlight()
+
+    async def failing():
+        await asyncio.sleep(0.01)
+        raise ValueError("failed")
+
+    first = asyncio.create_task(flights.do("a", failing))
+    second = asyncio.create_task(flights.do("a", failing))
+    await asyncio.sleep(0)
+    first.cancel()
+    with pytest.raises(ValueError):
+        await second
+    with pytest.raises(asyncio.CancelledError):
+        await first
@@ -0,0 +1,85 @@
+import io
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import numpy as np
+import pytest
+from PIL import Image
+from rf.benchmark import generate_spectrogram_loop
+from rf.spectrogram import (
+    generate_image,
+    generate_spectrogram,
+    get_colormap_lut,
+    get_window,
+)
+
+
+@pytest.mark.parametrize("fftSize", [8, 64, 1024])
+def test_generate_spectrogram_matches_loop(fftSize):
+    rng = np.random.default_rng(0)
+    samples = (
+        rng.normal(size=fftSize * 10 + 3) + 1j * rng.normal(size=fftSize * 10 + 3)
+    ).astype(np.complex64)
+    spectrogram = generate_spectrogram(samples, fftSize)
+    assert spectrogram.dtype == np.float32
+    assert spectrogram.shape == (10, fftSize)
+    assert np.allclose(
+        spectrogram, generate_spectrogram_loop(samples, fftSize), atol=1e-3
+    )
+
+
+def test_generate_spectrogram_without_scipy():
+    rng = np.random.default_rng(0)
+    samples = (rng.normal(size=640) + 1j * rng.normal(size=640)).astype(np.complex64)
+    with mock.patch("rf.spectrogram.scipy_fft", None):
+        spectrogram = generate_spectrogram(samples, 64, workers=4)
+    assert spectrogram.dtype == np.float32
+    assert np.allclose(spectrogram, generate_spectrogram_loop(samples, 64), atol=1e-3)
+
+
+def test_generate_spectrogram_odd_fft_size():
+    samples = np.exp(2j * np.pi * 0.2 * np.arange(35)).astype(np.complex64)
+    spectrogram = generate_spectrogram(samples, 7)
+    assert np.allclose(spectrogram, generate_spectrogram_loop(samples, 7), atol=1e-3)
+
+
+def test_generate_spectrogram_hop_and_window():
+    samples = np.ones(64, dtype=np.complex64)
+    spectrogram = generate_spectrogram(samples, 16, window="hann", hop=8)
+    assert spectrogram.shape == (7, 16)
+    # a constant signal puts all of its power in the centre (DC) bin
+    assert (spectrogram.argmax(axis=1) == 8).all()
+    assert generate_spectrogram(samples[:10], 16).shape == (0, 16)
+
+
+def test_get_window():
+    assert get_window(None, 8) is None
+    assert np.allclose(get_window("hamming", 8), np.hamming(8))
+    with pytest.raises(ValueError):
+        get_window("kaiser", 8)
+
+
+def test_generate_image():
+    spectrogram = np.linspace(-50, 50, 64 * 32, dtype=np.float32).reshape(32, 64)
+    spectrogram[0, 0] = -np.inf
+    image = Image.open(io.BytesIO(generate_image(spectrogram, format="png", size=None)))
+    assert image.size == (64, 32)
+    pixels = np.asarray(image)
+    lut = get_colormap_lut("viridis")
+    # below min + 30 dB is clipped to the first color, the maximum is the last
+    assert (pixels[0, 0] == lut[0]).all()
+    assert (pixels[-1, -1] == lut[255]).all()
+
+    image = Image.open(io.BytesIO(generate_image(spectrogram)))
+    assert image.format == "JPEG"
+    assert image.size == (640, 480)
+
+
+def test_generate_image_in_threads():
+    spectrogram = np.random.default_rng(0).normal(size=(128, 256)) * 20
+    expected = generate_image(spectrogram, format="png")
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        images = list(
+            executor.map(lambda _: generate_image(spectrogram, format="png"), range(8))
+        )
+    assert all(image == expected for image in images)
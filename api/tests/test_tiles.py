@@ -0,0 +1,141 @@
+import copy
+import io
+import os
+from unittest import mock
+from unittest.mock import Mock
+
+import numpy as np
+import pytest
+from database import datasource_repo
+from database.models import DataSource
+from PIL import Image
+from rf.tiles import SpectrogramPyramid, encode_tile, reduce_max
+from tests.test_data import test_datasource, valid_metadata
+
+
+def test_pyramid_levels():
+    # 1024 rows of 512 bins with 256 pixel tiles
+    pyramid = SpectrogramPyramid(1024 * 512, 512, tile_size=256)
+    assert pyramid.max_zoom == 2
+    assert pyramid.get_decimation(0) == (4, 2)
+    assert pyramid.get_decimation(2) == (1, 1)
+    assert pyramid.get_tile_count(0) == (1, 1)
+    assert pyramid.get_tile_count(1) == (1, 2)
+    assert pyramid.get_tile_count(2) == (2, 4)
+    assert pyramid.contains(2, 1, 3)
+    assert not pyramid.contains(2, 2, 0)
+    assert not pyramid.contains(3, 0, 0)
+
+
+def get_tile(pyramid, spectrogram, z, x, y):
+    if z == pyramid.max_zoom:
+        first_row, row_count = pyramid.get_row_range(y)
+        columns = slice(x * pyramid.tile_size, (x + 1) * pyramid.tile_size)
+        return spectrogram[first_row : first_row + row_count, columns]
+    children_x, children_y = pyramid.get_children(z, x, y)
+    children = [
+        [
+            get_tile(pyramid, spectrogram, z + 1, child_x, child_y)
+            for child_x in children_x
+        ]
+        for child_y in children_y
+    ]
+    return pyramid.combine_tiles(z, children)
+
+
+@pytest.mark.parametrize("rows,fft_size", [(45, 16), (8, 64), (64, 4)])
+def test_pyramid_levels_keep_block_max(rows, fft_size):
+    pyramid = SpectrogramPyramid(rows * fft_size, fft_size, tile_size=4)
+    spectrogram = np.random.default_rng(0).normal(size=(rows, fft_size))
+    for z in range(pyramid.max_zoom + 1):
+        time_decimation, frequency_decimation = pyramid.get_decimation(z)
+        # the whole spectrogram reduced at once, as create_pmtiles.py does
+        expected = reduce_max(
+            reduce_max(spectrogram, time_decimation, axis=0),
+            frequency_decimation,
+            axis=1,
+        )
+        tiles_x, tiles_y = pyramid.get_tile_count(z)
+        level = np.concatenate(
+            [
+                np.concatenate(
+                    [get_tile(pyramid, spectrogram, z, x, y) for x in range(tiles_x)],
+                    axis=1,
+                )
+                for y in range(tiles_y)
+            ]
+        )
+        assert np.array_equal(level, expected)
+
+
+def test_pyramid_overview_shows_short_bursts():
+    pyramid = SpectrogramPyramid(4096 * 8, 8, tile_size=4)
+    spectrogram = np.zeros((4096, 8))
+    spectrogram[2047, 3] = 1
+    tile = get_tile(pyramid, spectrogram, 0, 0, 0)
+    assert tile.shape == (4, 4)
+    assert tile[1, 1] == 1
+    assert tile.sum() == 1
+
+
+def test_reduce_max_pads_the_last_block():
+    array = np.array([[1.0, 5.0, 2.0], [3.0, 0.0, 4.0], [7.0, 1.0, 1.0]])
+    assert reduce_max(array, 2, axis=0).tolist() == [[3, 5, 4], [7, 1, 1]]
+    assert reduce_max(array, 2, axis=1).tolist() == [[5, 2], [3, 4], [7, 1]]
+    assert reduce_max(array, 1, axis=0) is array
+
+
+def test_encode_tile():
+    tile = np.array([[-10.0, 0.0], [5.0, 20.0]])
+    image = Image.open(io.BytesIO(encode_tile(tile, db_min=0, db_max=10)))
+    assert image.mode == "L"
+    assert np.asarray(image).tolist() == [[0, 0], [127, 255]]
+
+
+async def mock_get_test_datasource():
+    return DataSource(**test_datasource)
+
+
+@mock.patch("handlers.spectrogram.decrypt", return_value="secret")
+@pytest.mark.asyncio
+async def test_get_spectrogram_tile(mock_decrypt: Mock, tmp_path, client):
+    container_path = (
+        tmp_path / test_datasource["account"] / test_datasource["container"]
+    )
+    container_path.mkdir(parents=True)
+    samples = np.random.default_rng(0).normal(size=2 * 1024 * 256).astype(np.float32)
+    (container_path / "file_path.sigmf-data").write_bytes(samples.tobytes())
+    metadata = copy.deepcopy(valid_metadata)
+    metadata["global"]["core:datatype"] = "cf32_le"
+    client.post("/api/datasources", json=test_datasource)
+    client.post(
+        f'/api/datasources/{test_datasource["account"]}/{test_datasource["container"]}/file_path/meta',
+        json=metadata,
+    )
+    client.app.dependency_overrides[datasource_repo.get] = mock_get_test_datasource
+    url = (
+        f'/api/datasources/{test_datasource["account"]}/{test_datasource["container"]}'
+        "/file_path/spectrogram-tiles"
+    )
+
+    try:
+        with mock.patch.dict(
+            os.environ, {"IQENGINE_LOCAL_STORAGE_ROOT": str(tmp_path)}
+        ):
+            response = client.get(f"{url}/0/0/0?fft_size=256")
+            assert response.status_code == 200
+            assert response.headers["content-type"] == "image/png"
+            image = Image.open(io.BytesIO(response.content))
+            assert image.size == (256, 256)
+
+            response = client.get(f"{url}/2/0/3?fft_size=256")
+            assert response.status_code == 200
+            assert Image.open(io.BytesIO(response.content)).size == (256, 256)
+
+            response = client.get(f"{url}/3/0/0?fft_size=256")
+            assert response.status_code == 404
+
+            response = client.get(f"{url}/0/0/0?fft_size=100")
+            assert response.status_code == 400
+    finally:
+        client.app.dependency_overrides.pop(datasource_repo.get, None)
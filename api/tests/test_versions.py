@@ -0,0 +1,104 @@
+import copy
+from unittest import mock
+
+import pytest
+from database import version_repo
+from database.database import db
+from tests.test_data import test_datasource, valid_metadata
+
+url = f'/api/datasources/{test_datasource["account"]}/{test_datasource["container"]}/record/meta'
+
+
+def create_revisions(client, count):
+    client.post("/api/datasources", json=test_datasource).json()
+    metadata = copy.deepcopy(valid_metadata)
+    metadata["annotations"] = [
+        {
+            "core:uuid": "a",
+            "core:sample_start": 0,
+            "core:sample_count": 10,
+            "core:label": "0",
+        }
+    ]
+    client.post(url, json=metadata)
+    for revision in range(1, count):
+        if revision % 2:
+            client.patch(url, json={"global": {"core:description": str(revision)}})
+        else:
+            client.post(
+                f"{url}/annotations",
+                json={
+                    "upsert": [
+                        {
+                            "core:uuid": "a",
+                            "core:sample_start": 0,
+                            "core:sample_count": 10,
+                            "core:label": str(revision),
+                        }
+                    ]
+                },
+            )
+
+
+@pytest.mark.asyncio
+async def test_versions_are_stored_as_changes(client):
+    with mock.patch("database.version_repo.CHECKPOINT_INTERVAL", 4):
+        create_revisions(client, 6)
+    versions = (
+        await db().versions.find({}).sort("global.traceability:revision").to_list(None)
+    )
+    assert ["annotations" in version for version in versions] == [
+        True,
+        False,
+        False,
+        False,
+        True,
+        False,
+    ]
+    assert versions[1]["patch"] == [
+        {"op": "add", "path": "/global/core:description", "value": "1"}
+    ]
+    assert versions[1]["annotation_changes"] == {"upsert": [], "delete": []}
+    assert versions[2]["patch"] == []
+    assert versions[2]["annotation_changes"]["upsert"][0]["core:label"] == "2"
+    assert versions[4]["global"]["core:description"] == "3"
+    assert versions[4]["annotations"][0]["core:label"] == "4"
+
+
+@pytest.mark.asyncio
+async def test_api_get_meta_version(client):
+    with mock.patch("database.version_repo.CHECKPOINT_INTERVAL", 4):
+        create_revisions(client, 7)
+    for revision in range(7):
+        response = client.get(f"{url}/versions/{revision}")
+        assert response.status_code == 200
+        metadata = response.json()
+        assert metadata["global"]["traceability:revision"] == revision
+        # descriptions are patched on odd revisions, labels on even ones
+        description = str(revision - 1 + revision % 2) if revision else None
+        assert metadata["global"]["core:description"] == description
+        label = str(revision - revision % 2)
+        assert metadata["annotations"][0]["core:label"] == label
+    response = client.get(f"{url}/versions/7")
+    assert response.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_compact_versions(client):
+    with mock.patch("database.version_repo.CHECKPOINT_INTERVAL", 4):
+        create_revisions(client, 7)
+    expected = client.get(f"{url}/versions/3").json()
+    await version_repo.compact(4)
+    versions = (
+        await db().versions.find({}).sort("global.traceability:revision").to_list(None)
+    )
+    assert [version["global"]["traceability:revision"] for version in versions] == [
+        3,
+        4,
+        5,
+        6,
+    ]
+    assert "annotations" in versions[0]
+    assert client.get(f"{url}/versions/3").json() == expected
+    assert client.get(f"{url}/versions/2").status_code == 404
+    assert client.get(f"{url}/versions/6").status_code == 200
@@ -19,7 +19,10 @@ export class ApiClient implements IQDataClient {
 
     const queryURL = `/api/datasources/${account}/${container}/${file_path}/iqslices`;
 
-    const response = await axios.post(queryURL, body);
+    const response = await axios.post(queryURL, body, {
+      responseType: 'arraybuffer',
+      headers: { Accept: 'application/octet-stream' },
+    });
     if (response.status !== 200) {
       throw new Error(`Unexpected status code: ${response.status}`);
     }
@@ -27,19 +30,21 @@ export class ApiClient implements IQDataClient {
       return null;
     }
 
-    return Promise.all(
-      response.data.map((item) => {
-        const byteCharacters = atob(item.data);
-        const bytes = new Uint8Array(byteCharacters.length);
-        for (let i = 0; i < byteCharacters.length; i++) {
-          bytes[i] = byteCharacters.charCodeAt(i);
-        }
-        const iqArray = convertToFloat32(bytes.buffer, meta.getDataType());
-        console.debug(`getIQDataSlice ${file_path} ${item.index} took:`, performance.now() - startTime, 'ms');
-        let index = item.index;
-        return { index, iqArray };
-      })
-    );
+    // The response is a sequence of frames: uint32 index, uint32 byte count, then the tile bytes
+    const buffer: ArrayBuffer = response.data;
+    const view = new DataView(buffer);
+    const slices: IQDataSlice[] = [];
+    let position = 0;
+    while (position + 8 <= buffer.byteLength) {
+      const index = view.getUint32(position, true);
+      const byteCount = view.getUint32(position + 4, true);
+      position += 8;
+      const iqArray = convertToFloat32(buffer.slice(position, position + byteCount), meta.getDataType());
+      position += byteCount;
+      slices.push({ index, iqArray });
+    }
+    console.debug(`getIQDataSlices ${file_path} ${indexes.length} tiles took:`, performance.now() - startTime, 'ms');
+    return slices;
   }
 
   async getIQDataSlice(meta: SigMFMetadata, index: number, tileSize: number): Promise<IQDataSlice> {
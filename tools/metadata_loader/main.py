@@ -1,6 +1,7 @@
 import argparse
 import json
 import os
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import quote
 
 import requests
@@ -11,6 +12,13 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
+# Metadata files downloaded at once
+DOWNLOAD_WORKERS = 16
+
+# Metadata created by one request, and requests sent at once
+UPLOAD_BATCH_SIZE = 500
+UPLOAD_WORKERS = 4
+
 
 def get_config():
     return {
@@ -101,6 +109,34 @@ def create_meta(accountName: str, containerName: str, filepath: str, document: s
     return resp.status_code
 
 
+def call_create_meta_bulk_api(url, payload):
+    return requests.post(url, json=payload, timeout=300)
+
+
+def create_meta_bulk(accountName: str, containerName: str, items: list):
+    """
+    Create a batch of metadata with one request. Each item holds the
+    file_path and the metadata of a recording. Returns the status of each
+    item, in order.
+    """
+    config = get_config()
+
+    url = (
+        f'{config["API_URL_BASE"]}/api/datasources/{accountName}'
+        f"/{containerName}/meta/bulk"
+    )
+    resp = call_create_meta_bulk_api(url, payload=items)
+    if resp.status_code != 200:
+        return [resp.status_code] * len(items)
+    return [result["status"] for result in resp.json()["results"]]
+
+
+def download_meta(container_client, blob_name: str):
+    blob_client = container_client.get_blob_client(blob=blob_name)
+    downloader = blob_client.download_blob(max_concurrency=1, encoding="UTF-8")
+    return json.loads(downloader.readall())
+
+
 def initial_load_meta(args):
     config = get_config()
 
@@ -114,10 +150,10 @@ def initial_load_meta(args):
     )
 
     blob_list = container_client.list_blobs()
-    blob_names = [x.name for x in blob_list]
+    blob_names = {x.name for x in blob_list}
 
-    overall_response = True
-    for blob_name in blob_names:
+    recordings = []
+    for blob_name in sorted(blob_names):
         basename = os.path.basename(blob_name)
 
         parts = basename.split(".")
@@ -128,27 +164,62 @@ def initial_load_meta(args):
 
         dirname = os.path.dirname(blob_name)
         filename_base = ".".join(parts[0:ext_index])
-        filepath = f"{dirname}/{filename_base}"
+        filepath = f"{dirname}/{filename_base}" if dirname else filename_base
 
         if f"{filepath}.sigmf-data" not in blob_names:
             print(f"Skipping file {basename} because there is no sigmf-data.")
             continue
 
-        blob_client = container_client.get_blob_client(blob=blob_name)
-        downloader = blob_client.download_blob(max_concurrency=1, encoding="UTF-8")
-        blob_text = downloader.readall()
-
-        resp = create_meta(
-            args.accountName, args.containerName, filepath, json.loads(blob_text)
-        )
-
-        print(
-            f"Load of {basename} into the database {'succeeded' if resp==201 else 'failed'}."
-        )
+        recordings.append((blob_name, filepath))
+
+    workers = getattr(args, "workers", None) or DOWNLOAD_WORKERS
+    batch_size = getattr(args, "batchSize", None) or UPLOAD_BATCH_SIZE
+
+    def upload(batch):
+        items = [
+            {"file_path": filepath, "metadata": metadata}
+            for filepath, metadata in batch
+        ]
+        try:
+            statuses = create_meta_bulk(args.accountName, args.containerName, items)
+        except requests.RequestException as e:
+            print(f"Load of {len(items)} metadata into the database failed: {e}")
+            return False
+        for (filepath, _), status in zip(batch, statuses):
+            print(
+                f"Load of {filepath} into the database "
+                f"{'succeeded' if status==201 else 'failed'}."
+            )
+        return all(status == 201 for status in statuses)
 
-        overall_response = overall_response and resp == 201
+    def download(recording):
+        try:
+            return download_meta(container_client, recording[0])
+        except Exception as e:
+            print(f"Load of {recording[1]} into the database failed: {e}")
+            return None
 
-    return overall_response
+    # metadata are downloaded concurrently and uploaded in batches, while the
+    # next ones are downloaded
+    overall_response = True
+    uploads = []
+    with ThreadPoolExecutor(max_workers=workers) as downloads, ThreadPoolExecutor(
+        max_workers=UPLOAD_WORKERS
+    ) as uploaders:
+        batch: list = []
+        documents = downloads.map(download, recordings)
+        for (_, filepath), document in zip(recordings, documents):
+            if document is None:
+                overall_response = False
+                continue
+            batch.append((filepath, document))
+            if len(batch) >= batch_size:
+                uploads.append(uploaders.submit(upload, batch))
+                batch = []
+        if batch:
+            uploads.append(uploaders.submit(upload, batch))
+
+    return all([future.result() for future in uploads]) and overall_response
 
 
 def start():
@@ -193,6 +264,8 @@ def start():
     metadata_addfolder_parser = metadata_subparsers.add_parser("addfolder")
     metadata_addfolder_parser.add_argument("-accountName")
     metadata_addfolder_parser.add_argument("-containerName")
+    metadata_addfolder_parser.add_argument("-workers", type=int)
+    metadata_addfolder_parser.add_argument("-batchSize", type=int)
     metadata_addfolder_parser.set_defaults(func=initial_load_meta)
 
     args = parser.parse_args()
@@ -128,3 +128,44 @@ class TestMetadata(TestCase):
         ret = initial_load_meta(mock_args)
 
         self.assertEqual(ret, True)
+
+    @patch("metadata_loader.main.call_create_meta_bulk_api")
+    @patch("metadata_loader.main.BlobServiceClient", return_value=MockBlobServiceClient)
+    @patch("metadata_loader.main.get_config", return_value=mock_config)
+    def test_initial_load_batches(
+        self, mockConfig, mockBlobServiceClient, mockCallCreateMetaBulkApi
+    ):
+        def mock_bulk_post(url, payload):
+            class MockResponse:
+                status_code = 200
+
+                def json(self):
+                    return {"results": [{"status": 201} for _ in payload]}
+
+            return MockResponse()
+
+        mockCallCreateMetaBulkApi.side_effect = mock_bulk_post
+        names = [f"dir/file{index}" for index in range(5)]
+        blobs = [blob(f"{name}.sigmf-meta") for name in names]
+        blobs += [blob(f"{name}.sigmf-data") for name in names]
+        x = {
+            "accountName": "account",
+            "containerName": "container",
+            "workers": 2,
+            "batchSize": 2,
+        }
+        mock_args = Namespace(**x)
+
+        with patch("metadata_loader.main.download_meta", return_value={}), patch(
+            "metadata_loader.tests.test_unit_metadata.mock_blobs", blobs
+        ):
+            ret = initial_load_meta(mock_args)
+
+        self.assertEqual(ret, True)
+        self.assertEqual(mockCallCreateMetaBulkApi.call_count, 3)
+        uploaded = [
+            item["file_path"]
+            for call in mockCallCreateMetaBulkApi.call_args_list
+            for item in call.kwargs["payload"]
+        ]
+        self.assertEqual(sorted(uploaded), names)